@@ -1,33 +1,29 @@
 '''buy when price decreases, sell when price increases'''
 
-from pandas_datareader import data
+from market_data import load_prices
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
+from strategies import diff_signal
+from vector_backtest import backtest_signals, portfolio_frame
 
 pd.set_option('display.max_columns', 500)
 pd.set_option('display.width', 1000)
 
 start_date = '2014-01-01'
 end_date = '2018-01-01'
-goog_data = data.DataReader('GOOG', 'yahoo', start_date, end_date)
+goog_data = load_prices('GOOG', start_date, end_date)
 
 # signal
-goog_data_signal = pd.DataFrame(index=goog_data.index)
-goog_data_signal['price'] = goog_data['Adj Close']
-goog_data_signal['daily_difference'] = goog_data_signal['price'].diff()
-goog_data_signal['signal'] = 0.0
-goog_data_signal['signal'] = np.where(goog_data_signal['daily_difference'] > 0, 0.0, 1.0) # 0:sell, 1:buy
-goog_data_signal['positions'] = goog_data_signal['signal'].diff()
+goog_data_signal = diff_signal(goog_data['Adj Close'])
 
 # backtesting
 initial_capital = float(1000.0)
 positions = pd.DataFrame(index=goog_data_signal.index).fillna(0.0)
-portfolio = pd.DataFrame(index=goog_data_signal.index).fillna(0.0)
 positions['GOOG'] = goog_data_signal['signal']
-portfolio['positions'] = (positions.multiply(goog_data_signal['price'], axis=0))
-portfolio['cash'] = initial_capital - (positions.diff().multiply(goog_data_signal['price'], axis=0)).cumsum()
-portfolio['total'] = portfolio['positions'] + portfolio['cash']
+results = backtest_signals(goog_data_signal[['price']].set_axis(['GOOG'], axis=1), positions,
+                           initial_capital=initial_capital)
+portfolio = portfolio_frame(results)
 
 # output
 fig = plt.figure()
@@ -5,64 +5,20 @@
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-from pandas_datareader import data
+from market_data import load_prices
+from sup_res import trading_support_resistance
 pd.set_option('display.max_columns', 500)
 pd.set_option('display.width', 1000)
 
 start_date = '2014-01-01'
 end_date = '2018-01-01'
-SRC_DATA_FILENAME = 'goog_data.pkl'
 
 # load data
-try:
-    goog_data = pd.read_pickle(SRC_DATA_FILENAME)
-except FileNotFoundError:
-    goog_data = data.DataReader('GOOG', 'yahoo', start_date, end_date)
-    goog_data.to_pickle(SRC_DATA_FILENAME)
+goog_data = load_prices('GOOG', start_date, end_date)
     
 goog_data_signal = pd.DataFrame(index=goog_data.index)
 goog_data_signal['price'] = goog_data['Adj Close']
 
-def trading_support_resistance(data, bin_width=20):
-    data['sup_tolerance'] = pd.Series(np.zeros(len(data)))
-    data['res_tolerance'] = pd.Series(np.zeros(len(data)))
-    data['sup_count'] = pd.Series(np.zeros(len(data)))
-    data['res_count'] = pd.Series(np.zeros(len(data)))
-    data['sup'] = pd.Series(np.zeros(len(data)))
-    data['res'] = pd.Series(np.zeros(len(data)))
-    data['positions'] = pd.Series(np.zeros(len(data)))
-    data['signal'] = pd.Series(np.zeros(len(data)))
-    in_support = 0
-    in_resistance = 0
-    
-    for x in range((bin_width - 1) + bin_width, len(data)):
-        data_section = data[x - bin_width:x + 1] # from [19] to [39]
-        support_level = min(data_section['price'])
-        resistance_level = max(data_section['price'])
-        range_level = resistance_level - support_level
-        data['res'][x] = resistance_level
-        data['sup'][x] = support_level
-        data['res_tolerance'][x] = resistance_level - 0.2*range_level
-        data['sup_tolerance'][x] = support_level + 0.2*range_level
-        
-        if (data['price'][x] >= data['res_tolerance'][x]) and (data['price'][x] <= data['res'][x]):
-            in_resistance += 1
-            data['res_count'][x] = in_resistance
-        elif (data['price'][x] <= data['sup_tolerance'][x]) and (data['price'][x] >= data['sup'][x]):
-            in_support += 1
-            data['sup_count'][x] = in_support
-        else:
-            in_support = 0
-            in_resistance = 0
-        if in_resistance > 2:
-            data['signal'][x] = 0 # sell
-        elif in_support > 2:
-            data['signal'][x] = 1 # buy
-        else:
-            data['signal'][x] = data['signal'][x - 1]
-            
-    data['positions'] = data['signal'].diff() # 1:sell, -1:buy
-
 trading_support_resistance(goog_data_signal)
 
 fig = plt.figure()
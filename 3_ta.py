@@ -2,21 +2,16 @@ import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import statistics as stats
-from pandas_datareader import data
+from market_data import load_prices
 from collections import deque
 pd.set_option('display.max_columns', 500)
 pd.set_option('display.width', 1000)
 
 start_date = '2014-01-01'
 end_date = '2018-01-01'
-SRC_DATA_FILENAME = 'goog_data.pkl'
 
 # load data
-try:
-    goog_data = pd.read_pickle(SRC_DATA_FILENAME)
-except FileNotFoundError:
-    goog_data = data.DataReader('GOOG', 'yahoo', start_date, end_date)
-    goog_data.to_pickle(SRC_DATA_FILENAME)
+goog_data = load_prices('GOOG', start_date, end_date)
 close_prices = goog_data['Adj Close'].to_list()
 
 # sma
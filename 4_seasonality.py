@@ -3,41 +3,30 @@ import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
 import statistics as stats
-from pandas_datareader import data
+from market_data import load_prices
 from collections import deque
-from statsmodels.tsa.stattools import adfuller
+from seasonality import monthly_return, adf_test
+from rolling_moments import rolling_moments
 pd.set_option('display.max_columns', 500)
 pd.set_option('display.width', 1000)
 
 start_date = '2001-01-01'
 end_date = '2018-01-01'
-SRC_DATA_FILENAME = 'goog_data.pkl'
 
 # load data
-try:
-    goog_data = pd.read_pickle(SRC_DATA_FILENAME)
-except FileNotFoundError:
-    goog_data = data.DataReader('GOOG', 'yahoo', start_date, end_date)
-    goog_data.to_pickle(SRC_DATA_FILENAME)
+goog_data = load_prices('GOOG', start_date, end_date)
 
 # get mean cost per month
-goog_data.reset_index(inplace=True)
-goog_data['pct_change'] = goog_data['Adj Close'].pct_change()
-goog_monthly_return = goog_data[['Date', 'pct_change']].groupby(
-    [goog_data['Date'].dt.year,
-    goog_data['Date'].dt.month]).mean()
-goog_monthly_return.reset_index(level=0, inplace=True)
-goog_monthly_return.drop(columns='Date', axis=1, inplace=True)
-goog_monthly_return.rename(columns={'pct_change': 'monthly_return'}, inplace=True)
-goog_monthly_return.index.names = ['month']
+goog_monthly_return = monthly_return(goog_data)
 #sns.boxplot(data=goog_monthly_return, x=goog_monthly_return.index, y='monthly_return')
 
 # rolling statistics
 def plot_stats(s, windowsize=12):
+    moments = rolling_moments(s, windowsize, stats=('mean', 'std'))
     fig = plt.figure()
     plt.plot(s, color='r', label='original', lw=0.5)
-    plt.plot(s.rolling(windowsize).mean(), color='b', label='rolling mean')
-    plt.plot(s.rolling(windowsize).std(), color='k', label='rolling std')
+    plt.plot(moments['mean'], color='b', label='rolling mean')
+    plt.plot(moments['std'], color='k', label='rolling std')
     plt.legend()
 goog_monthly_return_sequential = goog_monthly_return.reset_index()
 goog_monthly_return_sequential.drop('month', axis=1, inplace=True)
@@ -46,7 +35,8 @@ goog_monthly_return_sequential.drop('month', axis=1, inplace=True)
 
 # determine if there is a unit root --> if the series is non-stationary --> if the series has a non-constant mean&std
 def test_stationarity(s):
-    test = adfuller(s)
-    output = pd.Series(test[0:4], index=['test stat', 'p-value', '# lags used', '# observations used'])
+    test = adf_test(s)
+    output = pd.Series([test['adf_stat'], test['p_value'], test['lags'], test['nobs']],
+                       index=['test stat', 'p-value', '# lags used', '# observations used'])
     print(output)
 test_stationarity(goog_data['Adj Close'])
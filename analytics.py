@@ -0,0 +1,287 @@
+'''performance and risk metrics for batches of backtest results.
+
+Inputs are (time x curves) arrays, one column per equity curve (a sweep
+combination, a symbol, a signal variant), and every metric is reduced
+along axis 0 for all the columns at once: thousands of curves are scored
+with a handful of array ops, no loop over them. A 1-D input is one curve
+and gives scalars back.
+
+positions may carry a trailing symbols axis, (time x curves x symbols)
+with prices (time x symbols), for multi-symbol books; backtest_summary
+does that for the vector_backtest output.
+
+conventions:
+  - returns are simple returns of the equity, NaN on the first bar; pass
+    capital + pnl for the pnl curves of sweep.py and backtest.py
+  - annualised with `periods` bars a year; sharpe and sortino use the
+    population std like sweep.curve_metrics, and are 0 on a flat curve
+  - max_drawdown is the largest fall from a running peak as a fraction of
+    the peak, drawdown_bars the longest stretch below a peak
+  - a trade is a run of bars holding a position on one side, a flip closes
+    it and opens the next. Its pnl is position x price change over the
+    bars held, before costs; one still open on the last bar is marked there
+  - NaN equity (curves padded to a common length) is skipped'''
+
+import numpy as np
+import pandas as pd
+from instrument import probe
+from jit import njit, HAVE_NUMBA
+
+TRADING_DAYS = 252
+
+
+def _as_2d(values):
+    values = np.asarray(values, dtype=np.float64)
+    return (values[:, None], True) if values.ndim == 1 else (values, False)
+
+
+def _out(values, squeeze):
+    return float(values[0]) if squeeze else values
+
+
+def _moments(values):
+    '''count, mean and population std per column, NaN skipped'''
+    valid = ~np.isnan(values)
+    count = valid.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(valid, values, 0).sum(axis=0)/count
+        dev = np.where(valid, values - mean, 0)
+        std = np.sqrt((dev*dev).sum(axis=0)/count)
+    return count, mean, std
+
+
+def _first_last(values):
+    '''first and last non-NaN value per column'''
+    if len(values) == 0:
+        return np.full(values.shape[1], np.nan), np.full(values.shape[1], np.nan)
+    valid = ~np.isnan(values)
+    cols = np.arange(values.shape[1])
+    first = values[np.argmax(valid, axis=0), cols]
+    last = values[len(values) - 1 - np.argmax(valid[::-1], axis=0), cols]
+    return first, last
+
+
+def returns(equity):
+    '''simple returns per bar, NaN on the first one and after a non-positive equity'''
+    eq, squeeze = _as_2d(equity)
+    out = np.full(eq.shape, np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        out[1:] = np.where(eq[:-1] > 0, eq[1:]/eq[:-1] - 1, np.nan)
+    return out[:, 0] if squeeze else out
+
+
+def _risk_adjusted(r, periods, risk_free):
+    '''std, sharpe and sortino per column of a 2-D returns array, one pass
+    over the moments for all three'''
+    count, mean, std = _moments(r)
+    excess = mean - risk_free/periods
+    below = np.fmin(r - risk_free/periods, 0) # NaN skipped
+    with np.errstate(invalid='ignore', divide='ignore'):
+        downside = np.sqrt((below*below).sum(axis=0)/count)
+        sharpe = np.where(std > 0, excess/std*np.sqrt(periods), 0.0)
+        sortino = np.where(downside > 0, excess/downside*np.sqrt(periods), 0.0)
+    return std, sharpe, sortino
+
+
+def sharpe(rets, periods=TRADING_DAYS, risk_free=0.0):
+    '''annualised mean/std of the returns over the risk_free rate (annual)'''
+    r, squeeze = _as_2d(rets)
+    return _out(_risk_adjusted(r, periods, risk_free)[1], squeeze)
+
+
+def sortino(rets, periods=TRADING_DAYS, risk_free=0.0):
+    '''sharpe with the downside deviation: only returns under risk_free count
+    as risk, averaged over all the bars'''
+    r, squeeze = _as_2d(rets)
+    return _out(_risk_adjusted(r, periods, risk_free)[2], squeeze)
+
+
+def drawdowns(equity):
+    '''(drawdown, bars under water) per bar: the fall from the running peak as
+    a fraction of it (NaN while the peak is not positive), and the bars since
+    that peak was set. NaN bars are not counted: a NaN row repeats the count
+    of the last valid one'''
+    eq, squeeze = _as_2d(equity)
+    peak = np.fmax.accumulate(eq, axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        drawdown = np.where(peak > 0, 1 - eq/peak, np.nan)
+    on_peak = eq >= peak
+    # position among the valid bars of each curve
+    rows = np.cumsum(~np.isnan(eq), axis=0)
+    bars = rows - np.maximum.accumulate(np.where(on_peak, rows, 0), axis=0)
+    return (drawdown[:, 0], bars[:, 0]) if squeeze else (drawdown, bars)
+
+
+@njit(cache=True)
+def _drawdown_kernel(eq, depth, longest):
+    '''running peak per column, row by row so the panel is read in memory
+    order. NaN bars are skipped'''
+    n, m = eq.shape
+    peak = np.full(m, np.nan)
+    under = np.zeros(m, dtype=np.int64)
+    for i in range(n):
+        for j in range(m):
+            value = eq[i, j]
+            if value != value:
+                continue
+            if not value < peak[j]: # a new peak, or the first bar
+                peak[j] = value
+                under[j] = 0
+                continue
+            under[j] += 1
+            if under[j] > longest[j]:
+                longest[j] = under[j]
+            if peak[j] > 0 and 1 - value/peak[j] > depth[j]:
+                depth[j] = 1 - value/peak[j]
+
+
+def max_drawdown(equity):
+    '''(deepest drawdown, longest bars under water) per curve'''
+    eq, squeeze = _as_2d(equity)
+    if HAVE_NUMBA:
+        peak = np.fmax.reduce(eq, axis=0, initial=np.nan)
+        depth = np.where(peak > 0, 0.0, np.nan)
+        longest = np.zeros(eq.shape[1], dtype=np.int64)
+        _drawdown_kernel(np.ascontiguousarray(eq), depth, longest)
+    else:
+        drawdown, bars = drawdowns(eq)
+        valid = ~np.isnan(drawdown)
+        depth = np.where(valid.any(axis=0), np.where(valid, drawdown, 0).max(axis=0, initial=0), np.nan)
+        longest = bars.max(axis=0, initial=0)
+    return (float(depth[0]), int(longest[0])) if squeeze else (depth, longest)
+
+
+def _book(positions, prices):
+    '''positions as (time x columns), prices forward filled and broadcastable
+    to them, and the per-curve shape of the columns ((curves,) or (curves,
+    symbols))'''
+    pos = np.asarray(positions, dtype=np.float64)
+    pos = pos[:, None] if pos.ndim == 1 else pos
+    price = np.asarray(prices, dtype=np.float64)
+    price = price[:, None] if price.ndim == 1 else price
+    if np.isnan(price).any():
+        price = pd.DataFrame(price).ffill().to_numpy()
+    shape = pos.shape[1:]
+    if pos.ndim == 3:
+        # columns run curve by curve, the symbols inside each
+        price = np.tile(price, (1, shape[0])) if price.shape[1] == shape[1] else price
+        pos = pos.reshape(len(pos), -1)
+    return np.nan_to_num(pos), price, shape
+
+
+def exposure(positions):
+    '''fraction of the bars holding a position (in any symbol)'''
+    pos = np.nan_to_num(np.asarray(positions, dtype=np.float64))
+    held = pos != 0
+    if held.ndim == 3:
+        held = held.any(axis=2)
+    return held.mean(axis=0) if held.ndim == 2 else float(held.mean())
+
+
+def turnover(positions, prices, equity, periods=TRADING_DAYS):
+    '''annualised traded value over equity: |change in position| x price,
+    summed over the symbols, divided by the equity of the bar'''
+    pos, price, shape = _book(positions, prices)
+    traded = np.abs(np.diff(pos, axis=0, prepend=0.0))*np.nan_to_num(price)
+    traded = traded.reshape((len(pos),) + shape)
+    if traded.ndim == 3:
+        traded = traded.sum(axis=2)
+    eq, squeeze = _as_2d(equity)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ratio = np.where(eq > 0, traded/eq, np.nan)
+    count, mean, _ = _moments(ratio)
+    return _out(mean*periods, squeeze)
+
+
+@probe('pnl')
+def round_trips(positions, prices):
+    '''pnl of every trade, (trades x curves [x symbols]) padded with NaN after
+    the last trade of each column'''
+    pos, price, shape = _book(positions, prices)
+    n, k = pos.shape
+    if n == 0:
+        return np.zeros((0,) + shape)
+    side = np.sign(pos)
+    before = np.concatenate([np.zeros((1, k)), side[:-1]])
+    ids = np.cumsum((side != 0) & (side != before), axis=0) # trade number, 1-based
+    counts = ids[-1]
+    width = int(counts.max()) if k else 0
+    # the move of bar i belongs to the position held into it
+    held = side[:-1] != 0
+    gain = np.nan_to_num(pos[:-1]*np.diff(price, axis=0))
+    cols = np.broadcast_to(np.arange(k), held.shape)
+    flat = (ids[:-1][held] - 1)*k + cols[held]
+    pnl = np.bincount(flat, weights=gain[held], minlength=width*k).reshape(width, k)
+    pnl[np.arange(width)[:, None] >= counts] = np.nan
+    return pnl.reshape((width,) + shape)
+
+
+def trade_stats(trade_pnl):
+    '''per curve, from a padded round_trips array: trades, hit_rate (share of
+    winners), avg_win and avg_loss (a negative number)'''
+    t = np.asarray(trade_pnl, dtype=np.float64)
+    squeeze = t.ndim == 1
+    if squeeze:
+        t = t[:, None]
+    axes = (0,) + tuple(range(2, t.ndim)) # every axis but the curves
+    valid = ~np.isnan(t)
+    wins, losses = t > 0, t < 0
+    trades = valid.sum(axis=axes)
+    n_wins, n_losses = wins.sum(axis=axes), losses.sum(axis=axes)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        stats = {
+            'trades': trades,
+            'hit_rate': n_wins/trades,
+            'avg_win': np.where(wins, t, 0).sum(axis=axes)/n_wins,
+            'avg_loss': np.where(losses, t, 0).sum(axis=axes)/n_losses,
+        }
+    return {key: value[0] for key, value in stats.items()} if squeeze else stats
+
+
+@probe('pnl')
+def summary(equity, positions=None, prices=None, periods=TRADING_DAYS, risk_free=0.0):
+    '''one row per curve: total_return, ann_return, ann_vol, sharpe, sortino,
+    max_drawdown, drawdown_bars and, given positions and prices, exposure,
+    turnover, trades, hit_rate, avg_win, avg_loss. A DataFrame equity gives
+    rows indexed by its columns'''
+    index = equity.columns if isinstance(equity, pd.DataFrame) else None
+    eq, _ = _as_2d(equity)
+    index = pd.RangeIndex(eq.shape[1], name='curve') if index is None else index
+    rets = returns(eq)
+    first, last = _first_last(eq)
+    bars = (~np.isnan(rets)).sum(axis=0)
+    vol, sharpes, sortinos = _risk_adjusted(rets, periods, risk_free)
+    with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+        total = np.where(first > 0, last/first - 1, np.nan)
+        ann_return = np.where(bars > 0, (1 + total)**(periods/np.maximum(bars, 1)) - 1, np.nan)
+    depth, longest = max_drawdown(eq)
+    out = pd.DataFrame({
+        'total_return': total,
+        'ann_return': ann_return,
+        'ann_vol': vol*np.sqrt(periods),
+        'sharpe': sharpes,
+        'sortino': sortinos,
+        'max_drawdown': depth,
+        'drawdown_bars': longest,
+    }, index=index)
+    if positions is not None and prices is not None:
+        pos = np.asarray(positions, dtype=np.float64)
+        pos = pos[:, None] if pos.ndim == 1 else pos
+        out['exposure'] = exposure(pos)
+        out['turnover'] = turnover(pos, prices, eq, periods)
+        for key, value in trade_stats(round_trips(pos, prices)).items():
+            out[key] = value
+    return out
+
+
+def backtest_summary(results, prices, periods=TRADING_DAYS, risk_free=0.0):
+    '''summary of a vector_backtest.backtest_signals result, one row per
+    signal variant'''
+    total = np.asarray(results['total'], dtype=np.float64)
+    positions = np.asarray(results['positions'], dtype=np.float64)
+    if total.ndim == 1:
+        total, positions = total[:, None], positions.reshape(len(total), 1, -1)
+    else:
+        total, positions = total.T, positions.transpose(1, 0, 2)
+    prices = np.asarray(prices, dtype=np.float64)
+    return summary(total, positions, prices.reshape(len(total), -1), periods, risk_free)
@@ -0,0 +1,418 @@
+'''event-driven backtest engine, pulled out of the 7_volatility_adj_strats.py
+loop. A strategy gets one bar at a time through on_bar() and returns the
+signed number of shares to trade; the engine fills at the close, keeps the
+Ledger and writes every bar into preallocated numpy buffers.
+
+A strategy that also has a compiled `step` (an njit function, see Strategy)
+runs entirely inside _engine_kernel: the engine loop, the Ledger updates and
+the strategy callback are one compiled loop over the same buffers, about
+4M bars/s for VolatilityAdjustedAPO against ~130k bars/s through on_bar.
+on_bar stays the path for live.py (one event at a time) and without numba.
+
+apo_backtest() is the same volatility-adjusted APO strategy fused into one
+typed kernel (numba-compiled when available, see jit.py) for sweeps. Both
+take the volatility from rolling_moments: the strategy streams it, the
+kernel gets the whole rolling std as an array.'''
+
+import numpy as np
+import pandas as pd
+from instrument import probe, span, traced
+from jit import njit, HAVE_NUMBA
+from rolling_moments import _N, RollingMoments, RollingState, rolling_push, rolling_std, rolling_var
+
+# parameters (same defaults as 7_volatility_adj_strats.py)
+APO_PARAMS = dict(
+    std_basis=15,
+    std_period=20,
+    num_periods_fast=10,
+    num_periods_slow=40,
+    apo_value_for_buy_entry=-10,
+    apo_value_for_sell_entry=10,
+    min_price_move_from_last_trade=10, # to prevent overtrading
+    min_profit_to_close=10, # min unrealised profit to lock profits
+    num_shares_per_trade=10,
+)
+
+
+class Ledger:
+    '''position and pnl since the last flat. open_pnl marks the whole round
+    trip to market: sells - buys + position*close, which is the matched
+    (realised) part plus the open shares at their average cost'''
+    __slots__ = ('position', 'buy_sum_value', 'sell_sum_value', 'buy_sum_qty', 'sell_sum_qty',
+                 'last_buy_price', 'last_sell_price', 'open_pnl', 'pnl')
+
+    def __init__(self):
+        self.position = 0
+        self.buy_sum_value = 0.0
+        self.sell_sum_value = 0.0
+        self.buy_sum_qty = 0
+        self.sell_sum_qty = 0
+        self.last_buy_price = 0.0
+        self.last_sell_price = 0.0
+        self.open_pnl = 0.0
+        self.pnl = 0.0 # realised pnl so far
+
+    def buy(self, price, qty):
+        self.last_buy_price = price
+        self.position += qty
+        self.buy_sum_value += price*qty
+        self.buy_sum_qty += qty
+
+    def sell(self, price, qty):
+        self.last_sell_price = price
+        self.position -= qty
+        self.sell_sum_value += price*qty
+        self.sell_sum_qty += qty
+
+    def mark(self, price):
+        if self.position == 0:
+            self.pnl += self.sell_sum_value - self.buy_sum_value
+            self.buy_sum_value = self.sell_sum_value = 0.0
+            self.buy_sum_qty = self.sell_sum_qty = 0
+            self.open_pnl = 0.0
+        else:
+            self.open_pnl = self.sell_sum_value - self.buy_sum_value + self.position*price
+
+    @property
+    def total_pnl(self):
+        return self.pnl + self.open_pnl
+
+
+# Ledger fields as a float64 row, for the compiled engine and steps
+LEDGER = Ledger.__slots__
+(_POSITION, _BUY_VALUE, _SELL_VALUE, _BUY_QTY, _SELL_QTY,
+ _LAST_BUY, _LAST_SELL, _OPEN_PNL, _PNL) = range(len(LEDGER))
+_LEDGER_INTS = ('position', 'buy_sum_qty', 'sell_sum_qty')
+
+
+def _ledger_row(ledger):
+    return np.array([getattr(ledger, f) for f in LEDGER], dtype=np.float64)
+
+
+def _ledger_load(ledger, row):
+    for f, value in zip(LEDGER, row.tolist()):
+        setattr(ledger, f, int(value) if f in _LEDGER_INTS else value)
+
+
+class Strategy:
+    '''columns: extra per-bar float64 outputs. The engine allocates them and
+    hands them to on_start(); on_bar(i, close, ledger) writes row i and
+    returns the signed share quantity to trade (0: do nothing).
+
+    step, when set, is the compiled on_bar: an njit function
+    step(i, close, ledger, params, state, record) -> qty, where ledger is the
+    LEDGER row (read only), record the (len(columns) x n) buffer whose rows
+    on_start() got, and (params, state) come from step_args() after
+    on_start(): a float64 array and anything numba takes as an argument,
+    usually a tuple of arrays the step updates in place'''
+    columns = ()
+    step = None
+
+    def on_start(self, record):
+        self.record = record
+
+    def on_bar(self, i, close, ledger):
+        return 0
+
+    def step_args(self):
+        return np.zeros(0), ()
+
+    def on_finish(self, ledger):
+        pass
+
+
+def _empty_results(n, columns=()):
+    results = {
+        'orders': np.zeros(n, dtype=np.int8), # 1 = buy, -1 = sell
+        'position': np.zeros(n, dtype=np.int64),
+        'pnl': np.zeros(n), # realised
+        'open_pnl': np.zeros(n),
+    }
+    for col in columns:
+        results[col] = np.full(n, np.nan)
+    return results
+
+
+@njit(cache=True)
+def _engine_kernel(close, step, params, state, record, ledger, orders, positions, pnls, open_pnls):
+    '''run_backtest\'s loop with the strategy\'s compiled step inlined;
+    ledger is the LEDGER row, updated in place'''
+    for i in range(len(close)):
+        price = close[i]
+        qty = step(i, price, ledger, params, state, record)
+        if qty > 0:
+            # Ledger.buy
+            ledger[_LAST_BUY] = price
+            ledger[_POSITION] += qty
+            ledger[_BUY_VALUE] += price*qty
+            ledger[_BUY_QTY] += qty
+            orders[i] = 1
+        elif qty < 0:
+            # Ledger.sell
+            ledger[_LAST_SELL] = price
+            ledger[_POSITION] += qty
+            ledger[_SELL_VALUE] -= price*qty
+            ledger[_SELL_QTY] -= qty
+            orders[i] = -1
+        # Ledger.mark
+        if ledger[_POSITION] == 0:
+            ledger[_PNL] += ledger[_SELL_VALUE] - ledger[_BUY_VALUE]
+            ledger[_BUY_VALUE] = 0.0
+            ledger[_SELL_VALUE] = 0.0
+            ledger[_BUY_QTY] = 0.0
+            ledger[_SELL_QTY] = 0.0
+            ledger[_OPEN_PNL] = 0.0
+        else:
+            ledger[_OPEN_PNL] = ledger[_SELL_VALUE] - ledger[_BUY_VALUE] + ledger[_POSITION]*price
+        positions[i] = int(ledger[_POSITION])
+        pnls[i] = ledger[_PNL]
+        open_pnls[i] = ledger[_OPEN_PNL]
+
+
+@probe('order')
+def run_backtest(close, strategy, ledger=None):
+    '''runs strategy over the close prices, returns a dict of arrays.
+    Compiled when the strategy has a step and numba is installed'''
+    close = np.asarray(close, dtype=np.float64)
+    n = len(close)
+    results = _empty_results(n, strategy.columns)
+    ledger = ledger if ledger is not None else Ledger()
+    if strategy.step is not None and HAVE_NUMBA:
+        record = np.full((len(strategy.columns), n), np.nan)
+        strategy.on_start(dict(zip(strategy.columns, record)))
+        params, state = strategy.step_args()
+        row = _ledger_row(ledger)
+        with span('_engine_kernel', 'order'):
+            _engine_kernel(np.ascontiguousarray(close), strategy.step, params, state, record, row,
+                           results['orders'], results['position'], results['pnl'], results['open_pnl'])
+        _ledger_load(ledger, row)
+        results.update(zip(strategy.columns, record))
+        strategy.on_finish(ledger)
+        return results
+
+    strategy.on_start({col: results[col] for col in strategy.columns})
+    orders, positions = results['orders'], results['position']
+    pnls, open_pnls = results['pnl'], results['open_pnl']
+    # plain bound methods unless instrument is recording
+    on_bar = traced(strategy.on_bar, 'order')
+    buy = traced(ledger.buy, 'pnl')
+    sell = traced(ledger.sell, 'pnl')
+    mark = traced(ledger.mark, 'pnl')
+
+    for i, price in enumerate(close.tolist()):
+        qty = on_bar(i, price, ledger)
+        if qty > 0:
+            buy(price, qty)
+            orders[i] = 1
+        elif qty < 0:
+            sell(price, -qty)
+            orders[i] = -1
+        mark(price)
+        positions[i] = ledger.position
+        pnls[i] = ledger.pnl
+        open_pnls[i] = ledger.open_pnl
+
+    strategy.on_finish(ledger)
+    return results
+
+
+def results_frame(results, index=None):
+    df = pd.DataFrame(results, index=index)
+    df['total_pnl'] = df['pnl'] + df['open_pnl']
+    return df
+
+
+# volatility-sensitive mean-reversion apo signal
+# sell: apo above threshold and price moved enough since the last sell, or
+#       long and (apo >= 0 or open pnl above the profit target)
+# buy:  apo below threshold and price moved enough since the last buy, or
+#       short and (apo <= 0 or open pnl above the profit target)
+# v_factor = std/STD_BASIS scales the fast ema response, the entry
+# thresholds and the profit target
+
+
+@njit(cache=True)
+def _apo_step(i, close, ledger, params, state, record):
+    '''VolatilityAdjustedAPO.on_bar for the compiled engine. params: k_fast,
+    k_slow, buy_entry, sell_entry, min_move, min_profit, qty, std_basis;
+    state: (emas, rolling sums, rolling window)'''
+    emas, mstate, mwindow = state
+    # rolling std over the last std_period closes: the RollingMoments sums
+    rolling_push(mstate, mwindow, 0, i, close, 2)
+    if mstate[0, _N] == 1:
+        v_factor = 1.0
+    else:
+        v_factor = np.sqrt(rolling_var(mstate, 0))/params[7]
+
+    if emas[0] == 0:
+        emas[0] = close
+        emas[1] = close
+    else:
+        emas[0] = (close - emas[0])*params[0]/v_factor + emas[0]
+        emas[1] = (close - emas[1])*params[1] + emas[1]
+    apo = emas[0] - emas[1]
+    record[0, i] = emas[0]
+    record[1, i] = emas[1]
+    record[2, i] = apo
+    record[3, i] = v_factor
+
+    position = ledger[_POSITION]
+    open_pnl = ledger[_OPEN_PNL]
+    if ((apo >= params[3]*v_factor and abs(close - ledger[_LAST_SELL]) > params[4])
+            or (position > 0 and (apo >= 0 or open_pnl > params[5]/v_factor))):
+        return -params[6]
+    if ((apo < params[2]*v_factor and abs(close - ledger[_LAST_BUY]) > params[4])
+            or (position < 0 and (apo <= 0 or open_pnl > params[5]/v_factor))):
+        return params[6]
+    return 0.0
+
+
+class VolatilityAdjustedAPO(Strategy):
+    columns = ('ema_fast', 'ema_slow', 'apo', 'v_factor')
+    step = staticmethod(_apo_step)
+
+    def __init__(self, **params):
+        p = dict(APO_PARAMS, **params)
+        self.std_basis = p['std_basis']
+        self.std_period = p['std_period']
+        self.k_fast = 2/(p['num_periods_fast'] + 1)
+        self.k_slow = 2/(p['num_periods_slow'] + 1)
+        self.buy_entry = p['apo_value_for_buy_entry']
+        self.sell_entry = p['apo_value_for_sell_entry']
+        self.min_move = p['min_price_move_from_last_trade']
+        self.min_profit = p['min_profit_to_close']
+        self.qty = p['num_shares_per_trade']
+
+    def on_start(self, record):
+        super().on_start(record)
+        self.moments = RollingMoments(self.std_period)
+        self.ema_fast = 0.0
+        self.ema_slow = 0.0
+
+    def step_args(self):
+        params = np.array([self.k_fast, self.k_slow, self.buy_entry, self.sell_entry,
+                           self.min_move, self.min_profit, self.qty, self.std_basis], dtype=np.float64)
+        vol = RollingState(self.std_period)
+        return params, (np.zeros(2), vol.sums, vol.window)
+
+    def on_bar(self, i, close, ledger):
+        # rolling std over the last std_period closes
+        self.moments.update(close)
+        if self.moments.count == 1:
+            v_factor = 1.0
+        else:
+            v_factor = self.moments.std/self.std_basis
+
+        if self.ema_fast == 0:
+            self.ema_fast = close
+            self.ema_slow = close
+        else:
+            self.ema_fast = (close - self.ema_fast)*self.k_fast/v_factor + self.ema_fast
+            self.ema_slow = (close - self.ema_slow)*self.k_slow + self.ema_slow
+        apo = self.ema_fast - self.ema_slow
+        self.record['ema_fast'][i] = self.ema_fast
+        self.record['ema_slow'][i] = self.ema_slow
+        self.record['apo'][i] = apo
+        self.record['v_factor'][i] = v_factor
+
+        position = ledger.position
+        open_pnl = ledger.open_pnl
+        if ((apo >= self.sell_entry*v_factor and abs(close - ledger.last_sell_price) > self.min_move)
+                or (position > 0 and (apo >= 0 or open_pnl > self.min_profit/v_factor))):
+            return -self.qty
+        if ((apo < self.buy_entry*v_factor and abs(close - ledger.last_buy_price) > self.min_move)
+                or (position < 0 and (apo <= 0 or open_pnl > self.min_profit/v_factor))):
+            return self.qty
+        return 0
+
+
+# _apo_kernel state, carried between calls when a series runs in blocks
+APO_STATE = ('ema_fast', 'ema_slow', 'last_buy_price', 'last_sell_price', 'position',
+             'buy_sum_value', 'sell_sum_value', 'open_pnl', 'pnl')
+
+
+@njit(cache=True)
+def _apo_kernel(close, v_factors, k_fast, k_slow, buy_entry, sell_entry,
+                min_move, min_profit, qty, ema_fast_out, ema_slow_out, apo_out,
+                orders, positions, pnls, open_pnls, state):
+    ema_fast = state[0]
+    ema_slow = state[1]
+    last_buy_price = state[2]
+    last_sell_price = state[3]
+    position = int(state[4])
+    buy_sum_value = state[5]
+    sell_sum_value = state[6]
+    open_pnl = state[7]
+    pnl = state[8]
+
+    for i in range(len(close)):
+        price = close[i]
+        v_factor = v_factors[i]
+
+        if ema_fast == 0:
+            ema_fast = price
+            ema_slow = price
+        else:
+            ema_fast = (price - ema_fast)*k_fast/v_factor + ema_fast
+            ema_slow = (price - ema_slow)*k_slow + ema_slow
+        apo = ema_fast - ema_slow
+
+        if ((apo >= sell_entry*v_factor and abs(price - last_sell_price) > min_move)
+                or (position > 0 and (apo >= 0 or open_pnl > min_profit/v_factor))):
+            orders[i] = -1
+            last_sell_price = price
+            position -= qty
+            sell_sum_value += price*qty
+        elif ((apo < buy_entry*v_factor and abs(price - last_buy_price) > min_move)
+                or (position < 0 and (apo <= 0 or open_pnl > min_profit/v_factor))):
+            orders[i] = 1
+            last_buy_price = price
+            position += qty
+            buy_sum_value += price*qty
+
+        if position == 0:
+            pnl += sell_sum_value - buy_sum_value
+            sell_sum_value = 0.0
+            buy_sum_value = 0.0
+            open_pnl = 0.0
+        else:
+            open_pnl = sell_sum_value - buy_sum_value + position*price
+
+        ema_fast_out[i] = ema_fast
+        ema_slow_out[i] = ema_slow
+        apo_out[i] = apo
+        positions[i] = position
+        pnls[i] = pnl
+        open_pnls[i] = open_pnl
+
+    state[0] = ema_fast
+    state[1] = ema_slow
+    state[2] = last_buy_price
+    state[3] = last_sell_price
+    state[4] = position
+    state[5] = buy_sum_value
+    state[6] = sell_sum_value
+    state[7] = open_pnl
+    state[8] = pnl
+
+
+@probe('signal')
+def apo_backtest(close, **params):
+    '''fused VolatilityAdjustedAPO + Ledger; same results as
+    run_backtest(close, VolatilityAdjustedAPO(**params))'''
+    p = dict(APO_PARAMS, **params)
+    close = np.ascontiguousarray(close, dtype=np.float64)
+    results = _empty_results(len(close), VolatilityAdjustedAPO.columns)
+    v_factor = rolling_std(close, int(p['std_period']), min_periods=1)/float(p['std_basis'])
+    v_factor[:1] = 1.0
+    results['v_factor'][:] = v_factor
+    with span('_apo_kernel', 'order'):
+        _apo_kernel(close, results['v_factor'],
+                    2/(p['num_periods_fast'] + 1), 2/(p['num_periods_slow'] + 1),
+                    float(p['apo_value_for_buy_entry']), float(p['apo_value_for_sell_entry']),
+                    float(p['min_price_move_from_last_trade']), float(p['min_profit_to_close']),
+                    int(p['num_shares_per_trade']),
+                    results['ema_fast'], results['ema_slow'], results['apo'],
+                    results['orders'], results['position'], results['pnl'], results['open_pnl'],
+                    np.zeros(len(APO_STATE)))
+    return results
@@ -0,0 +1,266 @@
+'''tick files -> OHLCV bars, streamed in chunks so memory stays bounded by
+the chunk size whatever the file size.
+
+bar types:
+  TimeBars('1min')        fixed clock intervals, labelled with the interval
+                          start (like DataFrame.resample); intervals without
+                          ticks give no bar
+  VolumeBars(10_000)      a bar closes on the tick that takes its traded
+                          size to the threshold
+  DollarBars(5e6)         same on price*size
+Volume and dollar bars are labelled with the time of their last tick.
+
+Every chunk is labelled tick by tick (a numba loop for the threshold bars,
+see jit.py) and reduced with ufunc.reduceat; the last, still open bar is
+carried into the next chunk. The bars come out with the goog_data.pkl
+columns (High, Low, Open, Close, Volume, Adj Close; Adj Close = Close) and
+a 'Date' index, so double_ma, turtle_strat, apo_backtest and the cli take
+them as they are.
+
+usage: python bars.py ticks.csv --time 1min --out bars_1min.csv
+       python bars.py ticks.csv --dollar 5e6 --store ohlcv --symbol GOOG_D5M
+       [--chunk-rows 1000000] [--time-col timestamp] [--price-col price]
+       [--size-col size] [--time-unit ns]'''
+
+import argparse
+import os
+import time
+import numpy as np
+import pandas as pd
+from jit import njit
+
+COLUMNS = ['High', 'Low', 'Open', 'Close', 'Volume', 'Adj Close']
+INDEX_NAME = 'Date'
+CHUNK_ROWS = 1_000_000
+
+
+def read_chunks(path, columns, chunk_rows=CHUNK_ROWS):
+    '''yields DataFrames of `columns`, chunk_rows rows at a time, from a .csv
+    or .parquet file'''
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.parquet':
+        import pyarrow.parquet as pq
+        return (b.to_pandas() for b in pq.ParquetFile(path).iter_batches(
+            batch_size=chunk_rows, columns=columns))
+    return pd.read_csv(path, usecols=columns, chunksize=chunk_rows)
+
+
+def to_ns(ts, time_unit=None):
+    '''int64 UTC ns of a timestamp column: numbers in time_unit (default ns),
+    anything else parsed as dates'''
+    if pd.api.types.is_numeric_dtype(ts):
+        ts = pd.to_datetime(ts, unit=time_unit or 'ns')
+    else:
+        ts = pd.to_datetime(ts, format='ISO8601')
+    if ts.dt.tz is not None:
+        ts = ts.dt.tz_convert('UTC').dt.tz_localize(None)
+    return ts.dt.as_unit('ns').to_numpy().view(np.int64)
+
+
+def read_ticks(path, chunk_rows=CHUNK_ROWS, time_col='timestamp', price_col='price',
+               size_col='size', time_unit=None):
+    '''yields (int64 ns timestamps, float64 prices, float64 sizes) per chunk
+    of a .csv or .parquet tick file. Numeric timestamps are read with
+    time_unit (default ns), anything else is parsed as dates'''
+    for df in read_chunks(path, [time_col, price_col, size_col], chunk_rows):
+        yield (to_ns(df[time_col], time_unit),
+               df[price_col].to_numpy(dtype=np.float64), df[size_col].to_numpy(dtype=np.float64))
+
+
+@njit(cache=True)
+def _threshold_labels(weight, threshold, acc, label, labels):
+    '''labels[i]: bar number of tick i, a bar closing on the tick that takes
+    its accumulated weight to threshold. Returns the carried (acc, label)'''
+    for i in range(len(weight)):
+        labels[i] = label
+        acc += weight[i]
+        if acc >= threshold:
+            label += 1
+            acc = 0.0
+    return acc, label
+
+
+class BarAggregator:
+    '''push() ticks chunk by chunk, get back the bars completed so far;
+    flush() at the end for the last one'''
+
+    def __init__(self):
+        self.partial = None # open bar: label, time, open, high, low, close, volume
+
+    def _labels(self, ts, price, size):
+        raise NotImplementedError
+
+    def _bar_time(self, label, last_ts):
+        raise NotImplementedError
+
+    def push(self, ts, price, size):
+        if len(ts) == 0:
+            return _frame([], [], [], [], [], [])
+        labels = self._labels(ts, price, size)
+        starts = np.flatnonzero(np.r_[True, labels[1:] != labels[:-1]])
+        ends = np.r_[starts[1:], len(labels)] - 1
+        bar_label = labels[starts]
+        bar_time = self._bar_time(bar_label, ts[ends])
+        bar_open = price[starts]
+        bar_high = np.maximum.reduceat(price, starts)
+        bar_low = np.minimum.reduceat(price, starts)
+        bar_close = price[ends]
+        bar_volume = np.add.reduceat(size, starts)
+
+        if self.partial is not None:
+            label, t, o, h, l, c, v = self.partial
+            if bar_label[0] == label:
+                # the open bar goes on in this chunk
+                bar_open[0] = o
+                bar_high[0] = max(h, bar_high[0])
+                bar_low[0] = min(l, bar_low[0])
+                bar_volume[0] += v
+            else:
+                bar_label = np.r_[label, bar_label]
+                bar_time = np.r_[t, bar_time]
+                bar_open = np.r_[o, bar_open]
+                bar_high = np.r_[h, bar_high]
+                bar_low = np.r_[l, bar_low]
+                bar_close = np.r_[c, bar_close]
+                bar_volume = np.r_[v, bar_volume]
+        self.partial = (bar_label[-1], bar_time[-1], bar_open[-1], bar_high[-1],
+                        bar_low[-1], bar_close[-1], bar_volume[-1])
+        return _frame(bar_time[:-1], bar_open[:-1], bar_high[:-1], bar_low[:-1],
+                      bar_close[:-1], bar_volume[:-1])
+
+    def flush(self):
+        if self.partial is None:
+            return _frame([], [], [], [], [], [])
+        _, t, o, h, l, c, v = self.partial
+        self.partial = None
+        return _frame([t], [o], [h], [l], [c], [v])
+
+
+class TimeBars(BarAggregator):
+    def __init__(self, freq='1min'):
+        super().__init__()
+        self.step = pd.Timedelta(freq).value
+
+    def _labels(self, ts, price, size):
+        return ts//self.step
+
+    def _bar_time(self, label, last_ts):
+        return label*self.step
+
+
+class ThresholdBars(BarAggregator):
+    '''bars of `threshold` units of weight(price, size)'''
+
+    def __init__(self, threshold):
+        super().__init__()
+        self.threshold = float(threshold)
+        self.acc = 0.0
+        self.label = 0
+
+    def _weight(self, price, size):
+        raise NotImplementedError
+
+    def _labels(self, ts, price, size):
+        labels = np.empty(len(ts), dtype=np.int64)
+        self.acc, self.label = _threshold_labels(self._weight(price, size), self.threshold,
+                                                 self.acc, self.label, labels)
+        return labels
+
+    def _bar_time(self, label, last_ts):
+        return last_ts
+
+
+class VolumeBars(ThresholdBars):
+    def _weight(self, price, size):
+        return size
+
+
+class DollarBars(ThresholdBars):
+    def _weight(self, price, size):
+        return price*size
+
+
+def _frame(t, o, h, l, c, v):
+    index = pd.DatetimeIndex(np.asarray(t, dtype=np.int64).view('datetime64[ns]'), name=INDEX_NAME)
+    c = np.asarray(c, dtype=np.float64)
+    return pd.DataFrame({'High': np.asarray(h, dtype=np.float64), 'Low': np.asarray(l, dtype=np.float64),
+                         'Open': np.asarray(o, dtype=np.float64), 'Close': c,
+                         'Volume': np.asarray(v, dtype=np.float64), 'Adj Close': c.copy()},
+                        index=index)
+
+
+class CsvBarWriter:
+    '''appends bars to a csv readable with pd.read_csv(path, index_col=0, parse_dates=True)'''
+
+    def __init__(self, path):
+        self.file = open(path, 'w', newline='')
+        self.header = True
+
+    def append(self, bars):
+        bars.to_csv(self.file, header=self.header)
+        self.header = False
+
+    def close(self):
+        self.file.close()
+
+
+def aggregate(chunks, aggregator, writer=None):
+    '''runs tick chunks through aggregator. With a writer (anything with
+    append(bars) and close()) the bars go out as they complete and the
+    count is returned; without one the bars are returned as a DataFrame'''
+    kept = []
+    count = 0
+    for ts, price, size in chunks:
+        bars = aggregator.push(ts, price, size)
+        if writer is None:
+            kept.append(bars)
+        elif len(bars):
+            writer.append(bars)
+        count += len(bars)
+    last = aggregator.flush()
+    count += len(last)
+    if writer is None:
+        return pd.concat(kept + [last])
+    if len(last):
+        writer.append(last)
+    writer.close()
+    return count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='aggregate a tick file into OHLCV bars')
+    parser.add_argument('ticks', help='.csv or .parquet with time, price and size columns')
+    kind = parser.add_mutually_exclusive_group(required=True)
+    kind.add_argument('--time', help='bar interval, e.g. 1s, 1min, 5min')
+    kind.add_argument('--volume', type=float, help='shares per bar')
+    kind.add_argument('--dollar', type=float, help='traded value per bar')
+    parser.add_argument('--out', default=None, help='bars csv')
+    parser.add_argument('--store', default=None, help='ohlcv_store root to write --symbol into')
+    parser.add_argument('--symbol', default=None)
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    parser.add_argument('--time-col', default='timestamp')
+    parser.add_argument('--price-col', default='price')
+    parser.add_argument('--size-col', default='size')
+    parser.add_argument('--time-unit', default=None, help='unit of numeric timestamps (default ns)')
+    args = parser.parse_args()
+
+    if args.time:
+        aggregator = TimeBars(args.time)
+    elif args.volume:
+        aggregator = VolumeBars(args.volume)
+    else:
+        aggregator = DollarBars(args.dollar)
+    if args.store:
+        from ohlcv_store import OHLCVStore
+        if not args.symbol:
+            parser.error('--store needs --symbol')
+        writer = OHLCVStore(args.store).writer(args.symbol, COLUMNS, INDEX_NAME)
+    elif args.out:
+        writer = CsvBarWriter(args.out)
+    else:
+        parser.error('give --out or --store')
+    t0 = time.perf_counter()
+    chunks = read_ticks(args.ticks, args.chunk_rows, args.time_col, args.price_col,
+                        args.size_col, args.time_unit)
+    count = aggregate(chunks, aggregator, writer)
+    print(f'{count} bars in {time.perf_counter() - t0:.2f}s')
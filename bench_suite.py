@@ -0,0 +1,196 @@
+'''benchmark suite and regression gate for the computational core of every
+snippet, headless (no matplotlib). Each case runs on the bundled GOOG
+series and on synthetic 1e5/1e6-bar OHLCV frames (1e7 on request, it takes
+a while); wall time (best of --repeat) and peak traced memory go to
+bench_history.json.
+
+--save-baseline stores the run as the baseline; any later run fails (exit 1)
+when a case is more than --threshold percent slower than its baseline.
+
+usage: python bench_suite.py [--sizes goog,1e5,1e6,1e7] [-k sup_res]
+                             [--threshold 20] [--save-baseline]'''
+
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+import backtest
+import ml_features
+import rolling_moments
+import seasonality
+import strategies
+import sup_res
+import ta_batch
+from jit import HAVE_NUMBA
+
+SRC_DATA_FILENAME = 'goog_data.pkl'
+HISTORY_FILENAME = 'bench_history.json'
+BASELINE_FILENAME = 'bench_baseline.json'
+SIZES = ['goog', '1e5', '1e6']
+
+
+def synthetic_ohlcv(n, seed=0):
+    '''random walk minute bars with the Yahoo column layout'''
+    rng = np.random.default_rng(seed)
+    close = 500 + np.cumsum(rng.normal(0, 0.5, n))
+    open_ = close + rng.normal(0, 0.2, n)
+    spread = np.abs(rng.normal(0, 0.5, n))
+    index = pd.date_range('2000-01-03', periods=n, freq='min', name='Date')
+    return pd.DataFrame({
+        'High': np.maximum(open_, close) + spread,
+        'Low': np.minimum(open_, close) - spread,
+        'Open': open_,
+        'Close': close,
+        'Volume': rng.integers(100, 10000, n).astype(np.float64),
+        'Adj Close': close,
+    }, index=index)
+
+
+def load_size(size):
+    if size == 'goog':
+        return pd.read_pickle(SRC_DATA_FILENAME)
+    return synthetic_ohlcv(int(float(size)))
+
+
+def _ta(fn):
+    return lambda data: fn(data['Adj Close'].to_numpy())
+
+
+# name -> fn(data). Each case copies what it mutates so repeats are equal
+CASES = {
+    'diff_signal': lambda data: strategies.diff_signal(data['Adj Close']),
+    'sup_res': lambda data: sup_res.trading_support_resistance(data[['Adj Close']].rename(columns={'Adj Close': 'price'})),
+    'ta_sma': _ta(ta_batch.sma),
+    'ta_ema': _ta(ta_batch.ema),
+    'ta_apo': _ta(ta_batch.apo),
+    'ta_macd': _ta(ta_batch.macd),
+    'ta_bb': _ta(ta_batch.bollinger_bands),
+    'ta_rsi': _ta(ta_batch.rsi),
+    'ta_std': _ta(ta_batch.std),
+    'ta_mom': _ta(ta_batch.mom),
+    'rolling_moments': lambda data: rolling_moments.rolling_moments(data['Adj Close'].to_numpy(), 20),
+    'seasonality': seasonality.monthly_return,
+    'ml_features': lambda data: (ml_features.pop_regression_y(data.copy()),
+                                 ml_features.pop_classification_y(data.copy())),
+    'double_ma': lambda data: strategies.double_ma(data, 20, 100),
+    'naive_momentum': lambda data: strategies.naive_momentum_trading(data, 5),
+    'turtle': lambda data: strategies.turtle_strat(data, 70, 20),
+    'apo': lambda data: backtest.apo_backtest(data['Close'].to_numpy()),
+    'engine_apo': lambda data: backtest.run_backtest(data['Close'].to_numpy(), backtest.VolatilityAdjustedAPO()),
+}
+
+
+def measure(fn, data, repeat=3, memory=True):
+    fn(data) # warm up (numba compile, imports, caches)
+    best = float('inf')
+    for _ in range(repeat):
+        gc.collect()
+        t0 = time.perf_counter()
+        fn(data)
+        best = min(best, time.perf_counter() - t0)
+    peak = None
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        fn(data)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return best, peak
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(sizes, pattern=None, repeat=3, memory=True):
+    results = {}
+    for size in sizes:
+        data = load_size(size)
+        for name, fn in CASES.items():
+            key = f'{name}@{size}'
+            if pattern and pattern not in key:
+                continue
+            seconds, peak = measure(fn, data, repeat, memory)
+            results[key] = {'seconds': seconds, 'peak_bytes': peak, 'bars': len(data)}
+            peak_mb = f'{peak/2**20:9.1f} MB' if peak is not None else ''
+            print(f'{key:<24} {seconds*1e3:10.2f} ms {peak_mb}', flush=True)
+        del data
+    return results
+
+
+def _load_json(path, default):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+
+
+def _dump_json(path, obj):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(obj, f, indent=1)
+    os.replace(tmp, path)
+
+
+def check_regressions(results, baseline, threshold):
+    '''keys more than threshold percent slower than the baseline'''
+    slower = []
+    for key, res in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        change = (res['seconds']/base['seconds'] - 1)*100
+        if change > threshold:
+            slower.append((key, base['seconds'], res['seconds'], change))
+    return slower
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark suite')
+    parser.add_argument('--sizes', default=','.join(SIZES))
+    parser.add_argument('-k', dest='pattern', default=None, help='only cases whose name@size contains this')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc run')
+    parser.add_argument('--threshold', type=float, default=20.0, help='percent slower that fails')
+    parser.add_argument('--history', default=HISTORY_FILENAME)
+    parser.add_argument('--baseline', default=BASELINE_FILENAME)
+    parser.add_argument('--save-baseline', action='store_true')
+    args = parser.parse_args()
+
+    results = run_suite(args.sizes.split(','), args.pattern, args.repeat, not args.no_memory)
+    run = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'numba': HAVE_NUMBA,
+        'results': results,
+    }
+    history = _load_json(args.history, [])
+    history.append(run)
+    _dump_json(args.history, history)
+
+    if args.save_baseline:
+        baseline = _load_json(args.baseline, {})
+        baseline.update(results)
+        _dump_json(args.baseline, baseline)
+        print(f'baseline saved to {args.baseline}')
+        sys.exit(0)
+
+    slower = check_regressions(results, _load_json(args.baseline, {}), args.threshold)
+    for key, base, now, change in slower:
+        print(f'REGRESSION {key}: {base*1e3:.2f} ms -> {now*1e3:.2f} ms ({change:+.0f}%)')
+    sys.exit(1 if slower else 0)
@@ -0,0 +1,97 @@
+'''benchmark: sup_res.trading_support_resistance vs the per-row loop from
+2_sup_res.py, on goog_data.pkl and a synthetic 10M bar random walk.
+The loop is far too slow for 10M bars so it only runs on the first
+LOOP_MAX_BARS and its time is extrapolated per bar.
+
+usage: python bench_sup_res.py [n_bars] [loop_max_bars]'''
+
+import sys
+import time
+import numpy as np
+import pandas as pd
+from sup_res import trading_support_resistance
+
+SRC_DATA_FILENAME = 'goog_data.pkl'
+N_SYNTHETIC = 10_000_000
+LOOP_MAX_BARS = 20_000
+
+
+# reference: the original loop, with .iat so it still writes on current pandas
+def loop_trading_support_resistance(data, bin_width=20):
+    for col in ['sup_tolerance', 'res_tolerance', 'sup_count', 'res_count',
+                'sup', 'res', 'positions', 'signal']:
+        data[col] = pd.Series(np.zeros(len(data)))
+    c = {col: data.columns.get_loc(col) for col in data.columns}
+    in_support = 0
+    in_resistance = 0
+
+    for x in range((bin_width - 1) + bin_width, len(data)):
+        data_section = data[x - bin_width:x + 1]
+        support_level = min(data_section['price'])
+        resistance_level = max(data_section['price'])
+        range_level = resistance_level - support_level
+        data.iat[x, c['res']] = resistance_level
+        data.iat[x, c['sup']] = support_level
+        data.iat[x, c['res_tolerance']] = resistance_level - 0.2*range_level
+        data.iat[x, c['sup_tolerance']] = support_level + 0.2*range_level
+
+        price = data.iat[x, c['price']]
+        if (price >= data.iat[x, c['res_tolerance']]) and (price <= data.iat[x, c['res']]):
+            in_resistance += 1
+            data.iat[x, c['res_count']] = in_resistance
+        elif (price <= data.iat[x, c['sup_tolerance']]) and (price >= data.iat[x, c['sup']]):
+            in_support += 1
+            data.iat[x, c['sup_count']] = in_support
+        else:
+            in_support = 0
+            in_resistance = 0
+        if in_resistance > 2:
+            data.iat[x, c['signal']] = 0
+        elif in_support > 2:
+            data.iat[x, c['signal']] = 1
+        else:
+            data.iat[x, c['signal']] = data.iat[x - 1, c['signal']]
+
+    data['positions'] = data['signal'].diff()
+    return data
+
+
+def synthetic_prices(n, seed=0):
+    rng = np.random.default_rng(seed)
+    prices = 500 + np.cumsum(rng.normal(0, 1, n))
+    index = pd.date_range('2000-01-01', periods=n, freq='min')
+    return pd.DataFrame({'price': prices}, index=index)
+
+
+def timed(fn, df):
+    t0 = time.perf_counter()
+    out = fn(df)
+    return out, time.perf_counter() - t0
+
+
+def compare(name, df, loop_max):
+    loop_df = df.iloc[:loop_max].copy()
+    loop_out, t_loop = timed(loop_trading_support_resistance, loop_df)
+    fast_sub, _ = timed(trading_support_resistance, df.iloc[:loop_max].copy())
+    fast_out, t_fast = timed(trading_support_resistance, df.copy())
+
+    cols = ['signal', 'positions', 'sup', 'res', 'sup_count', 'res_count']
+    same = all(loop_out[col].equals(fast_sub[col]) for col in cols)
+    loop_per_bar = t_loop/len(loop_df)
+    print(f'{name}: {len(df)} bars')
+    print(f'  loop:   {t_loop:.3f}s on {len(loop_df)} bars ({loop_per_bar*1e6:.1f} us/bar, '
+          f'~{loop_per_bar*len(df):.1f}s extrapolated)')
+    print(f'  vector: {t_fast:.3f}s ({t_fast/len(df)*1e9:.1f} ns/bar)')
+    print(f'  speedup: ~{loop_per_bar*len(df)/t_fast:.0f}x, identical output: {same}')
+    return same
+
+
+if __name__ == '__main__':
+    n_bars = int(sys.argv[1]) if len(sys.argv) > 1 else N_SYNTHETIC
+    loop_max = int(sys.argv[2]) if len(sys.argv) > 2 else LOOP_MAX_BARS
+
+    goog_data = pd.read_pickle(SRC_DATA_FILENAME)
+    goog = pd.DataFrame({'price': goog_data['Adj Close']}, index=goog_data.index)
+    ok = compare('goog_data.pkl', goog, len(goog))
+    ok &= compare('synthetic', synthetic_prices(n_bars), loop_max)
+    sys.exit(0 if ok else 1)
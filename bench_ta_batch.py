@@ -0,0 +1,64 @@
+'''benchmark: ta_batch kernels on a (time x symbols) panel vs a per-symbol
+python loop (the ta_stream objects, one symbol at a time). The loop runs on
+LOOP_SYMBOLS columns and is extrapolated to the full universe.
+
+usage: python bench_ta_batch.py [n_bars] [n_symbols] [loop_symbols]'''
+
+import sys
+import time
+import numpy as np
+import ta_batch
+import ta_stream
+
+N_BARS = 5000
+N_SYMBOLS = 5000
+LOOP_SYMBOLS = 10
+
+KERNELS = [
+    ('sma', ta_batch.sma, ta_stream.SMA),
+    ('ema', ta_batch.ema, ta_stream.EMA),
+    ('apo', ta_batch.apo, ta_stream.APO),
+    ('macd', ta_batch.macd, ta_stream.MACD),
+    ('bb', ta_batch.bollinger_bands, ta_stream.BollingerBands),
+    ('rsi', ta_batch.rsi, ta_stream.RSI),
+    ('std', ta_batch.std, ta_stream.StdDev),
+    ('mom', ta_batch.mom, ta_stream.Momentum),
+]
+
+
+def synthetic_panel(n_bars, n_symbols, seed=0):
+    rng = np.random.default_rng(seed)
+    panel = rng.normal(0, 1, (n_bars, n_symbols))
+    np.cumsum(panel, axis=0, out=panel)
+    panel += 500
+    return panel
+
+
+def per_symbol_loop(indicator, panel):
+    for j in range(panel.shape[1]):
+        ind = indicator()
+        for price in panel[:, j].tolist():
+            ind.update(price)
+
+
+if __name__ == '__main__':
+    n_bars = int(sys.argv[1]) if len(sys.argv) > 1 else N_BARS
+    n_symbols = int(sys.argv[2]) if len(sys.argv) > 2 else N_SYMBOLS
+    loop_symbols = int(sys.argv[3]) if len(sys.argv) > 3 else LOOP_SYMBOLS
+    panel = synthetic_panel(n_bars, n_symbols)
+    cells = n_bars*n_symbols
+    print(f'{n_bars} bars x {n_symbols} symbols')
+
+    for name, kernel, indicator in KERNELS:
+        t0 = time.perf_counter()
+        out = kernel(panel)
+        t_batch = time.perf_counter() - t0
+        del out
+
+        t0 = time.perf_counter()
+        per_symbol_loop(indicator, panel[:, :loop_symbols])
+        t_loop = (time.perf_counter() - t0)/loop_symbols*n_symbols
+
+        print(f'{name:>5}: batch {t_batch:7.2f}s ({cells/t_batch/1e6:7.1f}M cells/s)  '
+              f'loop ~{t_loop:8.1f}s ({cells/t_loop/1e6:5.2f}M cells/s)  '
+              f'{t_loop/t_batch:6.0f}x')
@@ -0,0 +1,458 @@
+'''out-of-core runs: the strategies and rolling indicators over a history
+taken in fixed-size blocks, each block's output written out as soon as it
+is computed.
+
+A runner keeps whatever the next block needs from the previous ones:
+  DiffSignal      last price and signal
+  DoubleMA        the two rolling means, last signal
+  NaiveMomentum   the up/down counter and last close
+  Turtle          last window_entry closes for the high/low band, the
+                  rolling mean, the position
+  SupRes          last bin_width prices, the band counters and signal
+  APO             the rolling std sums, emas and Ledger fields
+  Moments         rolling_moments sums (RollingState), last period values
+step(block) returns the rows the in-memory function (diff_signal,
+double_ma, naive_momentum_trading, turtle_strat,
+trading_support_resistance, apo_backtest, rolling_moments) gives for
+those rows, bit for bit, whatever the block size: rolling max/min are
+recomputed over the carried tail plus the block, rolling means go through
+a copy of pandas' rolling mean (same Kahan sums, so the same roundings)
+and the state machines resume from their carried state.
+
+The state machines and the rolling mean are numba kernels (see jit.py);
+without numba they run as plain python, slow but still exact, except APO
+and Moments, whose in-memory versions then use pandas rolling std.
+Results go to a csv (read it back with float_precision='round_trip' to
+get the same floats) or to an ohlcv_store symbol (StoreSink).
+
+usage: python chunked.py turtle --data goog_data.pkl --chunk-rows 500 --out turtle.csv
+       python chunked.py apo --data ohlcv --symbol GOOG --store-out results --out-symbol GOOG_APO
+       [--column Close] [-p key=value] [--verify]'''
+
+import math
+import numpy as np
+import pandas as pd
+from backtest import (APO_PARAMS, APO_STATE, VolatilityAdjustedAPO, _apo_kernel, _empty_results,
+                      results_frame)
+from jit import njit
+from rolling_moments import STATS, RollingState, rolling_moments, rolling_std
+from strat_kernels import _momentum_kernel, _turtle_kernel, momentum_state
+from sup_res import rolling_sup_res, sup_res_state_machine
+
+CHUNK_ROWS = 100_000
+
+# _roll_mean state
+_SUM, _COMP_ADD, _COMP_REMOVE, _NOBS, _NEG_CT, _SAME, _PREV, _ROWS = range(8)
+
+
+@njit(cache=True)
+def _roll_mean(x, window, min_periods, state, ring, out):
+    '''pandas' rolling mean (roll_mean in window/aggregations.pyx), one
+    value at a time: Kahan sums with separate compensations for the values
+    added and removed, a run of equal values returns the value itself, and
+    the sign is fixed up from the count of negative values. state and ring
+    (the last window values) carry over to the next call'''
+    for i in range(len(x)):
+        r = int(state[_ROWS])
+        val = x[i]
+        if r == 0 or window == 1:
+            for k in range(_PREV):
+                state[k] = 0.0
+            state[_PREV] = val
+        elif r >= window:
+            old = ring[r % window]
+            if old == old:
+                state[_NOBS] -= 1
+                y = -old - state[_COMP_REMOVE]
+                t = state[_SUM] + y
+                state[_COMP_REMOVE] = t - state[_SUM] - y
+                state[_SUM] = t
+                if math.copysign(1.0, old) < 0:
+                    state[_NEG_CT] -= 1
+        if val == val:
+            state[_NOBS] += 1
+            y = val - state[_COMP_ADD]
+            t = state[_SUM] + y
+            state[_COMP_ADD] = t - state[_SUM] - y
+            state[_SUM] = t
+            if math.copysign(1.0, val) < 0:
+                state[_NEG_CT] += 1
+            if val == state[_PREV]:
+                state[_SAME] += 1
+            else:
+                state[_SAME] = 1
+            state[_PREV] = val
+        ring[r % window] = val
+        state[_ROWS] = r + 1
+        nobs = state[_NOBS]
+        if nobs >= min_periods and nobs > 0:
+            res = state[_SUM]/nobs
+            if state[_SAME] >= nobs:
+                res = state[_PREV]
+            elif state[_NEG_CT] == 0 and res < 0:
+                res = 0.0
+            elif state[_NEG_CT] == nobs and res > 0:
+                res = 0.0
+            out[i] = res
+        else:
+            out[i] = np.nan
+
+
+class RollingMean:
+    '''Series.rolling(window, min_periods).mean(), block by block'''
+
+    def __init__(self, window, min_periods=None):
+        self.window = window
+        self.min_periods = window if min_periods is None else min_periods
+        self.state = np.zeros(8)
+        self.ring = np.zeros(window)
+
+    def update(self, values):
+        out = np.empty(len(values))
+        _roll_mean(np.ascontiguousarray(values, dtype=np.float64), self.window, self.min_periods,
+                   self.state, self.ring, out)
+        return out
+
+
+class Tail:
+    '''the last `size` values seen, to put in front of the next block'''
+
+    def __init__(self, size):
+        self.size = size
+        self.values = np.zeros(0)
+
+    def extend(self, values):
+        '''(number of carried values, carried values + values); keeps the new tail'''
+        lead = len(self.values)
+        joined = np.r_[self.values, values]
+        self.values = joined[len(joined) - min(self.size, len(joined)):]
+        return lead, joined
+
+
+def _diff(values, last):
+    '''Series.diff() of values, continuing from last (NaN at the start)'''
+    values = np.asarray(values, dtype=np.float64)
+    return np.r_[values[0] - last, np.diff(values)] if len(values) else values
+
+
+class ChunkedRunner:
+    '''step(block): the output rows for the next block of input rows'''
+    rows = 0 # input rows seen so far
+
+    def step(self, block):
+        raise NotImplementedError
+
+
+class DiffSignal(ChunkedRunner):
+    '''diff_signal(data[column])'''
+
+    def __init__(self, column='Close'):
+        self.column = column
+        self.last_price = np.nan
+        self.last_signal = np.nan
+
+    def step(self, block):
+        signals = pd.DataFrame(index=block.index)
+        signals['price'] = block[self.column]
+        price = signals['price'].to_numpy(dtype=np.float64)
+        signals['daily_difference'] = _diff(price, self.last_price)
+        signal = np.where(signals['daily_difference'] > 0, 0.0, 1.0)
+        signals['signal'] = signal
+        signals['positions'] = _diff(signal, self.last_signal)
+        if len(block):
+            self.last_price, self.last_signal = price[-1], signal[-1]
+        self.rows += len(block)
+        return signals
+
+
+class DoubleMA(ChunkedRunner):
+    '''double_ma(data, short_window, long_window)'''
+
+    def __init__(self, short_window=20, long_window=100, column='Close'):
+        self.short_window = short_window
+        self.column = column
+        self.short_ma = RollingMean(short_window)
+        self.long_ma = RollingMean(long_window)
+        self.last_signal = np.nan
+
+    def step(self, block):
+        close = block[self.column].to_numpy(dtype=np.float64)
+        signals = pd.DataFrame(index=block.index)
+        signals['short_ma'] = self.short_ma.update(close)
+        signals['long_ma'] = self.long_ma.update(close)
+        signal = np.where(signals['short_ma'] > signals['long_ma'], 1.0, 0.0)
+        # the first short_window rows of the whole history
+        signal[:max(self.short_window - self.rows, 0)] = 0.0
+        signals['signal'] = signal
+        signals['orders'] = _diff(signal, self.last_signal)
+        if len(block):
+            self.last_signal = signal[-1]
+        self.rows += len(block)
+        return signals
+
+
+class NaiveMomentum(ChunkedRunner):
+    '''naive_momentum_trading(data, period_len)'''
+
+    def __init__(self, period_len=5, column='Close'):
+        self.period_len = period_len
+        self.column = column
+        self.state = None
+
+    def step(self, block):
+        close = np.ascontiguousarray(block[self.column].to_numpy(dtype=np.float64)[:, None])
+        orders = np.zeros(close.shape)
+        if len(close):
+            if self.state is None:
+                self.state = momentum_state(close)
+            _momentum_kernel(close, self.period_len, orders, self.state)
+        self.rows += len(block)
+        return pd.DataFrame({'orders': orders[:, 0]}, index=block.index)
+
+
+class Turtle(ChunkedRunner):
+    '''turtle_strat(data, window_entry, window_exit)'''
+
+    def __init__(self, window_entry=50, window_exit=25, column='Close'):
+        self.window_entry = window_entry
+        self.column = column
+        self.last_close = np.nan
+        self.prev = Tail(window_entry - 1) # of the shifted closes
+        self.mean = RollingMean(window_exit)
+        self.position = np.zeros(1, dtype=np.int64)
+
+    def step(self, block):
+        close = block[self.column].to_numpy(dtype=np.float64)
+        prev = np.r_[self.last_close, close[:-1]] if len(close) else close
+        lead, joined = self.prev.extend(prev)
+        window = pd.Series(joined).rolling(window=self.window_entry)
+        signals = pd.DataFrame(index=block.index)
+        signals['orders'] = 0
+        signals['high'] = window.max().to_numpy()[lead:]
+        signals['low'] = window.min().to_numpy()[lead:]
+        signals['mean'] = self.mean.update(prev)
+        signals['long_entry'] = close > signals['high'].to_numpy()
+        signals['short_entry'] = close < signals['low'].to_numpy()
+        signals['long_exit'] = close < signals['mean'].to_numpy()
+        signals['short_exit'] = close > signals['mean'].to_numpy()
+        orders = np.zeros((len(close), 1), dtype=np.int64)
+        if len(close):
+            flags = [np.ascontiguousarray(signals[col].to_numpy()[:, None]) for col in
+                     ('long_entry', 'short_entry', 'long_exit', 'short_exit')]
+            _turtle_kernel(*flags, orders, self.position)
+            self.last_close = close[-1]
+        signals['orders'] = orders[:, 0]
+        self.rows += len(block)
+        return signals
+
+
+class SupRes(ChunkedRunner):
+    '''trading_support_resistance on block[[column]] renamed to price.
+    The warm-up rows hold 0 when the input has a RangeIndex, NaN otherwise,
+    as the in-memory function leaves them on a 0-based RangeIndex and on a
+    DatetimeIndex'''
+    columns = ['sup_tolerance', 'res_tolerance', 'sup_count', 'res_count',
+               'sup', 'res', 'positions', 'signal']
+
+    def __init__(self, bin_width=20, column='price'):
+        self.bin_width = bin_width
+        self.column = column
+        self.start = (bin_width - 1) + bin_width
+        self.prices = Tail(bin_width)
+        self.counts = (0, 0)
+        self.last_signal = np.nan
+
+    def step(self, block):
+        data = block[[self.column]].rename(columns={self.column: 'price'})
+        fill = 0.0 if isinstance(block.index, pd.RangeIndex) else np.nan
+        cols = {col: np.full(len(block), fill) for col in self.columns}
+        price = data['price'].to_numpy(dtype=np.float64)
+        lead, joined = self.prices.extend(price)
+        a = max(self.start - self.rows, 0) # first row past the warm-up
+        if a < len(block):
+            sup, res, sup_tol, res_tol = (b[lead + a:] for b in rolling_sup_res(joined, self.bin_width))
+            in_res, in_sup, in_resistance, in_support, signal = sup_res_state_machine(
+                price[a:], sup, res, sup_tol, res_tol, self.last_signal if a == 0 else fill, self.counts)
+            for col, values in [('res', res), ('sup', sup), ('res_tolerance', res_tol),
+                                ('sup_tolerance', sup_tol), ('signal', signal)]:
+                cols[col][a:] = values
+            for col, hit, count in [('res_count', in_res, in_resistance), ('sup_count', in_sup, in_support)]:
+                cols[col][a:] = np.where(hit, count, cols[col][a:])
+            self.counts = (in_resistance[-1], in_support[-1])
+        cols['positions'] = _diff(cols['signal'], self.last_signal)
+        for col in self.columns:
+            data[col] = cols[col]
+        if len(block):
+            self.last_signal = cols['signal'][-1]
+        self.rows += len(block)
+        return data
+
+
+class APO(ChunkedRunner):
+    '''results_frame(apo_backtest(block[column], **params))'''
+
+    def __init__(self, column='Close', **params):
+        self.column = column
+        self.p = p = dict(APO_PARAMS, **params)
+        self.std = RollingState(int(p['std_period']))
+        self.state = np.zeros(len(APO_STATE))
+
+    def step(self, block):
+        p = self.p
+        close = np.ascontiguousarray(block[self.column].to_numpy(), dtype=np.float64)
+        results = _empty_results(len(close), VolatilityAdjustedAPO.columns)
+        v_factor = rolling_std(close, int(p['std_period']), min_periods=1, state=self.std)/float(p['std_basis'])
+        if self.rows == 0:
+            v_factor[:1] = 1.0
+        results['v_factor'][:] = v_factor
+        _apo_kernel(close, results['v_factor'],
+                    2/(p['num_periods_fast'] + 1), 2/(p['num_periods_slow'] + 1),
+                    float(p['apo_value_for_buy_entry']), float(p['apo_value_for_sell_entry']),
+                    float(p['min_price_move_from_last_trade']), float(p['min_profit_to_close']),
+                    int(p['num_shares_per_trade']),
+                    results['ema_fast'], results['ema_slow'], results['apo'],
+                    results['orders'], results['position'], results['pnl'], results['open_pnl'],
+                    self.state)
+        self.rows += len(block)
+        return results_frame(results, index=block.index)
+
+
+class Moments(ChunkedRunner):
+    '''pd.DataFrame(rolling_moments(block[column], period, min_periods, stats))'''
+
+    def __init__(self, period=20, min_periods=None, stats=STATS, column='Close'):
+        self.period = period
+        self.min_periods = min_periods
+        self.stats = tuple(stats)
+        self.column = column
+        self.sums = tuple(s for s in self.stats if s not in ('min', 'max'))
+        self.extremes = tuple(s for s in self.stats if s in ('min', 'max'))
+        self.state = RollingState(period)
+        self.values = Tail(period - 1)
+
+    def step(self, block):
+        x = block[self.column].to_numpy(dtype=np.float64)
+        out = {}
+        if self.sums:
+            out.update(rolling_moments(x, self.period, self.min_periods, self.sums, self.state))
+        lead, joined = self.values.extend(x)
+        if self.extremes:
+            out.update((s, v[lead:]) for s, v in
+                       rolling_moments(joined, self.period, self.min_periods, self.extremes).items())
+        self.rows += len(block)
+        return pd.DataFrame({s: out[s] for s in self.stats}, index=block.index)
+
+
+RUNNERS = {
+    'diff': DiffSignal,
+    'double_ma': DoubleMA,
+    'naive_momentum': NaiveMomentum,
+    'turtle': Turtle,
+    'sup_res': SupRes,
+    'apo': APO,
+    'moments': Moments,
+}
+
+
+def frame_blocks(data, chunk_rows=CHUNK_ROWS):
+    for a in range(0, len(data), chunk_rows):
+        yield data.iloc[a:a + chunk_rows]
+
+
+def store_blocks(store, symbol, chunk_rows=CHUNK_ROWS, columns=None, start=None, end=None):
+    '''blocks of an ohlcv_store symbol; only the block being yielded is read
+    off the memory maps'''
+    arrays = store.read_arrays(symbol, start, end, columns)
+    ts = arrays.pop('_index')
+    name = store.meta(symbol)['index_name']
+    for a in range(0, len(ts), chunk_rows):
+        index = pd.DatetimeIndex(np.array(ts[a:a + chunk_rows]).view('datetime64[ns]'), name=name)
+        yield pd.DataFrame({col: np.array(v[a:a + chunk_rows]) for col, v in arrays.items()}, index=index)
+
+
+class StoreSink:
+    '''run_chunked writer into an ohlcv_store symbol; the columns are taken
+    from the first block'''
+
+    def __init__(self, store, symbol):
+        self.store = store
+        self.symbol = symbol
+        self.writer = None
+
+    def append(self, df):
+        if self.writer is None:
+            self.writer = self.store.writer(self.symbol, df.columns, df.index.name)
+        self.writer.append(df)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+def run_chunked(blocks, runner, writer=None):
+    '''steps runner through the blocks. With a writer (anything with
+    append(df) and close(), e.g. bars.CsvBarWriter or StoreSink) every
+    block's output goes out as soon as it is computed and the row count is
+    returned; without one the outputs are returned as one DataFrame'''
+    kept = []
+    count = 0
+    for block in blocks:
+        out = runner.step(block)
+        if writer is None:
+            kept.append(out)
+        elif len(out):
+            writer.append(out)
+        count += len(out)
+    if writer is None:
+        return pd.concat(kept) if kept else pd.DataFrame()
+    writer.close()
+    return count
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+    from bars import CsvBarWriter
+    from cli import STRATEGIES, load_data, parse_params, run_indicator
+    from ohlcv_store import OHLCVStore
+
+    parser = argparse.ArgumentParser(description='run a strategy or rolling_moments block by block')
+    parser.add_argument('name', choices=sorted(RUNNERS))
+    parser.add_argument('--data', default='goog_data.pkl', help='data file or store directory')
+    parser.add_argument('--symbol', default=None, help='symbol when --data is a store')
+    parser.add_argument('--column', default='Close')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    parser.add_argument('-p', '--param', action='append', help='key=value, repeatable')
+    parser.add_argument('--out', default=None, help='results csv')
+    parser.add_argument('--store-out', default=None, help='ohlcv_store root to write --out-symbol into')
+    parser.add_argument('--out-symbol', default=None)
+    parser.add_argument('--verify', action='store_true', help='compare with the in-memory run')
+    args = parser.parse_args()
+
+    params = parse_params(args.param)
+    runner = RUNNERS[args.name](column=args.column, **params)
+    if args.store_out:
+        if not args.out_symbol:
+            parser.error('--store-out needs --out-symbol')
+        writer = StoreSink(OHLCVStore(args.store_out), args.out_symbol)
+    elif args.out:
+        writer = CsvBarWriter(args.out)
+    else:
+        writer = None
+    if args.symbol:
+        blocks = store_blocks(OHLCVStore(args.data), args.symbol, args.chunk_rows)
+    else:
+        blocks = frame_blocks(load_data(args.data), args.chunk_rows)
+    t0 = time.perf_counter()
+    result = run_chunked(blocks, runner, writer)
+    count = result if writer is not None else len(result)
+    print(f'{count} rows in {time.perf_counter() - t0:.2f}s')
+    if args.verify:
+        if writer is not None:
+            parser.error('--verify keeps the result in memory, drop --out/--store-out')
+        data = load_data(args.data, args.symbol)
+        if args.name == 'moments':
+            expected = run_indicator('moments', data, args.column, **params)
+        else:
+            expected = STRATEGIES[args.name](data, args.column, **params)
+        print('identical' if result.equals(expected) else 'DIFFERENT')
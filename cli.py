@@ -0,0 +1,251 @@
+'''headless entry point for the snippets: runs a strategy or an indicator on
+a data file and writes the result as csv, parquet or json. Nothing heavy is
+imported at module level; numpy/pandas, numba (through jit.py), matplotlib
+and sklearn load inside the subcommand that needs them.
+
+usage:
+    python -m cli list
+    python -m cli strategy turtle --data goog_data.pkl -p window_entry=50 --out turtle.parquet
+    python -m cli indicator macd --column 'Adj Close' --out macd.csv
+    python -m cli walkforward --models linear,ridge --out wf.json
+    python -m cli --import-time strategy apo
+
+data: a .pkl/.csv/.parquet file, or an ohlcv_store directory with --symbol.
+--plot file.png saves a chart with the Agg backend (no display needed).
+--import-time reruns the command under python -X importtime and reports
+the import cost per top-level package. --trace PREFIX records the
+instrument.py probes and writes PREFIX.folded plus a per-stage table.'''
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+SRC_DATA_FILENAME = 'goog_data.pkl'
+
+
+# strategies: name -> fn(data, column, **params) -> DataFrame indexed like data
+
+def _close_frame(data, column):
+    return data[[column]].rename(columns={column: 'Close'})
+
+
+def _diff(data, column):
+    from strategies import diff_signal
+    return diff_signal(data[column])
+
+
+def _sup_res(data, column, bin_width=20):
+    from sup_res import trading_support_resistance
+    return trading_support_resistance(data[[column]].rename(columns={column: 'price'}), bin_width)
+
+
+def _double_ma(data, column, short_window=20, long_window=100):
+    from strategies import double_ma
+    return double_ma(_close_frame(data, column), short_window, long_window)
+
+
+def _naive_momentum(data, column, period_len=5):
+    from strategies import naive_momentum_trading
+    return naive_momentum_trading(_close_frame(data, column), period_len)
+
+
+def _turtle(data, column, window_entry=50, window_exit=25):
+    from strategies import turtle_strat
+    return turtle_strat(_close_frame(data, column), window_entry, window_exit)
+
+
+def _apo(data, column, **params):
+    from backtest import apo_backtest, results_frame
+    return results_frame(apo_backtest(data[column].to_numpy(), **params), index=data.index)
+
+
+STRATEGIES = {
+    'diff': _diff,
+    'sup_res': _sup_res,
+    'double_ma': _double_ma,
+    'naive_momentum': _naive_momentum,
+    'turtle': _turtle,
+    'apo': _apo,
+}
+
+
+# indicators: name -> (ta_batch function, output column names)
+INDICATORS = {
+    'sma': ('sma', ('sma',)),
+    'ema': ('ema', ('ema',)),
+    'apo': ('apo', ('apo',)),
+    'macd': ('macd', ('macd', 'signal', 'histogram')),
+    'bollinger': ('bollinger_bands', ('mid', 'upper', 'lower')),
+    'rsi': ('rsi', ('rsi',)),
+    'std': ('std', ('std',)),
+    'mom': ('mom', ('mom',)),
+    'moments': (None, ()),
+}
+
+
+def run_indicator(name, data, column, **params):
+    import pandas as pd
+    price = data[column]
+    if name == 'moments':
+        from rolling_moments import rolling_moments
+        return pd.DataFrame(rolling_moments(price, params.pop('period', 20), **params))
+    import ta_batch
+    fn_name, names = INDICATORS[name]
+    values = getattr(ta_batch, fn_name)(price.to_numpy(), **params)
+    values = values if isinstance(values, tuple) else (values,)
+    return pd.DataFrame({n: v[:, 0] for n, v in zip(names, values)}, index=data.index)
+
+
+def run_walkforward(data, models, train, test, expanding):
+    from walk_forward import walk_forward
+    return walk_forward(data, train=train, test=test, expanding=expanding, models=models)
+
+
+def load_data(path, symbol=None, start=None, end=None):
+    import pandas as pd
+    if os.path.isdir(path):
+        from ohlcv_store import OHLCVStore
+        if symbol is None:
+            raise SystemExit(f'{path} is a store directory, pass --symbol')
+        return OHLCVStore(path).read(symbol, start, end)
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.csv':
+        data = pd.read_csv(path, index_col=0, parse_dates=True)
+    elif ext == '.parquet':
+        data = pd.read_parquet(path)
+    else:
+        data = pd.read_pickle(path)
+    return data.loc[start:end] if start or end else data
+
+
+def write_result(df, out):
+    '''csv, parquet or json by extension; csv on stdout when out is None'''
+    if out is None:
+        try:
+            df.to_csv(sys.stdout)
+        except BrokenPipeError: # piped into head and the reader went away
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return
+    ext = os.path.splitext(out)[1].lower()
+    if ext == '.parquet':
+        df.to_parquet(out)
+    elif ext == '.json':
+        df.to_json(out, orient='table', date_format='iso', indent=1)
+    else:
+        df.to_csv(out)
+
+
+def save_plot(df, data, column, path):
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib import pyplot as plt
+    numeric = df.select_dtypes('number')
+    fig, axes = plt.subplots(2, 1, sharex=True, figsize=(12, 8))
+    data[column].plot(ax=axes[0], lw=0.8, color='k', label=column)
+    if 'orders' in numeric:
+        for value, marker, color in ((1, '^', 'g'), (-1, 'v', 'r')):
+            hits = numeric['orders'] == value
+            axes[0].plot(data.index[hits], data[column][hits], lw=0, marker=marker, color=color)
+    numeric.drop(columns=[c for c in ('orders', 'signal', 'positions') if c in numeric]).plot(ax=axes[1], lw=0.8)
+    axes[0].legend()
+    fig.savefig(path)
+    plt.close(fig)
+
+
+def parse_params(pairs):
+    params = {}
+    for pair in pairs or ():
+        key, value = pair.split('=', 1)
+        for cast in (int, float):
+            try:
+                value = cast(value)
+                break
+            except ValueError:
+                pass
+        params[key] = value
+    return params
+
+
+def import_time_report(argv, top=15):
+    '''runs argv under -X importtime and prints self time per top-level package'''
+    t0 = time.perf_counter()
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-m', 'cli'] + argv,
+                          stderr=subprocess.PIPE, text=True)
+    wall = time.perf_counter() - t0
+    per_package, errors = {}, []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:'):
+            errors.append(line)
+            continue
+        fields = line[len('import time:'):].split('|')
+        if not fields[0].strip().isdigit():
+            continue # header
+        package = fields[2].strip().split('.')[0]
+        per_package[package] = per_package.get(package, 0) + int(fields[0])
+    for line in errors:
+        print(line, file=sys.stderr)
+    total = sum(per_package.values())/1e6
+    print(f'\nimport time {total:.3f}s of {wall:.3f}s wall', file=sys.stderr)
+    for package, us in sorted(per_package.items(), key=lambda kv: -kv[1])[:top]:
+        print(f'  {package:<24} {us/1e3:9.1f} ms {us/1e4/wall:6.1f}%', file=sys.stderr)
+    return proc.returncode
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    parser = argparse.ArgumentParser(prog='python -m cli', description='run a snippet headless')
+    parser.add_argument('--import-time', action='store_true', help='report where startup time goes')
+    parser.add_argument('--trace', default=None, metavar='PREFIX',
+                        help='time the indicator/signal/order/pnl probes, write PREFIX.folded')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    sub.add_parser('list', help='strategies and indicators')
+    strategy = sub.add_parser('strategy', help='signals / backtest of a strategy')
+    strategy.add_argument('name', choices=sorted(STRATEGIES))
+    indicator = sub.add_parser('indicator', help='an indicator series')
+    indicator.add_argument('name', choices=sorted(INDICATORS))
+    walk = sub.add_parser('walkforward', help='walk-forward ML metrics (needs sklearn for lasso/knn/svc)')
+    walk.add_argument('--models', default='linear,ridge')
+    walk.add_argument('--train', type=int, default=500)
+    walk.add_argument('--test', type=int, default=100)
+    walk.add_argument('--expanding', action='store_true')
+    for p in (strategy, indicator, walk):
+        p.add_argument('--data', default=SRC_DATA_FILENAME, help='data file or store directory')
+        p.add_argument('--symbol', default=None, help='symbol when --data is a store')
+        p.add_argument('--start', default=None)
+        p.add_argument('--end', default=None)
+        p.add_argument('--out', default=None, help='.csv, .parquet or .json (csv to stdout if omitted)')
+    for p in (strategy, indicator):
+        p.add_argument('--column', default='Close')
+        p.add_argument('-p', '--param', action='append', help='key=value, repeatable')
+        p.add_argument('--plot', default=None, help='save a chart to this file')
+    args = parser.parse_args(argv)
+
+    if args.import_time:
+        return import_time_report([a for a in argv if a != '--import-time'])
+    if args.cmd == 'list':
+        print('strategies:', ' '.join(sorted(STRATEGIES)))
+        print('indicators:', ' '.join(sorted(INDICATORS)))
+        return 0
+
+    if args.trace:
+        import instrument
+        instrument.enable(allocations=True)
+    data = load_data(args.data, args.symbol, args.start, args.end)
+    if args.cmd == 'walkforward':
+        result = run_walkforward(data, args.models.split(','), args.train, args.test, args.expanding)
+    elif args.cmd == 'strategy':
+        result = STRATEGIES[args.name](data, args.column, **parse_params(args.param))
+    else:
+        result = run_indicator(args.name, data, args.column, **parse_params(args.param))
+    write_result(result, args.out)
+    if getattr(args, 'plot', None):
+        save_plot(result, data, args.column, args.plot)
+    if args.trace:
+        instrument.report(args.trace)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
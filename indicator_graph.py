@@ -0,0 +1,389 @@
+'''the ta_batch indicators as a dependency graph with a memo cache, so
+indicators that share a piece compute it once: APO and MACD read the same
+fast/slow emas, Bollinger bands the same sma and std as the plain ones.
+
+Every node declares its inputs (other nodes or the prices) and its
+parameters; its key is built from both, e.g. 'ema(price;time_period=10)'.
+Results are cached per (key, fingerprint of the prices), the fingerprint
+being a blake2b of the price bytes, so the same prices loaded twice hit
+the same entries.
+
+    graph = IndicatorGraph(close, IndicatorCache(max_bytes=256 << 20, directory='.ta_cache'))
+    fast_apo = graph.get('apo')
+    macd, signal, histogram = graph.get('macd')    # emas come from the cache
+    graph.append(new_close)                        # next get() extends
+    graph.get('apo')
+
+IndicatorCache keeps entries in memory up to max_bytes (least recently
+used dropped first) and, with a directory, also as .npy files there (their
+own LRU bound, max_disk_bytes), so another process starting from the same
+prices picks them up.
+
+appending: a node whose cached values cover a prefix of the prices is
+extended over the new bars instead of recomputed. emas go on from their
+last value and give exactly the full-run numbers; the windowed nodes (sma,
+std, rsi, mom) are recomputed over their last window of bars plus the new
+ones. Those agree with the full run to float precision but not bit for
+bit, as pandas' running window sums carry rounding from the first bar; and
+they are recomputed from the start when that window has a NaN, since
+their warm-up rules count from the first valid price. Element-wise nodes
+only compute the new rows.
+The prefix is found from what the cache holds, so a new graph over a
+longer history extends yesterday's disk entries as well.
+
+Cached arrays are shared: they come back read-only.'''
+
+import hashlib
+import os
+import time
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import ta_batch
+
+CACHE_DIR = '.ta_cache'
+MAX_CACHE_BYTES = 256 << 20
+
+
+class Node:
+    '''one indicator output. inputs: Nodes; params: keyword parameters.
+    warmup: rows of history an extension needs before the new rows
+    (0 for element-wise nodes)'''
+    kind = None
+    warmup = 0
+
+    def __init__(self, *inputs, **params):
+        self.inputs = inputs
+        self.params = params
+        args = ','.join(i.key for i in inputs)
+        values = ','.join(f'{k}={v!r}' for k, v in sorted(params.items()))
+        self.key = f'{self.kind}({args};{values})'
+
+    def compute(self, *arrays):
+        raise NotImplementedError
+
+    def extend(self, cached, arrays):
+        '''values for the rows after len(cached), given the cached values and
+        the full input arrays; None to recompute from the start'''
+        start = len(cached)
+        if self.warmup == 0:
+            return self.compute(*(a[start:] for a in arrays))
+        lo = max(start - self.warmup, 0)
+        if lo > 0 and any(np.isnan(a[lo:start]).any() for a in arrays):
+            return None
+        return self.compute(*(a[lo:] for a in arrays))[start - lo:]
+
+    def __repr__(self):
+        return self.key
+
+
+class Price(Node):
+    kind = 'price'
+
+    def __init__(self):
+        self.inputs = ()
+        self.params = {}
+        self.key = 'price'
+
+
+class EMA(Node):
+    kind = 'ema'
+
+    def compute(self, a):
+        return ta_batch._ema_rows(a, 2/(self.params['time_period'] + 1))
+
+    def extend(self, cached, arrays):
+        # the ema state is the last value on a valid bar (0 before the first)
+        valid = ~np.isnan(cached)
+        seen = valid.any(axis=0)
+        last = len(cached) - 1 - np.argmax(valid[::-1], axis=0)
+        state = np.where(seen, cached[last, np.arange(cached.shape[1])], 0.0)
+        return ta_batch._ema_rows(arrays[0][len(cached):], 2/(self.params['time_period'] + 1), state)
+
+
+class SMA(Node):
+    kind = 'sma'
+
+    def __init__(self, src, time_period):
+        super().__init__(src, time_period=time_period)
+        self.warmup = time_period
+
+    def compute(self, a):
+        return ta_batch.sma(a, self.params['time_period'])
+
+
+class Std(SMA):
+    kind = 'std'
+
+    def compute(self, a):
+        return ta_batch.std(a, self.params['time_period'])
+
+
+class RSI(SMA):
+    kind = 'rsi'
+
+    def compute(self, a):
+        return ta_batch.rsi(a, self.params['time_period'])
+
+
+class Mom(SMA):
+    kind = 'mom'
+
+    def compute(self, a):
+        return ta_batch.mom(a, self.params['time_period'])
+
+
+class Sub(Node):
+    kind = 'sub'
+
+    def compute(self, a, b):
+        return a - b
+
+
+class Band(Node):
+    '''mid + std_factor*dev (side=1) or mid - std_factor*dev (side=-1)'''
+    kind = 'band'
+
+    def compute(self, mid, dev):
+        band = self.params['std_factor']*dev
+        return mid + band if self.params['side'] > 0 else mid - band
+
+
+PRICE = Price()
+
+
+def _apo(price, time_period_fast, time_period_slow):
+    return Sub(EMA(price, time_period=time_period_fast), EMA(price, time_period=time_period_slow))
+
+
+def _macd(price, time_period_fast=10, time_period_slow=40, time_period_macd=20):
+    macd = _apo(price, time_period_fast, time_period_slow)
+    signal = EMA(macd, time_period=time_period_macd)
+    return macd, signal, Sub(macd, signal)
+
+
+def _bollinger_bands(price, time_period=20, std_factor=2):
+    mid = SMA(price, time_period)
+    dev = Std(price, time_period)
+    return (mid, Band(mid, dev, std_factor=std_factor, side=1),
+            Band(mid, dev, std_factor=std_factor, side=-1))
+
+
+# ta_batch name -> fn(price node, **params) -> node or tuple of nodes,
+# same parameters and defaults as the ta_batch function
+INDICATORS = {
+    'sma': lambda price, time_period=20: SMA(price, time_period),
+    'ema': lambda price, time_period=20: EMA(price, time_period=time_period),
+    'apo': lambda price, time_period_fast=10, time_period_slow=40: _apo(price, time_period_fast, time_period_slow),
+    'macd': _macd,
+    'std': lambda price, time_period=20: Std(price, time_period),
+    'bollinger_bands': _bollinger_bands,
+    'rsi': lambda price, time_period=20: RSI(price, time_period),
+    'mom': lambda price, time_period=20: Mom(price, time_period),
+}
+
+
+class IndicatorCache:
+    '''(node key, price fingerprint) -> values, LRU bounded by bytes, with an
+    optional directory of .npy files behind it'''
+
+    def __init__(self, max_bytes=MAX_CACHE_BYTES, directory=None, max_disk_bytes=4*MAX_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.entries = OrderedDict()
+        self.lengths = {} # node key -> {fingerprint: rows} of the memory entries
+        self.nbytes = 0
+        self.hits = self.disk_hits = self.misses = self.extended = self.evictions = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _dir(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest()[:16])
+
+    def _path(self, key, fingerprint, rows):
+        return os.path.join(self._dir(key), f'{rows}_{fingerprint}.npy')
+
+    def get(self, key, fingerprint, rows):
+        values = self.entries.get((key, fingerprint))
+        if values is not None:
+            self.entries.move_to_end((key, fingerprint))
+            self.hits += 1
+            return values
+        if self.directory:
+            path = self._path(key, fingerprint, rows)
+            if os.path.exists(path):
+                os.utime(path) # recently used
+                values = np.load(path)
+                self.disk_hits += 1
+                self._remember(key, fingerprint, values)
+                return self.entries.get((key, fingerprint), values)
+        self.misses += 1
+        return None
+
+    def put(self, key, fingerprint, values, disk=True):
+        values.flags.writeable = False
+        self._remember(key, fingerprint, values)
+        if disk and self.directory:
+            os.makedirs(self._dir(key), exist_ok=True)
+            path = self._path(key, fingerprint, len(values))
+            tmp = path + '.tmp.npy'
+            np.save(tmp, values)
+            os.replace(tmp, path)
+            self.evict_disk()
+
+    def _remember(self, key, fingerprint, values):
+        values.flags.writeable = False
+        if values.nbytes > self.max_bytes:
+            return
+        if (key, fingerprint) not in self.entries:
+            self.nbytes += values.nbytes
+        self.entries[(key, fingerprint)] = values
+        self.lengths.setdefault(key, {})[fingerprint] = len(values)
+        while self.nbytes > self.max_bytes:
+            (old_key, old_fp), old = self.entries.popitem(last=False)
+            self.nbytes -= old.nbytes
+            del self.lengths[old_key][old_fp]
+            self.evictions += 1
+
+    def prefixes(self, key):
+        '''{fingerprint: rows} of every entry held for key, memory and disk'''
+        found = dict(self.lengths.get(key, {}))
+        if self.directory and os.path.isdir(self._dir(key)):
+            for name in os.listdir(self._dir(key)):
+                rows, _, rest = name.partition('_')
+                if rest.endswith('.npy') and not rest.endswith('.tmp.npy'):
+                    found[rest[:-4]] = int(rows)
+        return found
+
+    def evict_disk(self, max_bytes=None):
+        '''drops the least recently used files until the directory fits'''
+        max_bytes = self.max_disk_bytes if max_bytes is None else max_bytes
+        files = []
+        for sub in os.listdir(self.directory):
+            sub = os.path.join(self.directory, sub)
+            if os.path.isdir(sub):
+                files += [os.path.join(sub, name) for name in os.listdir(sub)]
+        stats = [(os.stat(f), f) for f in files]
+        total = sum(st.st_size for st, _ in stats)
+        for st, f in sorted(stats, key=lambda sf: sf[0].st_mtime):
+            if total <= max_bytes:
+                break
+            total -= st.st_size
+            os.remove(f)
+        return total
+
+    def clear(self):
+        self.entries.clear()
+        self.lengths.clear()
+        self.nbytes = 0
+        if self.directory:
+            self.evict_disk(max_bytes=-1)
+
+    def stats(self):
+        return {'entries': len(self.entries), 'bytes': self.nbytes, 'hits': self.hits,
+                'disk_hits': self.disk_hits, 'misses': self.misses, 'extended': self.extended,
+                'evictions': self.evictions}
+
+
+class IndicatorGraph:
+    '''indicators over one price series or (time x symbols) panel. Takes and
+    returns what ta_batch does: arrays come back 2-D, DataFrames as
+    DataFrames'''
+
+    def __init__(self, prices, cache=None):
+        self.cache = cache if cache is not None else IndicatorCache()
+        self.is_frame = isinstance(prices, pd.DataFrame)
+        self.like = prices if self.is_frame else None
+        self.values = np.zeros((0, 1 if np.ndim(prices) == 1 else np.shape(prices)[1]))
+        self.hashers = {0: hashlib.blake2b(f'{self.values.shape[1]}xfloat64'.encode(), digest_size=16)}
+        self.computed = {} # node key -> values for the current prices
+        self.append(prices)
+
+    def append(self, prices):
+        '''new rows at the end of the prices'''
+        new = prices.to_numpy(dtype=np.float64) if isinstance(prices, (pd.Series, pd.DataFrame)) else prices
+        new = np.asarray(new, dtype=np.float64)
+        new = np.ascontiguousarray(new[:, None] if new.ndim == 1 else new)
+        if self.is_frame and len(self.values):
+            self.like = pd.concat([self.like, prices])
+        self.values = np.concatenate([self.values, new]) if len(self.values) else new
+        self.values.flags.writeable = False
+        self.fingerprint(len(self.values))
+        self.computed = {}
+
+    def fingerprint(self, rows):
+        '''digest of the first `rows` rows; hashing goes on from the nearest
+        earlier length already hashed'''
+        start = max(r for r in self.hashers if r <= rows)
+        if start == rows:
+            return self.hashers[rows].hexdigest()
+        hasher = self.hashers[start].copy()
+        hasher.update(memoryview(self.values[start:rows]).cast('B'))
+        self.hashers[rows] = hasher
+        return hasher.hexdigest()
+
+    def evaluate(self, node):
+        '''values of node for the current prices (2-D, read-only)'''
+        if node.key == PRICE.key:
+            return self.values
+        values = self.computed.get(node.key)
+        if values is not None:
+            self.cache.hits += 1
+            return values
+        n = len(self.values)
+        fingerprint = self.fingerprint(n)
+        values = self.cache.get(node.key, fingerprint, n)
+        if values is None:
+            inputs = [self.evaluate(i) for i in node.inputs]
+            cached = self._cached_prefix(node)
+            new = node.extend(cached, inputs) if cached is not None else None
+            if new is not None:
+                values = np.concatenate([cached, new])
+                self.cache.extended += 1
+            else:
+                values = node.compute(*inputs)
+            values = np.ascontiguousarray(values, dtype=np.float64)
+            self.cache.put(node.key, fingerprint, values)
+        self.computed[node.key] = values
+        return values
+
+    def _cached_prefix(self, node):
+        '''the longest cached values of node over a prefix of the prices'''
+        n = len(self.values)
+        for fingerprint, rows in sorted(self.cache.prefixes(node.key).items(), key=lambda fr: -fr[1]):
+            if 0 < rows < n and self.fingerprint(rows) == fingerprint:
+                values = self.cache.get(node.key, fingerprint, rows)
+                if values is not None:
+                    return values
+        return None
+
+    def get(self, name, **params):
+        '''a ta_batch indicator by name, e.g. get('macd', time_period_macd=9)'''
+        nodes = INDICATORS[name](PRICE, **params)
+        if isinstance(nodes, tuple):
+            return tuple(self._out(self.evaluate(node)) for node in nodes)
+        return self._out(self.evaluate(nodes))
+
+    def _out(self, values):
+        if self.is_frame:
+            return pd.DataFrame(values, index=self.like.index, columns=self.like.columns)
+        return values
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='compute ta_batch indicators through the cache')
+    parser.add_argument('--data', default='goog_data.pkl')
+    parser.add_argument('--column', default='Close')
+    parser.add_argument('--indicators', default='sma,ema,apo,macd,std,bollinger_bands,rsi,mom')
+    parser.add_argument('--cache-dir', default=None, help=f'disk tier, e.g. {CACHE_DIR}')
+    args = parser.parse_args()
+
+    close = pd.read_pickle(args.data)[[args.column]]
+    graph = IndicatorGraph(close, IndicatorCache(directory=args.cache_dir))
+    for name in args.indicators.split(','):
+        t0 = time.perf_counter()
+        graph.get(name)
+        print(f'{name:<16} {(time.perf_counter() - t0)*1e3:8.2f} ms')
+    print(graph.cache.stats())
@@ -0,0 +1,212 @@
+'''timing hooks for the strategy and indicator code.
+
+    @probe('indicator')             wraps a function
+    with span('fill loop', 'pnl'):  times a block
+    on_bar = traced(strategy.on_bar, 'order')
+                                    for per-bar calls: hands back the bare
+                                    callable when tracing is off, so a hot
+                                    loop pays nothing
+
+stages used in the repo: indicator, signal, order, pnl.
+
+Off by default. Disabled, a probe costs one global flag check per call.
+enable() starts recording, per (stage, name): calls, total and self time,
+the slowest call and, with allocations=True, the change in allocated
+blocks (sys.getallocatedblocks) and traced bytes (tracemalloc) across
+the call. Nested probes build call stacks; folded() / write_folded() give
+them in the folded format flamegraph.pl, inferno and speedscope read
+(self time in microseconds), summary() the per-stage table.
+
+INSTRUMENT=<prefix> in the environment enables it at import and, at exit,
+prints the summary and writes <prefix>.folded, e.g.
+    INSTRUMENT=prof python 6_basic_trading_strats.py
+
+One recording per process; not meant for several threads at once.
+
+LatencyStats is the always-on counterpart for services (scoring.py,
+live.py): per-request latencies over a sliding window, p50/p99 on demand.'''
+
+import atexit
+import functools
+import os
+import sys
+import time
+import tracemalloc
+from collections import deque
+import numpy as np
+import pandas as pd
+
+STAGES = ('indicator', 'signal', 'order', 'pnl')
+
+_active = False
+_allocations = False
+_stack = [] # open frames: [path, key, start_ns, child_ns, blocks, bytes]
+_stats = {} # (stage, name) -> [calls, total_ns, self_ns, max_ns, blocks, bytes]
+_folded = {} # 'a;b;c' -> self ns
+
+
+def enable(allocations=False):
+    global _active, _allocations
+    _allocations = allocations
+    if allocations and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _active = True
+
+
+def disable():
+    global _active
+    _active = False
+    if _allocations and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def enabled():
+    return _active
+
+
+def reset():
+    _stack.clear()
+    _stats.clear()
+    _folded.clear()
+
+
+def _enter(name, stage):
+    path = f'{_stack[-1][0]};{name}' if _stack else name
+    frame = [path, (stage, name), 0, 0, 0, 0]
+    if _allocations:
+        frame[4] = sys.getallocatedblocks()
+        frame[5] = tracemalloc.get_traced_memory()[0]
+    _stack.append(frame)
+    frame[2] = time.perf_counter_ns()
+    return frame
+
+
+def _exit(frame):
+    elapsed = time.perf_counter_ns() - frame[2]
+    blocks = nbytes = 0
+    if _allocations:
+        blocks = sys.getallocatedblocks() - frame[4]
+        nbytes = tracemalloc.get_traced_memory()[0] - frame[5]
+    _stack.pop()
+    if _stack:
+        _stack[-1][3] += elapsed
+    own = elapsed - frame[3]
+    row = _stats.get(frame[1])
+    if row is None:
+        row = _stats[frame[1]] = [0, 0, 0, 0, 0, 0]
+    row[0] += 1
+    row[1] += elapsed
+    row[2] += own
+    if elapsed > row[3]:
+        row[3] = elapsed
+    row[4] += blocks
+    row[5] += nbytes
+    _folded[frame[0]] = _folded.get(frame[0], 0) + own
+
+
+def probe(stage, name=None):
+    '''decorator; name defaults to the function's qualified name'''
+    def wrap(fn):
+        label = name or fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _active:
+                return fn(*args, **kwargs)
+            frame = _enter(label, stage)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _exit(frame)
+        return wrapper
+    return wrap
+
+
+def traced(fn, stage, name=None):
+    '''fn itself while tracing is off, a probed wrapper while it is on.
+    Decided once, when called, so bind it before the loop'''
+    if not _active:
+        return fn
+    return probe(stage, name or getattr(fn, '__qualname__', repr(fn)))(fn)
+
+
+class span:
+    '''times a with-block'''
+    __slots__ = ('name', 'stage', 'frame')
+
+    def __init__(self, name, stage):
+        self.name = name
+        self.stage = stage
+        self.frame = None
+
+    def __enter__(self):
+        if _active:
+            self.frame = _enter(self.name, self.stage)
+        return self
+
+    def __exit__(self, *exc):
+        if self.frame is not None:
+            _exit(self.frame)
+            self.frame = None
+
+
+def summary(by_stage=False):
+    '''one row per probe (or per stage): calls, total/self ms, mean and max
+    us per call, allocated blocks and bytes'''
+    rows = [dict(stage=stage, name=name, calls=calls, total_ms=total/1e6, self_ms=own/1e6,
+                 per_call_us=total/calls/1e3, max_us=slowest/1e3, blocks=blocks, bytes=nbytes)
+            for (stage, name), (calls, total, own, slowest, blocks, nbytes) in _stats.items()]
+    columns = ['stage', 'name', 'calls', 'total_ms', 'self_ms', 'per_call_us', 'max_us', 'blocks', 'bytes']
+    df = pd.DataFrame(rows, columns=columns)
+    if by_stage:
+        # self time adds up without double counting nested probes
+        df = df.groupby('stage')[['calls', 'self_ms', 'blocks', 'bytes']].sum()
+        return df.sort_values('self_ms', ascending=False)
+    return df.sort_values('self_ms', ascending=False).reset_index(drop=True)
+
+
+def folded():
+    '''"a;b;c <self us>" lines'''
+    return [f'{path} {ns//1000}' for path, ns in sorted(_folded.items()) if ns >= 1000]
+
+
+def write_folded(path):
+    with open(path, 'w') as f:
+        f.write('\n'.join(folded()) + '\n')
+
+
+def report(prefix=None, file=sys.stderr):
+    '''prints the per-stage and per-probe tables; writes <prefix>.folded'''
+    if not _stats:
+        return
+    with pd.option_context('display.width', 200, 'display.max_rows', 200,
+                           'display.float_format', '{:.3f}'.format):
+        print(summary(by_stage=True).to_string(), file=file)
+        print(summary().to_string(index=False), file=file)
+    if prefix:
+        write_folded(prefix + '.folded')
+        print(f'stacks written to {prefix}.folded', file=file)
+
+
+class LatencyStats:
+    '''request latencies (seconds) over the last `size` requests'''
+
+    def __init__(self, size=100000):
+        self.samples = deque(maxlen=size)
+        self.requests = 0
+
+    def record(self, seconds):
+        self.samples.append(seconds)
+        self.requests += 1
+
+    def summary(self):
+        out = {'requests': self.requests}
+        if self.samples:
+            p50, p99 = np.percentile(np.fromiter(self.samples, dtype=np.float64), [50, 99])*1e3
+            out.update(p50_ms=float(p50), p99_ms=float(p99))
+        return out
+
+
+if os.environ.get('INSTRUMENT'):
+    enable(allocations=os.environ.get('INSTRUMENT_ALLOCATIONS', '') not in ('', '0'))
+    atexit.register(report, os.environ['INSTRUMENT'])
@@ -0,0 +1,14 @@
+'''numba is optional. njit compiles when numba is installed and hands the
+function back unchanged otherwise, so kernels still run as plain python'''
+
+try:
+    from numba import njit, prange
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+    prange = range
+
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda fn: fn
@@ -0,0 +1,207 @@
+'''live, event-driven runner for the backtest.py strategies (by default the
+volatility-adjusted APO of 7_volatility_adj_strats.py).
+
+feed -> bounded queue -> strategy -> order sink, all on one asyncio loop.
+A feed is an async iterator of PriceEvent (a bar close or a tick);
+ReplayFeed replays a DataFrame or data file, as fast as possible or paced.
+The strategy state (emas, rolling std, Ledger) is updated one event at a
+time through the same Strategy.on_bar() the backtests use, so a replay
+gives the orders of run_backtest / apo_backtest.
+
+backpressure: the queue holds queue_size events. overflow='block' makes
+the feed wait for the strategy (nothing lost, the source slows down);
+'drop_oldest' keeps the newest events and counts what it dropped, which
+changes the indicator path and is only for feeds that cannot wait. With
+drop_oldest the strategy gets a turn after every event, so what is dropped
+is what it could not keep up with, not what a feed pushed between two
+yields (ReplayFeed only yields every 256 events when unpaced).
+
+latency: decision time (dequeue to order decided) and queue wait are kept
+per event; stats() gives p50/p99.
+
+usage: python live.py [--data goog_data.pkl] [--column Close] [--rate 0]
+                      [--queue-size 1024] [--overflow block] [--out orders.csv]'''
+
+import argparse
+import asyncio
+import csv
+import time
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from backtest import Ledger, VolatilityAdjustedAPO
+from instrument import LatencyStats
+
+SRC_DATA_FILENAME = 'goog_data.pkl'
+
+PriceEvent = namedtuple('PriceEvent', ['time', 'price'])
+Order = namedtuple('Order', ['seq', 'time', 'side', 'qty', 'price', 'position'])
+
+
+class Feed:
+    '''async iterator of PriceEvent'''
+
+    def __aiter__(self):
+        return self.events()
+
+    async def events(self):
+        raise NotImplementedError
+        yield
+
+
+class ReplayFeed(Feed):
+    '''replays a price column. rate: events per second, 0 for as fast as
+    the consumer takes them'''
+
+    def __init__(self, data, column='Close', rate=0):
+        if isinstance(data, str):
+            data = pd.read_pickle(data)
+        self.times = data.index
+        self.prices = data[column].to_numpy(dtype=np.float64).tolist()
+        self.rate = rate
+
+    async def events(self):
+        start = time.perf_counter()
+        for i, (t, price) in enumerate(zip(self.times, self.prices)):
+            if self.rate:
+                delay = start + i/self.rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            elif i % 256 == 0:
+                await asyncio.sleep(0) # let the consumer run
+            yield PriceEvent(t, price)
+
+
+class QueueFeed(Feed):
+    '''events pushed in from elsewhere (a socket reader, a callback); None ends it'''
+
+    def __init__(self):
+        self.queue = asyncio.Queue()
+
+    def push(self, event):
+        self.queue.put_nowait(event)
+
+    async def events(self):
+        while (event := await self.queue.get()) is not None:
+            yield event
+
+
+class OrderSink:
+    async def send(self, order):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class ListSink(OrderSink):
+    def __init__(self):
+        self.orders = []
+
+    async def send(self, order):
+        self.orders.append(order)
+
+
+class CsvSink(OrderSink):
+    def __init__(self, path):
+        self.file = open(path, 'w', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(Order._fields)
+
+    async def send(self, order):
+        self.writer.writerow(order)
+        self.file.flush()
+
+    async def close(self):
+        self.file.close()
+
+
+class LiveRunner:
+    def __init__(self, feed, sink, strategy=None, queue_size=1024, overflow='block', history=1024):
+        if overflow not in ('block', 'drop_oldest'):
+            raise ValueError(f'overflow must be block or drop_oldest, not {overflow!r}')
+        self.feed = feed
+        self.sink = sink
+        self.strategy = strategy if strategy is not None else VolatilityAdjustedAPO()
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.overflow = overflow
+        self.ledger = Ledger()
+        # recent strategy columns, a ring of `history` rows
+        self.history = history
+        self.record = {col: np.full(history, np.nan) for col in self.strategy.columns}
+        self.strategy.on_start(self.record)
+        self.seq = 0
+        self.dropped = 0
+        self.decision = LatencyStats()
+        self.wait = LatencyStats()
+
+    async def _pump(self):
+        try:
+            async for event in self.feed:
+                item = (event, time.perf_counter())
+                if self.overflow == 'block':
+                    await self.queue.put(item)
+                else:
+                    while self.queue.full():
+                        self.queue.get_nowait()
+                        self.dropped += 1
+                    self.queue.put_nowait(item)
+                    await asyncio.sleep(0)
+        finally:
+            await self.queue.put(None)
+
+    def on_event(self, event):
+        '''one strategy step; returns the Order or None'''
+        price = event.price
+        qty = self.strategy.on_bar(self.seq % self.history, price, self.ledger)
+        if qty > 0:
+            self.ledger.buy(price, qty)
+        elif qty < 0:
+            self.ledger.sell(price, -qty)
+        self.ledger.mark(price)
+        order = None
+        if qty:
+            order = Order(self.seq, event.time, 'buy' if qty > 0 else 'sell', abs(qty), price,
+                          self.ledger.position)
+        self.seq += 1
+        return order
+
+    async def run(self):
+        pump = asyncio.create_task(self._pump())
+        try:
+            while (item := await self.queue.get()) is not None:
+                event, queued = item
+                t0 = time.perf_counter()
+                order = self.on_event(event)
+                self.decision.record(time.perf_counter() - t0)
+                self.wait.record(t0 - queued)
+                if order is not None:
+                    await self.sink.send(order)
+            await pump
+        finally:
+            pump.cancel()
+            await self.sink.close()
+        return self.stats()
+
+    def stats(self):
+        return {'events': self.seq, 'dropped': self.dropped,
+                'position': self.ledger.position, 'total_pnl': self.ledger.total_pnl,
+                'decision': self.decision.summary(), 'queue_wait': self.wait.summary()}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='live APO runner over a replayed feed')
+    parser.add_argument('--data', default=SRC_DATA_FILENAME)
+    parser.add_argument('--column', default='Close')
+    parser.add_argument('--rate', type=float, default=0, help='events per second, 0 = unpaced')
+    parser.add_argument('--queue-size', type=int, default=1024)
+    parser.add_argument('--overflow', choices=['block', 'drop_oldest'], default='block')
+    parser.add_argument('--out', default=None, help='orders csv (default: keep in memory)')
+    args = parser.parse_args()
+
+    sink = CsvSink(args.out) if args.out else ListSink()
+    runner = LiveRunner(ReplayFeed(args.data, args.column, args.rate), sink,
+                        queue_size=args.queue_size, overflow=args.overflow)
+    stats = asyncio.run(runner.run())
+    for key, value in stats.items():
+        print(f'{key}: {value}')
@@ -0,0 +1,236 @@
+'''market data access with an on-disk cache, shared by the scripts.
+
+load_prices(symbol, start, end) returns daily bars for [start, end]. The
+cache keeps one file per (source, symbol) and remembers which date ranges
+the source already served, so a wider request only fetches the missing
+pieces and merges them into the file. A fetch counts as served up to the
+last bar it returned: days after that (today, the future, a source that
+is behind) are asked again next time. Least recently used files are
+evicted once the cache goes over max_bytes.
+
+python market_data.py checks this with a source that grows between calls.
+
+sources: anything with a `name` and fetch(symbol, start, end) -> DataFrame.
+LocalFileSource reads <dir>/<symbol>_data.pkl (or .csv) and falls back to
+Yahoo when the file is missing, like the old try/except in the scripts.
+MARKET_DATA_SOURCE=yahoo or MARKET_DATA_SOURCE=<dir> picks the default.'''
+
+import hashlib
+import json
+import os
+import time
+import warnings
+import pandas as pd
+
+CACHE_DIR = '.market_data_cache'
+MAX_CACHE_BYTES = 1 << 30
+ONE_DAY = pd.Timedelta(days=1)
+
+
+class DataSource:
+    name = 'none'
+
+    def fetch(self, symbol, start, end):
+        raise NotImplementedError
+
+
+class YahooSource(DataSource):
+    name = 'yahoo'
+
+    def fetch(self, symbol, start, end):
+        from pandas_datareader import data # slow import, only when we go online
+        return data.DataReader(symbol, 'yahoo', start, end)
+
+
+class LocalFileSource(DataSource):
+    '''offline stand-in: one pickle or csv per symbol in a directory'''
+
+    def __init__(self, directory='.', pattern='{lower}_data', fallback=None):
+        self.directory = os.path.abspath(directory)
+        self.pattern = pattern
+        self.fallback = fallback
+        self.name = 'local:' + self.directory
+
+    def path(self, symbol):
+        stem = os.path.join(self.directory, self.pattern.format(symbol=symbol, lower=symbol.lower()))
+        for ext in ('.pkl', '.csv'):
+            if os.path.exists(stem + ext):
+                return stem + ext
+        return None
+
+    def fetch(self, symbol, start, end):
+        path = self.path(symbol)
+        if path is None:
+            if self.fallback is None:
+                raise FileNotFoundError(f'no data file for {symbol} in {self.directory}')
+            return self.fallback.fetch(symbol, start, end)
+        if path.endswith('.pkl'):
+            df = pd.read_pickle(path)
+        else:
+            df = pd.read_csv(path, index_col=0, parse_dates=True)
+        return df.loc[start:end]
+
+
+def default_source():
+    spec = os.environ.get('MARKET_DATA_SOURCE', '')
+    if spec == 'yahoo':
+        return YahooSource()
+    return LocalFileSource(spec or '.', fallback=YahooSource())
+
+
+def _day(ts):
+    return pd.Timestamp(ts).normalize()
+
+
+def merge_ranges(ranges):
+    '''merges inclusive [start, end] day ranges that overlap or touch'''
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + ONE_DAY:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def missing_ranges(covered, start, end):
+    '''pieces of [start, end] not in the (merged) covered ranges'''
+    missing = []
+    cursor = start
+    for c_start, c_end in covered:
+        if c_end < cursor:
+            continue
+        if c_start > end:
+            break
+        if c_start > cursor:
+            missing.append([cursor, c_start - ONE_DAY])
+        cursor = max(cursor, c_end + ONE_DAY)
+    if cursor <= end:
+        missing.append([cursor, end])
+    return missing
+
+
+class MarketDataCache:
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(cache_dir, 'index.json')
+        os.makedirs(cache_dir, exist_ok=True)
+        self.index = self._read_index()
+
+    def _read_index(self):
+        try:
+            with open(self.index_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _write_index(self):
+        tmp = self.index_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.index, f, indent=1)
+        os.replace(tmp, self.index_path)
+
+    @staticmethod
+    def key(source_name, symbol):
+        return hashlib.sha1(f'{source_name}|{symbol}'.encode()).hexdigest()[:16]
+
+    def get(self, symbol, start, end, source=None):
+        source = source if source is not None else default_source()
+        start, end = _day(start), _day(end)
+        key = self.key(source.name, symbol)
+        entry = self.index.get(key)
+        path = os.path.join(self.cache_dir, key + '.pkl')
+
+        if entry is None or not os.path.exists(path):
+            entry = {'symbol': symbol, 'source': source.name, 'ranges': [], 'size': 0}
+            df = None
+        else:
+            df = pd.read_pickle(path)
+        covered = [[_day(s), _day(e)] for s, e in entry['ranges']]
+
+        # only ask the source for what we have not asked before
+        missing = missing_ranges(covered, start, end)
+        if missing:
+            pieces = [df] if df is not None else []
+            served = []
+            for m_start, m_end in missing:
+                piece = source.fetch(symbol, m_start, m_end)
+                pieces.append(piece)
+                if piece is not None and len(piece):
+                    served.append([m_start, min(m_end, _day(piece.index.max()))])
+            df = pd.concat([p for p in pieces if p is not None and len(p)] or pieces[-1:])
+            df = df[~df.index.duplicated(keep='last')].sort_index()
+            df.to_pickle(path)
+            covered = merge_ranges(covered + served)
+            entry['ranges'] = [[s.isoformat(), e.isoformat()] for s, e in covered]
+            entry['size'] = os.path.getsize(path)
+
+        entry['last_access'] = time.time()
+        self.index[key] = entry
+        self.evict()
+        self._write_index()
+        df = df.loc[start:end + ONE_DAY - pd.Timedelta(1)].copy()
+        if len(df) == 0 or df.index[0] - start > pd.Timedelta(days=7):
+            first = df.index[0].date() if len(df) else None
+            warnings.warn(f'{symbol}: asked {source.name} for data from {start.date()}, first bar is {first}')
+        return df
+
+    def evict(self, max_bytes=None):
+        '''drops least recently used files until the cache fits'''
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        total = sum(e['size'] for e in self.index.values())
+        for key in sorted(self.index, key=lambda k: self.index[k].get('last_access', 0)):
+            if total <= max_bytes:
+                break
+            total -= self.index[key]['size']
+            del self.index[key]
+            path = os.path.join(self.cache_dir, key + '.pkl')
+            if os.path.exists(path):
+                os.remove(path)
+        return total
+
+    def clear(self):
+        self.evict(max_bytes=-1)
+        self._write_index()
+
+
+_caches = {}
+
+
+def load_prices(symbol, start, end, source=None, cache_dir=CACHE_DIR):
+    '''daily bars for symbol between start and end (inclusive)'''
+    if cache_dir not in _caches:
+        _caches[cache_dir] = MarketDataCache(cache_dir)
+    return _caches[cache_dir].get(symbol, start, end, source=source)
+
+
+if __name__ == '__main__':
+    # a source that is behind, then catches up: the second get has to fetch
+    # the days the first one did not get, the third nothing
+    import tempfile
+
+    class GrowingSource(DataSource):
+        name = 'growing'
+
+        def __init__(self, until):
+            self.until = pd.Timestamp(until)
+            self.fetches = 0
+
+        def fetch(self, symbol, start, end):
+            self.fetches += 1
+            index = pd.bdate_range(start, min(pd.Timestamp(end), self.until), name='Date')
+            return pd.DataFrame({'Close': 1.0}, index=index)
+
+    start, end = '2015-01-01', '2018-01-01'
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = MarketDataCache(tmp)
+        source = GrowingSource('2016-01-01')
+        first = cache.get('X', start, end, source)
+        source.until = pd.Timestamp(end)
+        second = cache.get('X', start, end, source)
+        third = cache.get('X', start, end, source)
+    ok = (len(second) == len(third) == len(pd.bdate_range(start, end))
+          and len(first) < len(second) and source.fetches == 2)
+    print(f'rows {len(first)} -> {len(second)} -> {len(third)}, {source.fetches} fetches: '
+          f'{"ok" if ok else "STALE"}')
@@ -0,0 +1,57 @@
+'''features and labels for the 5_basic_ma.py models'''
+
+import numpy as np
+import pandas as pd
+
+
+# labels for regression prediction (numerical prediction) -- change in price/day
+def pop_regression_y(df):
+    df['Open-Close'] = df['Open'] - df['Close']
+    df['High-Low'] = df['High'] - df['Low']
+    df = df.dropna()
+    x = df[['Open-Close', 'High-Low']]
+    y = df['Close'].shift(-1) - df['Close']
+    x = x[:-1]
+    y = y[:-1]
+    return (x, y)
+
+# labels for classification prediction (categorical prediction) -- 1: up, -1: down
+def pop_classification_y(df):
+    df['Open-Close'] = df['Open'] - df['Close']
+    df['High-Low'] = df['High'] - df['Low']
+    df = df.dropna()
+    x = df[['Open-Close', 'High-Low']]
+    y = np.where(df['Close'].shift(-1) > df['Close'], 1, -1)
+    x = x[:-1]
+    y = y[:-1]
+    return (x, y)
+
+
+FEATURES = ['Open-Close', 'High-Low']
+
+
+def feature_arrays(df):
+    '''features and both labels as float arrays, computed once without
+    touching df. Same rows as pop_regression_y / pop_classification_y'''
+    df = df[['Open', 'High', 'Low', 'Close']].dropna()
+    close = df['Close'].to_numpy(dtype=np.float64)
+    x = np.column_stack([df['Open'].to_numpy(dtype=np.float64) - close,
+                         df['High'].to_numpy(dtype=np.float64) - df['Low'].to_numpy(dtype=np.float64)])
+    change = close[1:] - close[:-1]
+    return {
+        'x': np.ascontiguousarray(x[:-1]),
+        'y_reg': change,
+        'y_cls': np.where(change > 0, 1.0, -1.0),
+        'index': df.index[:-1].asi8 if isinstance(df.index, pd.DatetimeIndex) else np.arange(len(df) - 1),
+    }
+
+
+def bar_features(bars):
+    '''FEATURES rows for incoming bars: a DataFrame, a list of dicts with
+    Open/High/Low/Close, or an (n, 4) array in that order'''
+    if isinstance(bars, pd.DataFrame):
+        bars = bars[['Open', 'High', 'Low', 'Close']].to_numpy(dtype=np.float64)
+    elif len(bars) and isinstance(bars[0], dict):
+        bars = np.array([[b['Open'], b['High'], b['Low'], b['Close']] for b in bars], dtype=np.float64)
+    bars = np.asarray(bars, dtype=np.float64).reshape(-1, 4)
+    return np.column_stack([bars[:, 0] - bars[:, 3], bars[:, 1] - bars[:, 2]])
@@ -0,0 +1,349 @@
+'''Monte Carlo robustness runs: the strategies over thousands of synthetic
+price paths calibrated on goog_data.pkl, instead of the one historical path
+a backtest sees.
+
+paths, (bars x paths) panels starting from the first historical close:
+  bootstrap  moving-block bootstrap of the daily log returns, circular
+             blocks of `block` days (keeps volatility clustering and the
+             short-range autocorrelation)
+  gbm        normal log returns with the historical mean and std
+  regime     Markov switching between `regimes` volatility states: days are
+             labelled by the quantile of their rolling std, each state gets
+             the mean/std of its returns and the transitions are counted
+             from the labels
+Each generator draws from its own stream of np.random.SeedSequence(seed),
+so a seed gives the same paths whichever generators, strategies or number
+of workers are run.
+
+strategies, on the whole panel at once:
+  double_ma  pandas rolling means of every path (strategies.double_ma rule)
+  turtle     strat_kernels.turtle_orders (numba, see jit.py)
+  apo        apo_backtest per path; with workers > 1 the paths go to a
+             spawned process pool, in shared memory like sweep.py
+double_ma and turtle trade their orders at the close as sweep.orders_pnl,
+apo counts its pnl + open_pnl, so the historical path gives the sweep.py
+numbers.
+
+report, per generator and strategy: the distribution over paths of the final
+pnl, the max drawdown (largest fall of the pnl curve from its running high)
+and the sharpe of the daily pnl changes, next to the historical value and
+the share of paths that did worse.
+
+usage: python montecarlo.py [--paths 1000] [--generators bootstrap,gbm,regime]
+                            [--strategies double_ma,turtle,apo] [--seed 0]
+                            [--workers 4] [--block 20] [-p turtle.window_entry=40]'''
+
+import argparse
+import os
+import time
+from multiprocessing import get_context, shared_memory
+import numpy as np
+import pandas as pd
+from analytics import sharpe
+from backtest import apo_backtest
+from rolling_moments import rolling_std
+from strat_kernels import turtle_orders
+
+SRC_DATA_FILENAME = 'goog_data.pkl'
+GENERATORS = ('bootstrap', 'gbm', 'regime')
+STRATEGIES = ('double_ma', 'turtle', 'apo')
+METRICS = ('pnl', 'max_drawdown', 'sharpe')
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+STRATEGY_PARAMS = {
+    'double_ma': dict(short_window=20, long_window=100),
+    'turtle': dict(window_entry=50, window_exit=25),
+    'apo': dict(),
+}
+
+
+def _log_returns(close):
+    close = np.asarray(close, dtype=np.float64)
+    return np.diff(np.log(close))
+
+
+def _paths(start, returns):
+    '''(bars x paths) prices from a (bars - 1 x paths) panel of log returns'''
+    log_price = np.zeros((len(returns) + 1, returns.shape[1]))
+    np.cumsum(returns, axis=0, out=log_price[1:])
+    return float(start)*np.exp(log_price)
+
+
+def block_bootstrap(close, n_paths, length=None, rng=None, block=20):
+    '''paths from circular blocks of `block` consecutive historical returns'''
+    rng = np.random.default_rng(rng)
+    r = _log_returns(close)
+    steps = (length or len(close)) - 1
+    n_blocks = -(-steps//block)
+    starts = rng.integers(0, len(r), size=(n_blocks, n_paths))
+    # (blocks, block, paths) -> bars
+    idx = (starts[:, None, :] + np.arange(block)[None, :, None]) % len(r)
+    return _paths(close[0], r[idx.reshape(-1, n_paths)[:steps]])
+
+
+def gbm(close, n_paths, length=None, rng=None):
+    '''geometric brownian motion with the drift and volatility of close'''
+    rng = np.random.default_rng(rng)
+    r = _log_returns(close)
+    steps = (length or len(close)) - 1
+    return _paths(close[0], r.mean() + r.std()*rng.standard_normal((steps, n_paths)))
+
+
+def fit_regimes(close, regimes=2, vol_window=20):
+    '''per-state mean and std of the log returns and the transition matrix,
+    states ordered from calm to volatile'''
+    r = _log_returns(close)
+    vol = rolling_std(r, vol_window, min_periods=2)
+    vol[np.isnan(vol)] = np.nanmedian(vol)
+    edges = np.quantile(vol, np.arange(1, regimes)/regimes)
+    state = np.searchsorted(edges, vol, side='right')
+    counts = np.zeros((regimes, regimes))
+    np.add.at(counts, (state[:-1], state[1:]), 1)
+    # a state never left stays put
+    counts[np.diag(counts.sum(axis=1) == 0)] = 1
+    mean = np.array([r[state == s].mean() if (state == s).any() else r.mean() for s in range(regimes)])
+    std = np.array([r[state == s].std() if (state == s).any() else r.std() for s in range(regimes)])
+    return mean, std, counts/counts.sum(axis=1, keepdims=True), np.bincount(state, minlength=regimes)/len(state)
+
+
+def regime_switching(close, n_paths, length=None, rng=None, regimes=2, vol_window=20):
+    '''paths from a Markov chain of volatility states fitted on close'''
+    rng = np.random.default_rng(rng)
+    mean, std, transition, share = fit_regimes(close, regimes, vol_window)
+    steps = (length or len(close)) - 1
+    cumulative = np.cumsum(transition, axis=1)
+    cumulative[:, -1] = 1.0
+    u = rng.random((steps, n_paths))
+    z = rng.standard_normal((steps, n_paths))
+    states = np.empty((steps, n_paths), dtype=np.intp)
+    # first state from the historical shares, then one vector step per bar
+    s = np.minimum(np.searchsorted(np.cumsum(share), u[0], side='right'), regimes - 1)
+    states[0] = s
+    for t in range(1, steps):
+        s = (u[t][:, None] >= cumulative[s]).sum(axis=1)
+        states[t] = s
+    return _paths(close[0], mean[states] + std[states]*z)
+
+
+GENERATOR_FUNCS = {
+    'bootstrap': block_bootstrap,
+    'gbm': gbm,
+    'regime': regime_switching,
+}
+
+
+def generate(close, n_paths, generators=GENERATORS, length=None, seed=None, **params):
+    '''{generator: (bars x paths) panel}. params go to the generators that
+    take them (block, regimes, vol_window)'''
+    streams = dict(zip(GENERATORS, np.random.SeedSequence(seed).spawn(len(GENERATORS))))
+    panels = {}
+    for name in generators:
+        fn = GENERATOR_FUNCS[name]
+        kwargs = {k: v for k, v in params.items() if k in fn.__code__.co_varnames}
+        panels[name] = fn(close, n_paths, length, np.random.default_rng(streams[name]), **kwargs)
+    return panels
+
+
+def panel_orders_pnl(close, orders, shares=1):
+    '''sweep.orders_pnl down every column'''
+    position = np.cumsum(np.nan_to_num(orders), axis=0)*shares
+    pnl = np.zeros(close.shape)
+    np.cumsum(position[:-1]*np.diff(close, axis=0), axis=0, out=pnl[1:])
+    return pnl
+
+
+def _double_ma(close, short_window, long_window):
+    frame = pd.DataFrame(close)
+    short_ma = frame.rolling(window=short_window).mean().to_numpy()
+    long_ma = frame.rolling(window=long_window).mean().to_numpy()
+    signal = np.where(short_ma > long_ma, 1.0, 0.0)
+    signal[:short_window] = 0.0
+    orders = np.zeros(close.shape)
+    orders[1:] = np.diff(signal, axis=0)
+    return panel_orders_pnl(close, orders)
+
+
+def _turtle(close, window_entry, window_exit):
+    prev = pd.DataFrame(close).shift(1)
+    bands = (prev.rolling(window=window_entry).max().to_numpy(),
+             prev.rolling(window=window_entry).min().to_numpy(),
+             prev.rolling(window=window_exit).mean().to_numpy())
+    return panel_orders_pnl(close, turtle_orders(close, window_entry, window_exit, bands=bands))
+
+
+def _apo_columns(close, params):
+    pnl = np.empty(close.shape)
+    for j in range(close.shape[1]):
+        results = apo_backtest(close[:, j], **params)
+        pnl[:, j] = results['pnl'] + results['open_pnl']
+    return pnl
+
+
+# worker side: the shared panel of the current run
+_shm = None
+_panel = None
+
+
+def _attach(name, shape):
+    global _shm, _panel
+    if _shm is not None:
+        _shm.close()
+    _shm = shared_memory.SharedMemory(name=name)
+    _panel = np.ndarray(shape, dtype=np.float64, buffer=_shm.buf)
+
+
+def _apo_task(task):
+    name, shape, start, stop, params = task
+    if _shm is None or _shm.name != name:
+        _attach(name, shape)
+    return start, _apo_columns(_panel[:, start:stop], params)
+
+
+def apo_pool(workers):
+    '''process pool for run_strategy('apo', .., pool=), reusable across
+    panels. Spawned, not forked: turtle_orders starts numba's worker
+    threads in this process, and a forked child inherits their locks'''
+    return get_context('spawn').Pool(workers)
+
+
+def _apo(close, workers=None, pool=None, **params):
+    if (pool is None and (not workers or workers <= 1)) or close.shape[1] < 2:
+        return _apo_columns(close, params)
+    own = pool is None
+    pool = apo_pool(workers) if own else pool
+    shm = shared_memory.SharedMemory(create=True, size=close.nbytes)
+    try:
+        np.ndarray(close.shape, dtype=np.float64, buffer=shm.buf)[:] = close
+        step = max(1, -(-close.shape[1]//((workers or os.cpu_count())*4)))
+        tasks = [(shm.name, close.shape, j, min(j + step, close.shape[1]), params)
+                 for j in range(0, close.shape[1], step)]
+        pnl = np.empty(close.shape)
+        for start, block in pool.imap_unordered(_apo_task, tasks):
+            pnl[:, start:start + block.shape[1]] = block
+        return pnl
+    finally:
+        shm.close()
+        shm.unlink()
+        if own:
+            pool.close()
+            pool.join()
+
+
+STRATEGY_FUNCS = {
+    'double_ma': _double_ma,
+    'turtle': _turtle,
+    'apo': _apo,
+}
+
+
+def run_strategy(strategy, close, workers=None, pool=None, **params):
+    '''(bars x paths) pnl curves of strategy on every column of close. apo
+    runs on pool (see apo_pool), or on a pool of its own with workers > 1'''
+    close = np.ascontiguousarray(close, dtype=np.float64)
+    if close.ndim == 1:
+        close = close[:, None]
+    p = dict(STRATEGY_PARAMS[strategy], **params)
+    if strategy == 'apo':
+        return _apo(close, workers, pool, **p)
+    return STRATEGY_FUNCS[strategy](close, **p)
+
+
+def path_metrics(pnl):
+    '''final pnl, max drawdown and sharpe of each column of a pnl panel'''
+    if len(pnl) == 0:
+        nan = np.full(pnl.shape[1], np.nan)
+        return {'pnl': nan, 'max_drawdown': nan, 'sharpe': nan}
+    high = np.maximum(np.maximum.accumulate(pnl, axis=0), 0.0)
+    changes = np.diff(pnl, axis=0, prepend=0.0)
+    return {'pnl': pnl[-1].copy(), 'max_drawdown': (high - pnl).max(axis=0), 'sharpe': sharpe(changes)}
+
+
+def distribution(values, historical=np.nan, higher_is_worse=False, quantiles=QUANTILES):
+    '''summary of one metric over the paths; rank is the share of the paths
+    that did worse than historical'''
+    values = np.asarray(values, dtype=np.float64)
+    row = {'mean': values.mean(), 'std': values.std()}
+    row.update({f'p{round(q*100)}': v for q, v in zip(quantiles, np.quantile(values, quantiles))})
+    row['historical'] = historical
+    worse = values > historical if higher_is_worse else values < historical
+    row['rank'] = np.nan if np.isnan(historical) else float(np.mean(worse))
+    return row
+
+
+def monte_carlo(close, n_paths=1000, generators=GENERATORS, strategies=STRATEGIES, seed=None,
+                workers=None, length=None, generator_params=None, strategy_params=None):
+    '''runs every strategy over the paths of every generator.
+    Returns (report, paths): report indexed by (generator, strategy, metric)
+    with the distribution columns, paths one row per generator, strategy and
+    path with the metrics'''
+    close = np.asarray(close, dtype=np.float64)
+    strategy_params = strategy_params or {}
+    panels = generate(close, n_paths, generators, length, seed, **(generator_params or {}))
+    pool = apo_pool(workers) if workers and workers > 1 and 'apo' in strategies else None
+    rows, frames = [], []
+    try:
+        for strategy in strategies:
+            params = strategy_params.get(strategy, {})
+            historical = path_metrics(run_strategy(strategy, close, **params))
+            for generator, panel in panels.items():
+                metrics = path_metrics(run_strategy(strategy, panel, workers, pool, **params))
+                for metric in METRICS:
+                    row = distribution(metrics[metric], historical[metric][0], metric == 'max_drawdown')
+                    rows.append(dict(generator=generator, strategy=strategy, metric=metric, **row))
+                frame = pd.DataFrame(metrics)
+                frame.insert(0, 'path', np.arange(n_paths))
+                frame.insert(0, 'strategy', strategy)
+                frame.insert(0, 'generator', generator)
+                frames.append(frame)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    report = pd.DataFrame(rows).set_index(['generator', 'strategy', 'metric'])
+    return report, pd.concat(frames, ignore_index=True)
+
+
+def _split_params(pairs):
+    '''strategy.key=value / generator key=value pairs'''
+    from cli import parse_params
+    strategy_params, generator_params = {}, {}
+    for key, value in parse_params(pairs).items():
+        if '.' in key:
+            strategy, key = key.split('.', 1)
+            strategy_params.setdefault(strategy, {})[key] = value
+        else:
+            generator_params[key] = value
+    return strategy_params, generator_params
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='strategy pnl and drawdown distributions over simulated paths')
+    parser.add_argument('--data', default=SRC_DATA_FILENAME)
+    parser.add_argument('--column', default='Close')
+    parser.add_argument('--paths', type=int, default=1000)
+    parser.add_argument('--length', type=int, default=None, help='bars per path (default: the history)')
+    parser.add_argument('--generators', default=','.join(GENERATORS))
+    parser.add_argument('--strategies', default=','.join(STRATEGIES))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None, help='process pool for apo (default: in process)')
+    parser.add_argument('--block', type=int, default=20, help='bootstrap block length')
+    parser.add_argument('--regimes', type=int, default=2)
+    parser.add_argument('-p', '--param', action='append',
+                        help='strategy.key=value for a strategy, key=value for the generators, repeatable')
+    parser.add_argument('--out', default=None, help='write the per-path metrics to this csv')
+    args = parser.parse_args()
+
+    strategy_params, generator_params = _split_params(args.param)
+    generator_params = dict(dict(block=args.block, regimes=args.regimes), **generator_params)
+    close = pd.read_pickle(args.data)[args.column].to_numpy()
+    t0 = time.perf_counter()
+    report, paths = monte_carlo(close, args.paths, tuple(args.generators.split(',')),
+                                tuple(args.strategies.split(',')), args.seed, args.workers,
+                                args.length, generator_params, strategy_params)
+    elapsed = time.perf_counter() - t0
+    if args.out:
+        paths.to_csv(args.out, index=False)
+    pd.set_option('display.width', 1000)
+    print(report.to_string(float_format=lambda v: f'{v:.4g}'))
+    print(f'{args.paths} paths x {len(report)//len(METRICS)} runs in {elapsed:.2f}s '
+          f'({os.path.basename(args.data)}, seed {args.seed})')
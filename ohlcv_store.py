@@ -0,0 +1,280 @@
+'''columnar on-disk OHLCV store, read through memory maps.
+
+layout: <root>/<SYMBOL>/index.npy      int64 ns timestamps, sorted
+                        <field>.npy     one contiguous float64/int64/bool array per column
+                        meta.json       column names -> files, dtypes, index name
+
+Reads open the .npy files with mmap_mode='r', so nothing is loaded until it
+is touched: a date range is a searchsorted on the index plus a slice, and
+only the requested columns are opened.
+
+usage: python ohlcv_store.py import goog_data.pkl GOOG [--root ohlcv]
+       python ohlcv_store.py show GOOG [--root ohlcv] [--start ..] [--end ..]'''
+
+import argparse
+import json
+import os
+import re
+import numpy as np
+import pandas as pd
+from market_data import DataSource
+
+STORE_DIR = 'ohlcv'
+
+
+def _field_file(column):
+    return re.sub(r'[^0-9A-Za-z]+', '_', column).strip('_') + '.npy'
+
+
+def _field_files(columns):
+    '''column -> file name. Raises ValueError when two columns would share
+    a file ('Adj Close', 'Adj_Close') or one would replace the index'''
+    files = {}
+    owner = {'index.npy': 'the index'}
+    for col in columns:
+        fname = _field_file(col)
+        if fname in owner:
+            raise ValueError(f'column {col!r} would be stored in {fname}, like {owner[fname]}')
+        owner[fname] = repr(col)
+        files[col] = fname
+    return files
+
+
+class OHLCVStore:
+    def __init__(self, root=STORE_DIR):
+        self.root = root
+        self._meta = {}
+
+    def _dir(self, symbol):
+        return os.path.join(self.root, symbol)
+
+    def symbols(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(s for s in os.listdir(self.root)
+                      if os.path.exists(os.path.join(self.root, s, 'meta.json')))
+
+    def meta(self, symbol):
+        if symbol not in self._meta:
+            with open(os.path.join(self._dir(symbol), 'meta.json')) as f:
+                self._meta[symbol] = json.load(f)
+        return self._meta[symbol]
+
+    def columns(self, symbol):
+        return list(self.meta(symbol)['columns'])
+
+    def write(self, symbol, df):
+        '''writes (replaces) a symbol. Columns must be numeric or bool, stored
+        like SymbolWriter does'''
+        files = _field_files([str(col) for col in df.columns])
+        df = df.sort_index()
+        path = self._dir(symbol)
+        os.makedirs(path, exist_ok=True)
+        index = pd.DatetimeIndex(df.index)
+        if index.tz is not None:
+            index = index.tz_convert('UTC').tz_localize(None)
+        np.save(os.path.join(path, 'index.npy'), index.as_unit('ns').asi8.astype(np.int64))
+        columns = {}
+        for col in df.columns:
+            values = df[col].to_numpy()
+            dtype = _column_dtype(values.dtype)
+            fname = files[str(col)]
+            np.save(os.path.join(path, fname), np.ascontiguousarray(values, dtype=dtype))
+            columns[str(col)] = {'file': fname, 'dtype': np.dtype(dtype).name}
+        meta = {'symbol': symbol, 'index_name': df.index.name, 'rows': len(df), 'columns': columns}
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=1)
+        self._meta.pop(symbol, None)
+
+    def writer(self, symbol, columns, index_name=None):
+        '''SymbolWriter that builds (replaces) symbol from appended chunks'''
+        return SymbolWriter(self, symbol, columns, index_name)
+
+    def index(self, symbol):
+        '''raw int64 ns timestamps (memmap)'''
+        return np.load(os.path.join(self._dir(symbol), 'index.npy'), mmap_mode='r')
+
+    def _bounds(self, symbol, start, end):
+        ts = self.index(symbol)
+        lo = 0 if start is None else int(np.searchsorted(ts, pd.Timestamp(start).value, 'left'))
+        hi = len(ts) if end is None else int(np.searchsorted(ts, pd.Timestamp(end).value, 'right'))
+        return ts, lo, hi
+
+    def read_arrays(self, symbol, start=None, end=None, columns=None):
+        '''zero-copy: dict of memmap slices, plus '_index' with the timestamps'''
+        meta = self.meta(symbol)
+        ts, lo, hi = self._bounds(symbol, start, end)
+        out = {'_index': ts[lo:hi]}
+        for col in (columns if columns is not None else meta['columns']):
+            fname = meta['columns'][col]['file']
+            out[col] = np.load(os.path.join(self._dir(symbol), fname), mmap_mode='r')[lo:hi]
+        return out
+
+    def read(self, symbol, start=None, end=None, columns=None):
+        '''DataFrame over [start, end] for the requested columns'''
+        arrays = self.read_arrays(symbol, start, end, columns)
+        index = pd.DatetimeIndex(arrays.pop('_index').view('datetime64[ns]'),
+                                 name=self.meta(symbol)['index_name'])
+        return pd.DataFrame(arrays, index=index, copy=False)
+
+    def latest(self, symbols, column='Close', rows=260):
+        '''the last `rows` values of column for every symbol: a (rows x
+        symbols) float64 panel aligned on each symbol's last bar (NaN above a
+        shorter history) and the int64 ns time of that bar (-1 for a missing
+        symbol). The panel is kept in <root>/_latest/, so the next call only
+        reads the symbols whose meta.json changed since'''
+        n = len(symbols)
+        stamps = np.full(n, -1, dtype=np.int64)
+        for j, symbol in enumerate(symbols):
+            try:
+                stamps[j] = os.stat(os.path.join(self._dir(symbol), 'meta.json')).st_mtime_ns
+            except FileNotFoundError:
+                pass
+        panel = np.full((rows, n), np.nan)
+        last = np.full(n, -1, dtype=np.int64)
+        path = os.path.join(self.root, '_latest', _field_file(column)[:-4] + f'_{rows}.npz')
+        fresh = np.zeros(n, dtype=bool)
+        same_symbols = False
+        if os.path.exists(path):
+            with np.load(path) as snap:
+                position = {s: i for i, s in enumerate(snap['symbols'].tolist())}
+                at = np.array([position.get(s, -1) for s in symbols], dtype=np.int64)
+                fresh = (at >= 0) & (snap['stamps'][np.maximum(at, 0)] == stamps)
+                panel[:, fresh] = snap['panel'][:, at[fresh]]
+                last[fresh] = snap['last'][at[fresh]]
+                same_symbols = len(position) == n and bool((at == np.arange(n)).all())
+        stale = np.flatnonzero(~fresh & (stamps >= 0))
+        for j in stale:
+            values = _read_tail(os.path.join(self._dir(symbols[j]), _field_file(column)), rows)
+            panel[rows - len(values):, j] = values
+            ts = _read_tail(os.path.join(self._dir(symbols[j]), 'index.npy'), 1)
+            last[j] = ts[0] if len(ts) else -1
+        if len(stale) or not same_symbols:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = path + '.tmp.npz'
+            np.savez(tmp, symbols=np.array(symbols, dtype=str), stamps=stamps, panel=panel, last=last)
+            os.replace(tmp, path)
+        return panel, last
+
+
+def _read_tail(path, rows):
+    '''last `rows` values of a 1-D .npy file, reading only its header and
+    those bytes'''
+    with open(path, 'rb', buffering=0) as f:
+        head = f.read(128)
+        # magic, version, header length, then the header dict as text
+        offset = (10 if head[6] == 1 else 12) + int.from_bytes(head[8:10] if head[6] == 1 else head[8:12], 'little')
+        if offset > len(head):
+            head += f.read(offset - len(head))
+        descr = head[head.index(b"'descr': '") + 10:]
+        dtype = np.dtype(descr[:descr.index(b"'")].decode())
+        count = (os.fstat(f.fileno()).st_size - offset)//dtype.itemsize
+        k = min(rows, count)
+        f.seek(offset + (count - k)*dtype.itemsize)
+        return np.frombuffer(f.read(k*dtype.itemsize), dtype=dtype)
+
+
+def _column_dtype(dtype):
+    if dtype == np.bool_:
+        return np.bool_
+    return np.int64 if np.issubdtype(dtype, np.integer) else np.float64
+
+
+class SymbolWriter:
+    '''writes a symbol whose rows arrive in chunks, without holding them:
+    append() spools each column to a raw file next to the store files,
+    close() turns the spools into the .npy files and meta.json. The index
+    is int64 ns; columns keep the type of the first chunk appended: bool,
+    int64 for integers, float64 otherwise'''
+
+    def __init__(self, store, symbol, columns, index_name=None, copy_rows=1 << 20):
+        self.store = store
+        self.symbol = symbol
+        self.columns = [str(c) for c in columns]
+        self.index_name = index_name
+        self.copy_rows = copy_rows
+        self.files = _field_files(self.columns)
+        self.path = store._dir(symbol)
+        os.makedirs(self.path, exist_ok=True)
+        names = ['index'] + [self.files[c][:-4] for c in self.columns]
+        self.spools = [open(os.path.join(self.path, name + '.raw'), 'wb') for name in names]
+        self.dtypes = None
+        self.rows = 0
+
+    def append(self, df):
+        index = pd.DatetimeIndex(df.index)
+        if index.tz is not None:
+            index = index.tz_convert('UTC').tz_localize(None)
+        index.as_unit('ns').asi8.astype(np.int64).tofile(self.spools[0])
+        if self.dtypes is None:
+            self.dtypes = [_column_dtype(df[col].dtype) for col in self.columns]
+        for f, col, dtype in zip(self.spools[1:], self.columns, self.dtypes):
+            np.ascontiguousarray(df[col].to_numpy(), dtype=dtype).tofile(f)
+        self.rows += len(df)
+
+    def close(self):
+        for f in self.spools:
+            f.close()
+        columns = {}
+        dtypes = [np.int64] + (self.dtypes or [np.float64]*len(self.columns))
+        for f, col, dtype in zip(self.spools, [None] + self.columns, dtypes):
+            fname = 'index.npy' if col is None else self.files[col]
+            raw = np.memmap(f.name, dtype=dtype, mode='r') if self.rows else np.zeros(0, dtype)
+            out = np.lib.format.open_memmap(os.path.join(self.path, fname), 'w+', dtype, (self.rows,))
+            for a in range(0, self.rows, self.copy_rows):
+                out[a:a + self.copy_rows] = raw[a:a + self.copy_rows]
+            out.flush()
+            del out, raw
+            os.remove(f.name)
+            if col is not None:
+                columns[col] = {'file': fname, 'dtype': np.dtype(dtype).name}
+        meta = {'symbol': self.symbol, 'index_name': self.index_name, 'rows': self.rows, 'columns': columns}
+        with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=1)
+        self.store._meta.pop(self.symbol, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def import_pickle(path, symbol, root=STORE_DIR):
+    '''converts a pickled DataFrame (e.g. goog_data.pkl) into the store'''
+    store = OHLCVStore(root)
+    store.write(symbol, pd.read_pickle(path))
+    return store
+
+
+class StoreSource(DataSource):
+    '''market_data source backed by the store'''
+
+    def __init__(self, root=STORE_DIR):
+        self.store = OHLCVStore(root)
+        self.name = 'store:' + os.path.abspath(root)
+
+    def fetch(self, symbol, start, end):
+        return self.store.read(symbol, start, end)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='columnar OHLCV store')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    imp = sub.add_parser('import', help='import a pickled DataFrame')
+    imp.add_argument('path')
+    imp.add_argument('symbol')
+    show = sub.add_parser('show', help='print a slice')
+    show.add_argument('symbol')
+    show.add_argument('--start')
+    show.add_argument('--end')
+    show.add_argument('--columns', nargs='*')
+    for p in (imp, show):
+        p.add_argument('--root', default=STORE_DIR)
+    args = parser.parse_args()
+
+    if args.cmd == 'import':
+        store = import_pickle(args.path, args.symbol, args.root)
+        print(f'{args.symbol}: {store.meta(args.symbol)["rows"]} rows, columns {store.columns(args.symbol)}')
+    else:
+        print(OHLCVStore(args.root).read(args.symbol, args.start, args.end, args.columns))
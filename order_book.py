@@ -0,0 +1,555 @@
+'''limit order book replay and fill model: the orders of a strategy matched
+against recorded L2 data instead of filled at the close.
+
+L2 events, one per row (read_l2 reads them from .csv/.parquet in chunks):
+  timestamp, kind, side, price, size
+  kind  update  the displayed size at that price is now `size` (0 removes it)
+        trade   `size` traded at that price against that side of the book
+  side  bid or ask (b/a, 0/1 also read). A trade on the ask was a buy.
+
+The book is a price grid: depth[side, level] with level = price/tick_size
+minus a base, widened as prices move out of it. Our own orders are not in
+the data, they sit on the levels in FIFO queues (array-backed linked
+lists), each with the displayed size that was ahead of it when it joined:
+  - a trade at the level takes the size ahead first, then our orders in
+    arrival order, then whatever is behind us
+  - a drop in displayed size that no trade explains is a cancel, taken
+    pro rata from ahead of and behind each of our orders
+  - a trade through a price we are resting at (a sell below our bid) or
+    new size posted across it fills us at our price first
+  - market orders and marketable limits take the displayed size level by
+    level from the best price (paying the spread), the rest of a limit
+    rests at its price, the rest of a market order is killed
+The book does not react to our orders: size we take stays gone only until
+the next update of that level.
+
+latency: an order or a cancel reaches the book `latency` after it is sent,
+and a fill is known to the strategy `latency` after it happens (the
+'known' column). Orders and cancels arriving at the time of an event go
+before it.
+
+The whole replay is one kernel (numba-compiled when available, see
+jit.py) over the event arrays and the struct-of-arrays order state;
+OrderBook.run() takes the events chunk by chunk and orders can be
+submitted between chunks.
+
+usage: python order_book.py l2.csv --strategy double_ma --bar 1min --qty 100
+                            [--latency 1ms] [--limit] [--tif 30s] [-p key=value]
+       python order_book.py --synthetic 5000000 --strategy turtle'''
+
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from bars import CHUNK_ROWS, read_chunks, to_ns
+from jit import njit
+
+BID, ASK = 0, 1
+UPDATE, TRADE = 0, 1
+STATES = ('pending', 'open', 'filled', 'cancelled', 'killed')
+_PENDING, _OPEN, _FILLED, _CANCELLED, _KILLED = range(5)
+_NEVER = np.iinfo(np.int64).max
+_EPS = 1e-9
+
+# int order rows
+_ARRIVE, _SIDE, _LEVEL, _STATE, _NEXT, _PREV = range(6)
+# float order rows
+_QTY, _LEFT, _AHEAD = range(3)
+# book state: best level per side, best level holding our orders per side,
+# our open orders per side, next order / cancel to arrive
+_BEST, _OWN_BEST, _OWN_COUNT, _NEXT_ORDER, _NEXT_CANCEL = 0, 2, 4, 6, 7
+# fill rows
+_F_ORDER, _F_TIME, _F_LEVEL, _F_MAKER = range(4)
+
+
+@njit(cache=True)
+def _better(side, a, b):
+    '''level a is a better price than b on that side of the book'''
+    return a > b if side == BID else a < b
+
+
+@njit(cache=True)
+def _set_depth(depth, book, side, level, size):
+    depth[side, level] = size
+    best = book[_BEST + side]
+    if size > 0:
+        if best < 0 or _better(side, level, best):
+            book[_BEST + side] = level
+    elif level == best:
+        step = -1 if side == BID else 1
+        level += step
+        while 0 <= level < depth.shape[1] and depth[side, level] <= 0:
+            level += step
+        book[_BEST + side] = level if 0 <= level < depth.shape[1] else -1
+
+
+@njit(cache=True)
+def _push(q_head, q_tail, oi, book, side, level, k):
+    oi[_NEXT, k] = -1
+    oi[_PREV, k] = q_tail[side, level]
+    if q_tail[side, level] >= 0:
+        oi[_NEXT, q_tail[side, level]] = k
+    else:
+        q_head[side, level] = k
+    q_tail[side, level] = k
+    book[_OWN_COUNT + side] += 1
+    own = book[_OWN_BEST + side]
+    if own < 0 or _better(side, level, own):
+        book[_OWN_BEST + side] = level
+
+
+@njit(cache=True)
+def _remove(q_head, q_tail, oi, book, k):
+    side, level = oi[_SIDE, k], oi[_LEVEL, k]
+    prev, nxt = oi[_PREV, k], oi[_NEXT, k]
+    if prev >= 0:
+        oi[_NEXT, prev] = nxt
+    else:
+        q_head[side, level] = nxt
+    if nxt >= 0:
+        oi[_PREV, nxt] = prev
+    else:
+        q_tail[side, level] = prev
+    book[_OWN_COUNT + side] -= 1
+    if book[_OWN_COUNT + side] == 0:
+        book[_OWN_BEST + side] = -1
+    elif level == book[_OWN_BEST + side] and q_head[side, level] < 0:
+        step = -1 if side == BID else 1
+        level += step
+        while q_head[side, level] < 0:
+            level += step
+        book[_OWN_BEST + side] = level
+
+
+@njit(cache=True)
+def _fill(q_head, q_tail, oi, of, book, k, t, level, qty, maker, base, fi, fq, nfills):
+    fi[_F_ORDER, nfills] = k
+    fi[_F_TIME, nfills] = t
+    fi[_F_LEVEL, nfills] = level + base
+    fi[_F_MAKER, nfills] = maker
+    fq[nfills] = qty
+    of[_LEFT, k] -= qty
+    if of[_LEFT, k] <= _EPS:
+        of[_LEFT, k] = 0.0
+        if oi[_STATE, k] == _OPEN:
+            _remove(q_head, q_tail, oi, book, k)
+        oi[_STATE, k] = _FILLED
+    return nfills + 1
+
+
+@njit(cache=True)
+def _fill_through(depth, q_head, q_tail, oi, of, book, side, stop, vol, t, base, fi, fq, nfills):
+    '''volume coming in on `side` at a worse price than our resting orders
+    (from level stop on, inclusive) fills them best price first. Returns
+    (volume left, fills written)'''
+    level = book[_OWN_BEST + side]
+    step = -1 if side == BID else 1
+    while vol > _EPS and level >= 0 and book[_OWN_COUNT + side] > 0 and \
+            (level == stop or _better(side, level, stop)):
+        k = q_head[side, level]
+        while k >= 0 and vol > _EPS:
+            nxt = oi[_NEXT, k]
+            qty = min(vol, of[_LEFT, k])
+            vol -= qty
+            nfills = _fill(q_head, q_tail, oi, of, book, k, t, level, qty, 1, base, fi, fq, nfills)
+            k = nxt
+        level += step
+    return vol, nfills
+
+
+@njit(cache=True)
+def _arrive(depth, q_head, q_tail, oi, of, book, k, t, base, fi, fq, nfills):
+    side = oi[_SIDE, k]
+    opp = 1 - side
+    limit = oi[_LEVEL, k]
+    # take the other side while it is at or inside the limit
+    level = book[_BEST + opp]
+    while of[_LEFT, k] > _EPS and level >= 0 and (limit < 0 or level == limit or _better(side, limit, level)):
+        qty = min(of[_LEFT, k], depth[opp, level])
+        nfills = _fill(q_head, q_tail, oi, of, book, k, t, level, qty, 0, base, fi, fq, nfills)
+        _set_depth(depth, book, opp, level, depth[opp, level] - qty)
+        level = book[_BEST + opp]
+    if oi[_STATE, k] == _FILLED:
+        return nfills
+    if limit < 0:
+        oi[_STATE, k] = _KILLED
+    else:
+        oi[_STATE, k] = _OPEN
+        of[_AHEAD, k] = depth[side, limit]
+        _push(q_head, q_tail, oi, book, side, limit, k)
+    return nfills
+
+
+@njit(cache=True)
+def _book_kernel(ts, kind, side, level, size, start, base, depth, book, q_head, q_tail,
+                 oi, of, n_orders, c_time, c_order, fi, fq, nfills):
+    '''replays events start.. Stops early, before an event, when the fill
+    buffers could overflow; returns (next event, fills written)'''
+    n = len(ts)
+    cap = len(fq)
+    slack = n_orders + depth.shape[1] + 1 # the most one event or arrival can fill
+    for i in range(start, n):
+        t = ts[i]
+        # orders and cancels that reach the book first
+        while True:
+            ko = book[_NEXT_ORDER]
+            kc = book[_NEXT_CANCEL]
+            t_order = oi[_ARRIVE, ko] if ko < n_orders else _NEVER
+            t_cancel = c_time[kc] if kc < len(c_time) else _NEVER
+            if min(t_order, t_cancel) > t:
+                break
+            if nfills + slack > cap:
+                return i, nfills
+            if t_order <= t_cancel:
+                nfills = _arrive(depth, q_head, q_tail, oi, of, book, ko, t_order, base, fi, fq, nfills)
+                book[_NEXT_ORDER] += 1
+            else:
+                k = c_order[kc]
+                if oi[_STATE, k] == _OPEN:
+                    _remove(q_head, q_tail, oi, book, k)
+                    oi[_STATE, k] = _CANCELLED
+                elif oi[_STATE, k] == _PENDING:
+                    oi[_STATE, k] = _CANCELLED
+                book[_NEXT_CANCEL] += 1
+        if nfills + slack > cap:
+            return i, nfills
+
+        s, lv, v = side[i], level[i], size[i]
+        if kind[i] == TRADE:
+            # through our better priced orders first, then the queue at lv
+            vol = v
+            if book[_OWN_COUNT + s] > 0 and book[_OWN_BEST + s] != lv and _better(s, book[_OWN_BEST + s], lv):
+                stop = lv + 1 if s == BID else lv - 1
+                vol, nfills = _fill_through(depth, q_head, q_tail, oi, of, book, s, stop, vol, t,
+                                            base, fi, fq, nfills)
+            taken = 0.0 # displayed size ahead of our orders taken
+            k = q_head[s, lv]
+            while k >= 0 and vol > _EPS:
+                nxt = oi[_NEXT, k]
+                ahead = min(vol, max(of[_AHEAD, k] - taken, 0.0))
+                vol -= ahead
+                taken += ahead
+                if vol <= _EPS:
+                    break
+                qty = min(vol, of[_LEFT, k])
+                vol -= qty
+                nfills = _fill(q_head, q_tail, oi, of, book, k, t, lv, qty, 1, base, fi, fq, nfills)
+                k = nxt
+            k = q_head[s, lv]
+            while k >= 0:
+                of[_AHEAD, k] = max(of[_AHEAD, k] - taken, 0.0)
+                k = oi[_NEXT, k]
+            _set_depth(depth, book, s, lv, max(depth[s, lv] - taken - max(vol, 0.0), 0.0))
+        else:
+            old = depth[s, lv]
+            if v < old and q_head[s, lv] >= 0:
+                # cancels, pro rata ahead of and behind each of our orders
+                k = q_head[s, lv]
+                while k >= 0:
+                    of[_AHEAD, k] = min(of[_AHEAD, k]*v/old, v)
+                    k = oi[_NEXT, k]
+            _set_depth(depth, book, s, lv, v)
+            opp = 1 - s
+            own = book[_OWN_BEST + opp]
+            if v > old and book[_OWN_COUNT + opp] > 0 and (own == lv or _better(opp, own, lv)):
+                # new size posted across our resting orders trades with them
+                vol, nfills = _fill_through(depth, q_head, q_tail, oi, of, book, opp, lv, v - old, t,
+                                            base, fi, fq, nfills)
+    return n, nfills
+
+
+def read_l2(path, chunk_rows=CHUNK_ROWS, time_col='timestamp', kind_col='kind', side_col='side',
+            price_col='price', size_col='size', time_unit=None):
+    '''yields (int64 ns timestamps, int8 kinds, int8 sides, float64 prices,
+    float64 sizes) per chunk of a .csv or .parquet L2 file'''
+    for df in read_chunks(path, [time_col, kind_col, side_col, price_col, size_col], chunk_rows):
+        yield (to_ns(df[time_col], time_unit), _codes(df[kind_col], {'u': UPDATE, 't': TRADE}),
+               _codes(df[side_col], {'b': BID, 'a': ASK}),
+               df[price_col].to_numpy(dtype=np.float64), df[size_col].to_numpy(dtype=np.float64))
+
+
+def _codes(column, letters):
+    '''0/1 as they are, words by their first letter'''
+    if pd.api.types.is_numeric_dtype(column):
+        codes = column.to_numpy()
+    else:
+        codes = column.astype(str).str[0].str.lower().map(
+            dict(letters, **{str(v): v for v in letters.values()})).to_numpy()
+    if pd.isna(codes).any() or not np.isin(codes, (0, 1)).all():
+        raise ValueError(f'{column.name}: expected one of {sorted(letters)} or 0/1')
+    return codes.astype(np.int8)
+
+
+def synthetic_l2(n, seed=0, price=100.0, tick_size=0.01, levels=10, trade_share=0.1):
+    '''about n random L2 events around a random-walk mid, for tests and
+    benchmarks: updates within `levels` ticks of the mid on either side,
+    trades at the touch, and the level the mid moves onto emptied so the
+    book never crosses. Returns the read_l2 tuple'''
+    rng = np.random.default_rng(seed)
+    ts = pd.Timestamp('2024-01-02 14:30').value + np.cumsum(rng.integers(1, 10_000_000, n))
+    move = rng.choice([-1, 0, 1], n, p=[0.002, 0.996, 0.002])
+    mid = np.round(price/tick_size) + np.cumsum(move)
+    kind = (rng.random(n) < trade_share).astype(np.int8)
+    side = rng.integers(0, 2, n).astype(np.int8)
+    offset = np.where(kind == TRADE, 1, rng.integers(1, levels + 1, n))
+    ticks = np.where(side == BID, mid - offset, mid + offset)
+    size = np.where(kind == TRADE, rng.integers(1, 300, n),
+                    rng.integers(0, 6, n)*100).astype(np.float64)
+    moved = np.flatnonzero(move)
+    clear = (np.zeros(len(moved), dtype=np.int8), np.where(move[moved] > 0, ASK, BID).astype(np.int8),
+             mid[moved], np.zeros(len(moved)))
+    kind, side, ticks, size = (np.insert(a, moved, c) for a, c in zip((kind, side, ticks, size), clear))
+    return np.insert(ts, moved, ts[moved]), kind, side, ticks*tick_size, size
+
+
+class OrderBook:
+    '''replay state: the book, our orders and the fills so far. submit() and
+    cancel() orders, run() the events chunk by chunk'''
+
+    def __init__(self, tick_size=0.01, latency=0, levels=1024):
+        self.tick_size = tick_size
+        self.latency = pd.Timedelta(latency).value
+        self.base = None # tick of level 0
+        self.depth = np.zeros((2, levels))
+        self.q_head = np.full((2, levels), -1, dtype=np.int64)
+        self.q_tail = np.full((2, levels), -1, dtype=np.int64)
+        self.book = np.array([-1, -1, -1, -1, 0, 0, 0, 0], dtype=np.int64)
+        self.oi = np.zeros((6, 64), dtype=np.int64)
+        self.of = np.zeros((3, 64))
+        self.ticks = np.zeros(64, dtype=np.int64) # limit ticks, -1 for market orders
+        self.refs = np.zeros(64) # reference price per order, for slippage
+        self.sent = np.zeros(64, dtype=np.int64)
+        self.n_orders = 0
+        self.c_time = np.zeros(0, dtype=np.int64)
+        self.c_order = np.zeros(0, dtype=np.int64)
+        self.last_time = np.iinfo(np.int64).min
+        self.events = 0
+        self._fills = []
+
+    def _ns(self, t):
+        return int(t) if isinstance(t, (int, np.integer)) else pd.Timestamp(t).value
+
+    def submit(self, t, side, qty, price=None, cancel_after=None, ref_price=np.nan):
+        '''sends an order at time t: side 'buy'/'sell' (or +1/-1), a limit
+        price or None for a market order, cancel_after a Timedelta for a
+        limit that should not rest longer. ref_price is the fill the
+        strategy assumed (the close). Returns the order id'''
+        t = self._ns(t)
+        if t + self.latency < self.last_time:
+            raise ValueError('order arrives before events already replayed')
+        if self.n_orders and t < self.sent[self.n_orders - 1]:
+            raise ValueError('orders must be submitted in time order')
+        if qty <= 0:
+            raise ValueError('qty must be positive, the side gives the direction')
+        k = self.n_orders
+        if k == self.oi.shape[1]:
+            self.oi, self.of = np.hstack([self.oi, np.zeros_like(self.oi)]), np.hstack([self.of, np.zeros_like(self.of)])
+            self.ticks, self.refs, self.sent = (np.concatenate([a, np.zeros_like(a)])
+                                                for a in (self.ticks, self.refs, self.sent))
+        buy = side.lower() in ('buy', 'b') if isinstance(side, str) else side > 0
+        self.oi[:, k] = (t + self.latency, BID if buy else ASK, -1, _PENDING, -1, -1)
+        self.of[:, k] = (qty, qty, 0.0)
+        self.ticks[k] = -1 if price is None else int(round(price/self.tick_size))
+        self.refs[k] = ref_price
+        self.sent[k] = t
+        self.n_orders += 1
+        if cancel_after is not None and price is not None:
+            self.cancel(k, t + pd.Timedelta(cancel_after).value)
+        return k
+
+    def cancel(self, order, t):
+        '''cancel request sent at t, effective if the order still rests when it arrives'''
+        arrive = self._ns(t) + self.latency
+        if arrive < self.last_time:
+            raise ValueError('cancel arrives before events already replayed')
+        self.c_time = np.append(self.c_time, arrive)
+        self.c_order = np.append(self.c_order, order)
+
+    def _cover(self, lo, hi):
+        '''widens the grid to hold ticks lo..hi'''
+        levels = self.depth.shape[1]
+        if self.base is None:
+            self.base = lo - levels//2 + (hi - lo)//2
+        if lo >= self.base and hi < self.base + levels:
+            return
+        new_base = min(lo, self.base) - levels//4
+        width = max(hi, self.base + levels - 1) + levels//4 - new_base + 1
+        shift = self.base - new_base
+        depth = np.zeros((2, width))
+        depth[:, shift:shift + levels] = self.depth
+        heads = []
+        for q in (self.q_head, self.q_tail):
+            grown = np.full((2, width), -1, dtype=np.int64)
+            grown[:, shift:shift + levels] = q
+            heads.append(grown)
+        self.depth, (self.q_head, self.q_tail) = depth, heads
+        for j in (_BEST, _BEST + 1, _OWN_BEST, _OWN_BEST + 1):
+            if self.book[j] >= 0:
+                self.book[j] += shift
+        limits = self.oi[_LEVEL, :self.n_orders]
+        limits[limits >= 0] += shift
+        self.base = new_base
+
+    def run(self, ts, kind, side, price, size):
+        '''replays one chunk of events (the read_l2 arrays, in time order)'''
+        ts = np.ascontiguousarray(ts, dtype=np.int64)
+        if not len(ts):
+            return self
+        ticks = np.rint(np.asarray(price, dtype=np.float64)/self.tick_size).astype(np.int64)
+        pending = self.book[_NEXT_ORDER]
+        limits = self.ticks[pending:self.n_orders]
+        limits = limits[limits >= 0]
+        self._cover(min(ticks.min(), limits.min(initial=ticks.min())),
+                    max(ticks.max(), limits.max(initial=ticks.max())))
+        self.oi[_LEVEL, pending:self.n_orders] = np.where(
+            self.ticks[pending:self.n_orders] >= 0, self.ticks[pending:self.n_orders] - self.base, -1)
+        # cancels not yet arrived, in arrival order
+        done = self.book[_NEXT_CANCEL]
+        order = done + np.argsort(self.c_time[done:], kind='stable')
+        self.c_time[done:], self.c_order[done:] = self.c_time[order], self.c_order[order]
+
+        kind = np.ascontiguousarray(kind, dtype=np.int8)
+        side = np.ascontiguousarray(side, dtype=np.int8)
+        size = np.ascontiguousarray(size, dtype=np.float64)
+        levels = ticks - self.base
+        i, n = 0, len(ts)
+        cap = 4*(self.n_orders + self.depth.shape[1]) + 1024
+        while i < n:
+            fi, fq = np.zeros((4, cap), dtype=np.int64), np.zeros(cap)
+            i, count = _book_kernel(ts, kind, side, levels, size, i, self.base, self.depth, self.book,
+                                    self.q_head, self.q_tail, self.oi, self.of, self.n_orders,
+                                    self.c_time, self.c_order, fi, fq, 0)
+            if count:
+                self._fills.append((fi[:, :count].copy(), fq[:count].copy()))
+            cap *= 2
+        self.events += n
+        self.last_time = int(ts[-1])
+        return self
+
+    def _prices(self, ticks):
+        '''ticks/ticks-per-unit rounds exactly for ticks like 0.01'''
+        scale = 1/self.tick_size
+        return ticks/round(scale) if abs(scale - round(scale)) < 1e-9 else ticks*self.tick_size
+
+    def top(self):
+        '''(bid price, bid size, ask price, ask size), NaN for an empty side'''
+        out = []
+        for side in (BID, ASK):
+            level = self.book[_BEST + side]
+            out += [self._prices(level + self.base), self.depth[side, level]] if level >= 0 else [np.nan, np.nan]
+        return tuple(out)
+
+    def fills(self):
+        '''every fill: order, time, known (time + latency), side, price, qty, maker'''
+        if self._fills:
+            fi = np.hstack([f[0] for f in self._fills])
+            fq = np.concatenate([f[1] for f in self._fills])
+        else:
+            fi, fq = np.zeros((4, 0), dtype=np.int64), np.zeros(0)
+        order = fi[_F_ORDER]
+        return pd.DataFrame({
+            'order': order,
+            'time': pd.to_datetime(fi[_F_TIME]),
+            'known': pd.to_datetime(fi[_F_TIME] + self.latency),
+            'side': np.where(self.oi[_SIDE, order] == BID, 'buy', 'sell'),
+            'price': self._prices(fi[_F_LEVEL]),
+            'qty': fq,
+            'maker': fi[_F_MAKER].astype(bool),
+        })
+
+    def orders(self):
+        '''per order: sent, side, qty, limit, status, filled, avg_price and
+        slippage per share against ref_price (positive: worse than assumed)'''
+        n = self.n_orders
+        fills = self.fills()
+        value = np.bincount(fills['order'], weights=fills['price']*fills['qty'], minlength=n)[:n]
+        filled = self.of[_QTY, :n] - self.of[_LEFT, :n]
+        sign = np.where(self.oi[_SIDE, :n] == BID, 1.0, -1.0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            avg_price = np.where(filled > 0, value/filled, np.nan)
+        return pd.DataFrame({
+            'sent': pd.to_datetime(self.sent[:n]),
+            'side': np.where(sign > 0, 'buy', 'sell'),
+            'qty': self.of[_QTY, :n],
+            'limit': np.where(self.ticks[:n] >= 0, self._prices(self.ticks[:n]), np.nan),
+            'status': np.asarray(STATES, dtype=object)[self.oi[_STATE, :n]],
+            'filled': filled,
+            'avg_price': avg_price,
+            'ref_price': self.refs[:n],
+            'slippage': sign*(avg_price - self.refs[:n]),
+        }, index=pd.RangeIndex(n, name='order'))
+
+
+def submit_quantities(book, times, quantities, prices=None, limit=False, cancel_after=None):
+    '''sends the nonzero signed share quantities of a strategy (orders*shares,
+    or the change in position) at their times; prices are the fills the
+    strategy assumed, and the limit prices with limit=True'''
+    times = pd.DatetimeIndex(times).as_unit('ns').asi8
+    quantities = np.nan_to_num(np.asarray(quantities, dtype=np.float64))
+    prices = np.full(len(times), np.nan) if prices is None else np.asarray(prices, dtype=np.float64)
+    ids = []
+    for t, qty, price in zip(times[quantities != 0], quantities[quantities != 0],
+                             prices[quantities != 0]):
+        ids.append(book.submit(int(t), 1 if qty > 0 else -1, abs(qty), price if limit else None,
+                               cancel_after, ref_price=price))
+    return np.asarray(ids, dtype=np.int64)
+
+
+if __name__ == '__main__':
+    from bars import TimeBars, aggregate
+    from cli import STRATEGIES, parse_params
+    parser = argparse.ArgumentParser(description='strategy orders filled against replayed L2 data')
+    parser.add_argument('l2', nargs='?', help='.csv or .parquet: timestamp, kind, side, price, size')
+    parser.add_argument('--synthetic', type=int, default=None, help='replay this many random events instead')
+    parser.add_argument('--strategy', choices=['double_ma', 'naive_momentum', 'turtle', 'apo'], default='double_ma')
+    parser.add_argument('-p', '--param', action='append', help='strategy key=value, repeatable')
+    parser.add_argument('--bar', default='1min', help='bars the strategy runs on, built from the trades')
+    parser.add_argument('--qty', type=float, default=100, help='shares per order')
+    parser.add_argument('--tick-size', type=float, default=0.01)
+    parser.add_argument('--latency', default='0ms')
+    parser.add_argument('--limit', action='store_true', help='limit orders at the close instead of market orders')
+    parser.add_argument('--tif', default=None, help='cancel unfilled limits after this long, e.g. 30s')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    parser.add_argument('--out', default=None, help='write the fills to this csv')
+    args = parser.parse_args()
+
+    if args.synthetic:
+        events = synthetic_l2(args.synthetic, tick_size=args.tick_size)
+        chunks = lambda: (tuple(a[i:i + args.chunk_rows] for a in events)
+                          for i in range(0, len(events[0]), args.chunk_rows))
+    elif args.l2:
+        chunks = lambda: read_l2(args.l2, args.chunk_rows)
+    else:
+        parser.error('give an L2 file or --synthetic N')
+
+    # bars from the trades, the strategy on the bars, its orders at each bar's end
+    trades = ((ts[k == TRADE], p[k == TRADE], s[k == TRADE]) for ts, k, _, p, s in chunks())
+    bars = aggregate(trades, TimeBars(args.bar))
+    result = STRATEGIES[args.strategy](bars, 'Close', **parse_params(args.param))
+    if 'position' in result: # apo sizes its own trades
+        quantities = np.diff(result['position'].to_numpy(), prepend=0)
+    else:
+        quantities = result['orders'].to_numpy()*args.qty
+    book = OrderBook(args.tick_size, args.latency)
+    submit_quantities(book, bars.index + pd.Timedelta(args.bar), quantities, bars['Close'].to_numpy(),
+                      args.limit, args.tif)
+
+    t0 = time.perf_counter()
+    in_book = 0.0
+    for chunk in chunks():
+        t1 = time.perf_counter()
+        book.run(*chunk)
+        in_book += time.perf_counter() - t1
+    elapsed = time.perf_counter() - t0
+    orders = book.orders()
+    fills = book.fills()
+    if args.out:
+        fills.to_csv(args.out, index=False)
+    print(orders['status'].value_counts().to_string())
+    done = orders[orders['filled'] > 0]
+    print(f'{len(bars)} bars, {len(orders)} orders, {len(fills)} fills, '
+          f'{done["filled"].sum()/max(orders["qty"].sum(), 1e-12):.1%} of the quantity filled')
+    print(f'slippage against the close: {np.nansum(done["slippage"]*done["filled"]):.2f} total, '
+          f'{np.nanmean(done["slippage"]) if len(done) else np.nan:.4f} per share on average')
+    print(f'{book.events} events replayed in {elapsed:.3f}s, {in_book:.3f}s of it in the book '
+          f'({book.events/in_book/1e6:.2f}M events/s)')
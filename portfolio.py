@@ -0,0 +1,479 @@
+'''multi-symbol portfolio simulation: the volatility-adjusted APO or the
+turtle strategy on every symbol of a (time x symbols) close panel, all
+symbols advanced bar by bar on one merged timeline and trading out of one
+cash account.
+
+risk rules, checked on every order:
+  - buys are paid from the shared cash (short sales credit it)
+  - |position|*price of a symbol stays under max_symbol_weight*equity
+  - sum of |position|*price stays under max_gross_leverage*equity
+  - with vol_sizing the trade size is num_shares_per_trade/v_factor,
+    v_factor = std/STD_BASIS as in 7_volatility_adj_strats.py (capped at
+    max_size_scale times the base size)
+Orders that would break a limit are cut down to what fits. Within a bar
+all the decisions are taken first, then the orders that reduce a position
+are filled (freeing cash and room), then the ones that add, in symbol
+order.
+
+A NaN close means the symbol has no bar at that time: no update, and it
+stays marked at its last price.
+
+State is struct-of-arrays: one row per field, one column per symbol, and
+the whole bar loop is one kernel (numba-compiled when available, see
+jit.py). Portfolio.run() can be called again with the next block of rows,
+so long histories go through in chunks (store_chunks reads them from an
+ohlcv_store directory); the trade log and the equity curve are the only
+outputs that grow.
+
+With one symbol, no limits and vol_sizing off the APO trades exactly like
+apo_backtest.'''
+
+import numpy as np
+import pandas as pd
+from backtest import APO_PARAMS
+from jit import njit
+from rolling_moments import RollingState, rolling_push, rolling_var
+
+PORTFOLIO_PARAMS = dict(
+    cash=1_000_000.0,
+    max_symbol_weight=0.05,
+    max_gross_leverage=1.0,
+    vol_sizing=True,
+    max_size_scale=4.0,
+)
+TURTLE_PARAMS = dict(
+    window_entry=50,
+    window_exit=25,
+    num_shares_per_trade=10,
+    std_basis=15,
+    std_period=20,
+)
+STRATEGIES = ('apo', 'turtle')
+_APO, _TURTLE = 0, 1
+
+# float state rows
+(_BUY_VALUE, _SELL_VALUE, _LAST_BUY, _LAST_SELL, _OPEN_PNL, _PNL, _LAST_PRICE,
+ _EMA_FAST, _EMA_SLOW, _EXIT_SUM, _HIGH, _LOW) = range(12)
+# int state rows
+_POSITION, _BARS, _MAX_AT, _MIN_AT, _TRADES = range(5)
+# account
+_CASH = 0
+# strategy parameter slots
+(_P_BASE_QTY, _P_STD_BASIS, _P_MAX_SCALE, _P_VOL_SIZING, _P_MAX_SYMBOL, _P_MAX_GROSS,
+ _P_K_FAST, _P_K_SLOW, _P_BUY_ENTRY, _P_SELL_ENTRY, _P_MIN_MOVE, _P_MIN_PROFIT,
+ _P_ENTRY, _P_EXIT) = range(14)
+
+
+@njit(cache=True)
+def _rescan(ring, j, first, last, sign):
+    '''bar number of the max (sign=1) or min (sign=-1) of ring over
+    bars first..last, the latest one on ties'''
+    w = ring.shape[1]
+    best = first
+    best_value = sign*ring[j, first % w]
+    at = first % w
+    for t in range(first + 1, last + 1):
+        at += 1
+        if at == w:
+            at = 0
+        if sign*ring[j, at] >= best_value:
+            best = t
+            best_value = sign*ring[j, at]
+    return best
+
+
+@njit(cache=True)
+def _clamp(qty, position, price, cash, equity, gross, max_symbol, max_gross):
+    '''cuts qty down so the exposure limits and the cash hold'''
+    target = position + qty
+    room = min(max_symbol*equity, max_gross*equity - (gross - abs(position)*price))
+    cap = int(room//price) if room > 0 else 0
+    if target > 0 and target > position:
+        target = min(target, max(cap, position))
+    elif target < 0 and target < position:
+        target = max(target, min(-cap, position))
+    qty = target - position
+    if qty > 0 and qty*price > cash:
+        qty = int(cash//price)
+    return qty
+
+
+@njit(cache=True)
+def _fill(j, qty, price, fs, istate, account):
+    if qty > 0:
+        fs[_LAST_BUY, j] = price
+        fs[_BUY_VALUE, j] += price*qty
+    else:
+        fs[_LAST_SELL, j] = price
+        fs[_SELL_VALUE, j] += price*(-qty)
+    istate[_POSITION, j] += qty
+    istate[_TRADES, j] += 1
+    account[_CASH] -= qty*price
+
+
+# the per-symbol update is written out in the kernel on purpose: an njit
+# call that takes the state arrays costs more than the update itself. The
+# rolling std is the exception, so its numerics live only in rolling_moments
+
+@njit(cache=True)
+def _portfolio_kernel(kind, close, start, row_offset, p, fs, istate, mstate, mwindow,
+                      ring, account, want, equity_out, cash_out, gross_out, net_out, positions_out,
+                      trade_row, trade_sym, trade_qty, trade_price, ntrades):
+    '''runs rows start.. of close. Stops early, before a bar, when the trade
+    buffers could overflow; returns (next row, trades written)'''
+    n, m = close.shape
+    cap = len(trade_row)
+    base_qty = p[_P_BASE_QTY]
+    std_basis = p[_P_STD_BASIS]
+    max_size = base_qty*p[_P_MAX_SCALE]
+    vol_sizing = p[_P_VOL_SIZING] != 0
+    max_symbol = p[_P_MAX_SYMBOL]
+    max_gross = p[_P_MAX_GROSS]
+    k_fast = p[_P_K_FAST]
+    k_slow = p[_P_K_SLOW]
+    buy_entry = p[_P_BUY_ENTRY]
+    sell_entry = p[_P_SELL_ENTRY]
+    min_move = p[_P_MIN_MOVE]
+    min_profit = p[_P_MIN_PROFIT]
+    entry = int(p[_P_ENTRY])
+    exit_ = int(p[_P_EXIT])
+    w = ring.shape[1]
+
+    for i in range(start, n):
+        if ntrades + m > cap:
+            return i, ntrades
+        # mark to the new closes and take every decision
+        market = 0.0
+        gross = 0.0
+        for j in range(m):
+            x = close[i, j]
+            want[j] = 0
+            position = istate[_POSITION, j]
+            if x == x:
+                fs[_LAST_PRICE, j] = x
+                bars = istate[_BARS, j]
+
+                # rolling std: the rolling_moments sums, powers 1-2
+                rolling_push(mstate, mwindow, j, bars, x, 2)
+                v_factor = 1.0
+                if bars > 0:
+                    v_factor = np.sqrt(rolling_var(mstate, j))/std_basis
+
+                size = int(base_qty)
+                if vol_sizing:
+                    size = int(min(base_qty/v_factor, max_size)) if v_factor > 0 else int(max_size)
+
+                if kind == _APO:
+                    # VolatilityAdjustedAPO.on_bar
+                    if fs[_EMA_FAST, j] == 0:
+                        fs[_EMA_FAST, j] = x
+                        fs[_EMA_SLOW, j] = x
+                    else:
+                        fs[_EMA_FAST, j] = (x - fs[_EMA_FAST, j])*k_fast/v_factor + fs[_EMA_FAST, j]
+                        fs[_EMA_SLOW, j] = (x - fs[_EMA_SLOW, j])*k_slow + fs[_EMA_SLOW, j]
+                    apo = fs[_EMA_FAST, j] - fs[_EMA_SLOW, j]
+                    open_pnl = fs[_OPEN_PNL, j]
+                    if ((apo >= sell_entry*v_factor and abs(x - fs[_LAST_SELL, j]) > min_move)
+                            or (position > 0 and (apo >= 0 or open_pnl > min_profit/v_factor))):
+                        want[j] = -size
+                    elif ((apo < buy_entry*v_factor and abs(x - fs[_LAST_BUY, j]) > min_move)
+                            or (position < 0 and (apo <= 0 or open_pnl > min_profit/v_factor))):
+                        want[j] = size
+                else:
+                    # turtle_strat on the previous closes: breakout entry
+                    # when flat, whole position out when the close crosses
+                    # the window_exit mean
+                    if position == 0:
+                        if bars >= entry:
+                            if x > fs[_HIGH, j]:
+                                want[j] = size
+                            elif x < fs[_LOW, j]:
+                                want[j] = -size
+                    elif bars >= exit_:
+                        mean = fs[_EXIT_SUM, j]/exit_
+                        if (position > 0 and x < mean) or (position < 0 and x > mean):
+                            want[j] = -position
+                    # then push this close: ring, exit sum, window extremes
+                    at = bars % w
+                    ring[j, at] = x
+                    fs[_EXIT_SUM, j] += x
+                    if bars >= exit_:
+                        fs[_EXIT_SUM, j] -= ring[j, at - exit_ if at >= exit_ else at - exit_ + w]
+                    first = bars + 1 - entry
+                    if bars == 0 or x >= fs[_HIGH, j]:
+                        istate[_MAX_AT, j] = bars
+                        fs[_HIGH, j] = x
+                    elif istate[_MAX_AT, j] < first:
+                        istate[_MAX_AT, j] = _rescan(ring, j, first, bars, 1.0)
+                        fs[_HIGH, j] = ring[j, istate[_MAX_AT, j] % w]
+                    if bars == 0 or x <= fs[_LOW, j]:
+                        istate[_MIN_AT, j] = bars
+                        fs[_LOW, j] = x
+                    elif istate[_MIN_AT, j] < first:
+                        istate[_MIN_AT, j] = _rescan(ring, j, first, bars, -1.0)
+                        fs[_LOW, j] = ring[j, istate[_MIN_AT, j] % w]
+                istate[_BARS, j] = bars + 1
+            if position != 0:
+                market += position*fs[_LAST_PRICE, j]
+                gross += abs(position)*fs[_LAST_PRICE, j]
+        equity = account[_CASH] + market
+
+        # orders that reduce a position
+        for j in range(m):
+            qty = want[j]
+            if qty == 0:
+                continue
+            position = istate[_POSITION, j]
+            if qty*position < 0 and abs(qty) <= abs(position):
+                price = fs[_LAST_PRICE, j]
+                _fill(j, qty, price, fs, istate, account)
+                gross -= abs(qty)*price
+                trade_row[ntrades] = row_offset + i
+                trade_sym[ntrades] = j
+                trade_qty[ntrades] = qty
+                trade_price[ntrades] = price
+                ntrades += 1
+                want[j] = 0
+
+        # orders that add, within the limits; then mark the ledgers
+        net = 0.0
+        for j in range(m):
+            qty = want[j]
+            position = istate[_POSITION, j]
+            price = fs[_LAST_PRICE, j]
+            if qty != 0:
+                qty = _clamp(qty, position, price, account[_CASH], equity, gross, max_symbol, max_gross)
+                if qty != 0:
+                    _fill(j, qty, price, fs, istate, account)
+                    gross += (abs(position + qty) - abs(position))*price
+                    position += qty
+                    trade_row[ntrades] = row_offset + i
+                    trade_sym[ntrades] = j
+                    trade_qty[ntrades] = qty
+                    trade_price[ntrades] = price
+                    ntrades += 1
+            if close[i, j] == close[i, j]:
+                # Ledger.mark
+                if position == 0:
+                    fs[_PNL, j] += fs[_SELL_VALUE, j] - fs[_BUY_VALUE, j]
+                    fs[_BUY_VALUE, j] = 0.0
+                    fs[_SELL_VALUE, j] = 0.0
+                    fs[_OPEN_PNL, j] = 0.0
+                else:
+                    fs[_OPEN_PNL, j] = fs[_SELL_VALUE, j] - fs[_BUY_VALUE, j] + position*price
+            if position != 0:
+                net += position*price
+            if positions_out.shape[0] > 0:
+                positions_out[i, j] = position
+
+        equity_out[i] = account[_CASH] + net
+        cash_out[i] = account[_CASH]
+        gross_out[i] = gross
+        net_out[i] = net
+    return n, ntrades
+
+
+class Portfolio:
+    '''simulation state for a fixed list of symbols. run() the close panel
+    in one go or block by block; the state carries over between calls'''
+
+    def __init__(self, symbols, strategy='apo', **params):
+        if strategy not in STRATEGIES:
+            raise ValueError(f'strategy must be one of {STRATEGIES}, not {strategy!r}')
+        defaults = APO_PARAMS if strategy == 'apo' else TURTLE_PARAMS
+        unknown = set(params) - set(PORTFOLIO_PARAMS) - set(defaults)
+        if unknown:
+            raise TypeError(f'unknown parameters: {sorted(unknown)}')
+        p = dict(PORTFOLIO_PARAMS, **defaults)
+        p.update(params)
+        self.params = p
+        self.symbols = list(symbols)
+        self.strategy = strategy
+        self.kind = _APO if strategy == 'apo' else _TURTLE
+        m = len(self.symbols)
+
+        self.p = np.zeros(14)
+        self.p[_P_BASE_QTY] = p['num_shares_per_trade']
+        self.p[_P_STD_BASIS] = p['std_basis']
+        self.p[_P_MAX_SCALE] = p['max_size_scale']
+        self.p[_P_VOL_SIZING] = bool(p['vol_sizing'])
+        self.p[_P_MAX_SYMBOL] = p['max_symbol_weight']
+        self.p[_P_MAX_GROSS] = p['max_gross_leverage']
+        if strategy == 'apo':
+            self.p[_P_K_FAST] = 2/(p['num_periods_fast'] + 1)
+            self.p[_P_K_SLOW] = 2/(p['num_periods_slow'] + 1)
+            self.p[_P_BUY_ENTRY] = p['apo_value_for_buy_entry']
+            self.p[_P_SELL_ENTRY] = p['apo_value_for_sell_entry']
+            self.p[_P_MIN_MOVE] = p['min_price_move_from_last_trade']
+            self.p[_P_MIN_PROFIT] = p['min_profit_to_close']
+            ring_width = 1
+        else:
+            self.p[_P_ENTRY] = p['window_entry']
+            self.p[_P_EXIT] = p['window_exit']
+            ring_width = max(p['window_entry'], p['window_exit'] + 1)
+        self.std_period = int(p['std_period'])
+
+        self.fs = np.zeros((12, m))
+        self.fs[_LAST_PRICE] = np.nan
+        self.istate = np.zeros((5, m), dtype=np.int64)
+        self.vol = RollingState(self.std_period, m) # the rolling std of every symbol
+        self.ring = np.zeros((m, ring_width))
+        self.account = np.array([float(p['cash'])])
+        self.want = np.zeros(m, dtype=np.int64)
+        self.rows = 0 # rows run so far
+        self._trades = []
+
+    def run(self, close, index=None, record_positions=False):
+        '''advances over the rows of close (time x symbols, NaN = no bar).
+        Returns a dict of per-row arrays: equity, cash, gross, net (and
+        positions with record_positions); trades go to self.trades()'''
+        if isinstance(close, pd.DataFrame):
+            index = close.index if index is None else index
+            close = close[self.symbols].to_numpy()
+        close = np.ascontiguousarray(close, dtype=np.float64)
+        if close.ndim != 2 or close.shape[1] != len(self.symbols):
+            raise ValueError(f'close must be (rows x {len(self.symbols)} symbols)')
+        n, m = close.shape
+        out = {k: np.zeros(n) for k in ('equity', 'cash', 'gross', 'net')}
+        positions = np.zeros((n, m) if record_positions else (0, 0), dtype=np.int64)
+        row = 0
+        cap = max(4*m, n//4)
+        while row < n:
+            buffers = (np.zeros(cap, dtype=np.int64), np.zeros(cap, dtype=np.int64),
+                       np.zeros(cap, dtype=np.int64), np.zeros(cap))
+            row, count = _portfolio_kernel(
+                self.kind, close, row, self.rows, self.p, self.fs, self.istate,
+                self.vol.sums, self.vol.window, self.ring, self.account, self.want,
+                out['equity'], out['cash'], out['gross'], out['net'], positions, *buffers, 0)
+            self._trades.append(tuple(b[:count].copy() for b in buffers) + (index, self.rows))
+            cap *= 2
+        if record_positions:
+            out['positions'] = positions
+        self.rows += n
+        return out
+
+    def trades(self):
+        '''every fill so far: row, time (when run() had an index), symbol, qty, price'''
+        frames = []
+        for rows, syms, qtys, prices, index, first_row in self._trades:
+            df = pd.DataFrame({'row': rows, 'symbol': np.asarray(self.symbols, dtype=object)[syms],
+                               'qty': qtys, 'price': prices})
+            if index is not None:
+                df.insert(1, 'time', np.asarray(index)[rows - first_row])
+            frames.append(df)
+        if not frames:
+            return pd.DataFrame(columns=['row', 'symbol', 'qty', 'price'])
+        return pd.concat(frames, ignore_index=True)
+
+    def summary(self):
+        '''per symbol: position, last price, realised and open pnl, fills'''
+        return pd.DataFrame({
+            'position': self.istate[_POSITION],
+            'last_price': self.fs[_LAST_PRICE],
+            'pnl': self.fs[_PNL],
+            'open_pnl': self.fs[_OPEN_PNL],
+            'trades': self.istate[_TRADES],
+        }, index=pd.Index(self.symbols, name='symbol'))
+
+    @property
+    def cash(self):
+        return float(self.account[_CASH])
+
+
+def align_closes(closes):
+    '''{symbol: close Series} -> one (time x symbols) frame on the union of
+    the timestamps, NaN where a symbol has no bar'''
+    return pd.concat(closes, axis=1).sort_index()
+
+
+def _merge_arrays(indexes, values):
+    '''numpy outer join of sorted int64 indexes -> (index, panel)'''
+    index = np.unique(np.concatenate(indexes)) if indexes else np.zeros(0, dtype=np.int64)
+    panel = np.full((len(index), len(values)), np.nan)
+    for j, (ts, v) in enumerate(zip(indexes, values)):
+        panel[np.searchsorted(index, ts), j] = v
+    return index, panel
+
+
+def store_chunks(store, symbols, column='Close', start=None, end=None, freq='30D'):
+    '''yields (DatetimeIndex, panel) blocks of the merged timeline, one per
+    freq period, reading only that period of every symbol from the store'''
+    arrays = [store.read_arrays(s, columns=[column]) for s in symbols] # memmaps
+    bounds = [a['_index'] for a in arrays]
+    first = min(int(ts[0]) for ts in bounds if len(ts))
+    last = max(int(ts[-1]) for ts in bounds if len(ts))
+    lo = max(first, pd.Timestamp(start).value) if start is not None else first
+    hi = min(last, pd.Timestamp(end).value) if end is not None else last
+    step = pd.Timedelta(freq).value
+    while lo <= hi:
+        stop = min(lo + step, hi + 1)
+        indexes, values = [], []
+        for a_, ts in zip(arrays, bounds):
+            a, b = np.searchsorted(ts, [lo, stop])
+            indexes.append(np.asarray(ts[a:b]))
+            values.append(a_[column][a:b])
+        index, panel = _merge_arrays(indexes, values)
+        if len(index):
+            yield pd.DatetimeIndex(index.view('datetime64[ns]')), panel
+        lo = stop
+
+
+def simulate(close, strategy='apo', record_positions=False, **params):
+    '''one-shot run over a (time x symbols) frame, or an iterable of
+    (index, panel) blocks with symbols= given. Returns (curve frame,
+    trades frame, per-symbol summary)'''
+    if isinstance(close, pd.DataFrame):
+        blocks = [(close.index, close.to_numpy())]
+        symbols = params.pop('symbols', list(close.columns))
+    else:
+        blocks = close
+        symbols = params.pop('symbols')
+    portfolio = Portfolio(symbols, strategy, **params)
+    curves = []
+    for index, panel in blocks:
+        out = portfolio.run(panel, index=index, record_positions=record_positions)
+        positions = out.pop('positions', None)
+        curve = pd.DataFrame(out, index=index)
+        if positions is not None:
+            curve = curve.join(pd.DataFrame(positions, index=index, columns=symbols))
+        curves.append(curve)
+    curve = pd.concat(curves) if curves else pd.DataFrame()
+    return curve, portfolio.trades(), portfolio.summary()
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+    from ohlcv_store import OHLCVStore, STORE_DIR
+    from sweep import parse_values
+
+    parser = argparse.ArgumentParser(description='portfolio simulation over an ohlcv store')
+    parser.add_argument('strategy', choices=STRATEGIES)
+    parser.add_argument('--root', default=STORE_DIR)
+    parser.add_argument('--symbols', default=None, help='comma separated (default: all)')
+    parser.add_argument('--column', default='Close')
+    parser.add_argument('--start', default=None)
+    parser.add_argument('--end', default=None)
+    parser.add_argument('--freq', default='30D', help='timeline block per kernel call')
+    parser.add_argument('-p', '--param', action='append', help='key=value, repeatable')
+    parser.add_argument('--trades', default=None, help='write the fills to this csv')
+    args = parser.parse_args()
+
+    store = OHLCVStore(args.root)
+    symbols = args.symbols.split(',') if args.symbols else store.symbols()
+    params = {}
+    for pair in args.param or ():
+        key, value = pair.split('=', 1)
+        params[key] = parse_values(value)[0]
+    t0 = time.perf_counter()
+    curve, trades, summary = simulate(
+        store_chunks(store, symbols, args.column, args.start, args.end, args.freq),
+        args.strategy, symbols=symbols, **params)
+    elapsed = time.perf_counter() - t0
+    print(summary.to_string())
+    print(f'{len(curve)} bars x {len(symbols)} symbols, {len(trades)} fills in {elapsed:.2f}s')
+    if len(curve):
+        print(f'equity {curve["equity"].iloc[0]:.2f} -> {curve["equity"].iloc[-1]:.2f}, '
+              f'max gross {curve["gross"].max():.2f}')
+    if args.trades:
+        trades.to_csv(args.trades, index=False)
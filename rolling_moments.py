@@ -0,0 +1,384 @@
+'''rolling mean, variance, skew, kurtosis, min and max over the last
+`period` values, O(1) amortized per value.
+
+The moments come from running power sums of (x - K), each one compensated
+(Neumaier). K starts at the first value and is moved to the window mean
+every `period` values, when the sums are rebuilt from the window, so
+rounding error cannot pile up over a long series (one O(period) rebuild
+per period values). Min and max use monotonic deques.
+
+Definitions follow pandas rolling: var/std with ddof=1, skew and kurt are
+the bias corrected G1 / excess G2, NaN until there are 2 / 3 / 4 values; a
+flat window has skew 0 and kurt -3. A NaN takes its row of the window but
+is not a value: it is left out of the sums and the min/max, and
+min_periods counts the valid values only. (pandas skew/kurt stay NaN for a
+while after a window with no values at all; these do not.)
+
+RollingMoments is the streaming API, one update() per value. rolling_moments
+is the batch API over a 1-D series or a (time x columns) panel: a compiled
+kernel with numba (see jit.py), pandas rolling without it. With a
+RollingState it takes the series in consecutive blocks (chunked.py).
+rolling_push / rolling_var are the per-column step and variance for other
+kernels that keep a rolling std in their own state (portfolio.py).'''
+
+import math
+from collections import deque
+import numpy as np
+import pandas as pd
+from instrument import probe
+from jit import njit, HAVE_NUMBA
+
+STATS = ('mean', 'var', 'std', 'skew', 'kurt', 'min', 'max')
+# where each of STATS sits in the kernel's result row
+_RES = (0, 1, 4, 2, 3, 5, 6)
+
+# state layout: shift, count, then (sum, compensation) for powers 1..4
+_K, _N = 0, 1
+_STATE_SIZE = 10
+
+
+@njit(cache=True)
+def _add(state, j, k, term):
+    '''Neumaier step on the k-th (sum, compensation) pair of row j'''
+    s = state[j, k]
+    t = s + term
+    if abs(s) >= abs(term):
+        state[j, k + 1] += (s - t) + term
+    else:
+        state[j, k + 1] += (term - t) + s
+    state[j, k] = t
+
+
+@njit(cache=True)
+def _accumulate(state, j, x, sign, powers=4):
+    if x != x:
+        return
+    d = x - state[j, _K]
+    d2 = d*d
+    _add(state, j, 2, sign*d)
+    _add(state, j, 4, sign*d2)
+    if powers > 2:
+        _add(state, j, 6, sign*d2*d)
+        _add(state, j, 8, sign*d2*d2)
+    state[j, _N] += sign
+
+
+@njit(cache=True)
+def _reset(state, j, shift):
+    for k in range(state.shape[1]):
+        state[j, k] = 0.0
+    state[j, _K] = shift
+
+
+@njit(cache=True)
+def _rebuild(state, window, j, count, powers=4):
+    '''re-anchor row j on the mean of the values in window[j, :count] and
+    recompute its sums'''
+    total = 0.0
+    valid = 0
+    for i in range(count):
+        if window[j, i] == window[j, i]:
+            total += window[j, i]
+            valid += 1
+    _reset(state, j, total/valid if valid else 0.0)
+    for i in range(count):
+        _accumulate(state, j, window[j, i], 1.0, powers)
+
+
+@njit(cache=True)
+def rolling_push(state, window, j, rows, x, powers=4):
+    '''one value into column j of a RollingState's sums and window (rows:
+    how many values the column had before x). Rows are indexed rather than
+    sliced, a view per call costs more than the update'''
+    period = window.shape[1]
+    slot = rows % period
+    if rows >= period:
+        _accumulate(state, j, window[j, slot], -1.0, powers)
+    if state[j, _N] == 0 and x == x:
+        # nothing in the window: anchor on x
+        _reset(state, j, x)
+    window[j, slot] = x
+    _accumulate(state, j, x, 1.0, powers)
+    if slot == period - 1:
+        _rebuild(state, window, j, period, powers)
+
+
+@njit(cache=True)
+def rolling_var(state, j):
+    '''variance (ddof=1) of the values in column j's sums, NaN under 2'''
+    n = state[j, _N]
+    if n < 2:
+        return np.nan
+    d = (state[j, 2] + state[j, 3])/n
+    m2 = (state[j, 4] + state[j, 5])/n - d*d
+    if m2 < 0.0:
+        m2 = 0.0
+    return m2*n/(n - 1)
+
+
+@njit(cache=True)
+def _moments(state, j, out, powers=4):
+    '''out[:4] = mean, var, skew, kurt of column j (skew/kurt not touched
+    with powers=2)'''
+    n = state[j, _N]
+    if n == 0:
+        out[:4 if powers == 4 else 2] = np.nan
+        return
+    d = (state[j, 2] + state[j, 3])/n
+    a2 = (state[j, 4] + state[j, 5])/n
+    a3 = (state[j, 6] + state[j, 7])/n
+    a4 = (state[j, 8] + state[j, 9])/n
+    m2 = a2 - d*d
+    if m2 < 0.0:
+        m2 = 0.0
+    out[0] = state[j, _K] + d
+    out[1] = m2*n/(n - 1) if n > 1 else np.nan
+    if powers < 4:
+        return
+    m3 = a3 - 3*d*a2 + 2*d*d*d
+    m4 = a4 - 4*d*a3 + 6*d*d*a2 - 3*d*d*d*d
+    flat = m2 <= 1e-14*(state[j, _K]*state[j, _K] + a2)
+    if n < 3:
+        out[2] = np.nan
+    elif flat:
+        out[2] = 0.0
+    else:
+        out[2] = math.sqrt(n*(n - 1))/(n - 2)*m3/m2**1.5
+    if n < 4:
+        out[3] = np.nan
+    elif flat:
+        out[3] = -3.0
+    else:
+        out[3] = (n - 1)/((n - 2)*(n - 3))*((n + 1)*(m4/(m2*m2) - 3) + 6)
+
+
+class RollingMoments:
+    '''streaming moments over the last `period` values'''
+
+    def __init__(self, period):
+        self.period = period
+        self.window = np.zeros((1, period))
+        self.state = np.zeros((1, _STATE_SIZE))
+        self.i = 0
+        self._min = deque()
+        self._max = deque()
+        self._out = np.zeros(4)
+        self._dirty = True
+
+    def update(self, x):
+        x = float(x)
+        rolling_push(self.state, self.window, 0, self.i, x)
+        if x == x:
+            while self._min and self._min[-1][1] >= x:
+                self._min.pop()
+            while self._max and self._max[-1][1] <= x:
+                self._max.pop()
+            self._min.append((self.i, x))
+            self._max.append((self.i, x))
+        if self._min and self._min[0][0] <= self.i - self.period:
+            self._min.popleft()
+        if self._max and self._max[0][0] <= self.i - self.period:
+            self._max.popleft()
+        self.i += 1
+        self._dirty = True
+        return self
+
+    def _values(self):
+        if self._dirty:
+            _moments(self.state, 0, self._out)
+            self._dirty = False
+        return self._out
+
+    @property
+    def count(self):
+        '''values in the window, NaN left out'''
+        return int(self.state[0, _N])
+
+    @property
+    def mean(self):
+        return float(self._values()[0])
+
+    @property
+    def var(self):
+        return float(self._values()[1])
+
+    @property
+    def std(self):
+        return math.sqrt(self.var)
+
+    @property
+    def skew(self):
+        return float(self._values()[2])
+
+    @property
+    def kurt(self):
+        return float(self._values()[3])
+
+    @property
+    def min(self):
+        return self._min[0][1] if self._min else np.nan
+
+    @property
+    def max(self):
+        return self._max[0][1] if self._max else np.nan
+
+
+@njit(cache=True)
+def _push_extremes(x, j, i, period, qmin, qmax, heads):
+    '''monotonic deques of row indices for the window min and max. heads:
+    min head, min tail, max head, max tail'''
+    v = x[i, j]
+    while heads[1] > heads[0] and x[qmin[heads[1] - 1], j] >= v:
+        heads[1] -= 1
+    qmin[heads[1]] = i
+    heads[1] += 1
+    if qmin[heads[0]] <= i - period:
+        heads[0] += 1
+    while heads[3] > heads[2] and x[qmax[heads[3] - 1], j] <= v:
+        heads[3] -= 1
+    qmax[heads[3]] = i
+    heads[3] += 1
+    if qmax[heads[2]] <= i - period:
+        heads[2] += 1
+
+
+@njit(cache=True)
+def _expire_extremes(i, period, qmin, qmax, heads):
+    '''a NaN row: nothing to push, the oldest value may leave the window'''
+    if heads[1] > heads[0] and qmin[heads[0]] <= i - period:
+        heads[0] += 1
+    if heads[3] > heads[2] and qmax[heads[2]] <= i - period:
+        heads[2] += 1
+
+
+@njit(cache=True)
+def _rolling_kernel(x, period, min_periods, powers, extremes, slots, out, states, windows, offset):
+    '''out[slots[s], i, j] for the s-th of STATS, skipped when slots[s] < 0.
+    powers=2 only keeps the sums for mean/var/std, extremes=False skips
+    min/max. states/windows hold each column's sums and last `period`
+    values; offset is the number of rows they have already seen (min/max
+    only from offset 0)'''
+    n, m = x.shape
+    res = np.zeros(7)
+    qmin = np.zeros(n, dtype=np.int64)
+    qmax = np.zeros(n, dtype=np.int64)
+    heads = np.zeros(4, dtype=np.int64)
+    need = max(min_periods, 1)
+    for j in range(m):
+        heads[:] = 0
+        count = min(offset, period)
+        since_rebuild = offset % period
+        # rolling_push written out: the call costs more than the update
+        for i in range(n):
+            v = x[i, j]
+            slot = (offset + i) % period
+            if count == period:
+                _accumulate(states, j, windows[j, slot], -1.0, powers)
+            else:
+                count += 1
+            if states[j, _N] == 0 and v == v:
+                _reset(states, j, v)
+            windows[j, slot] = v
+            _accumulate(states, j, v, 1.0, powers)
+            since_rebuild += 1
+            if since_rebuild >= period:
+                _rebuild(states, windows, j, count, powers)
+                since_rebuild = 0
+            if extremes:
+                if x[i, j] == x[i, j]:
+                    _push_extremes(x, j, i, period, qmin, qmax, heads)
+                else:
+                    _expire_extremes(i, period, qmin, qmax, heads)
+            # valid values, not rows
+            if states[j, _N] < need:
+                for s in range(len(slots)):
+                    if slots[s] >= 0:
+                        out[slots[s], i, j] = np.nan
+                continue
+            _moments(states, j, res, powers)
+            res[4] = math.sqrt(res[1])
+            if extremes:
+                res[5] = x[qmin[heads[0]], j]
+                res[6] = x[qmax[heads[2]], j]
+            for s in range(len(slots)):
+                if slots[s] >= 0:
+                    out[slots[s], i, j] = res[_RES[s]]
+
+
+class RollingState:
+    '''what rolling_moments needs to go on where the previous call
+    stopped: pass the same one with consecutive blocks of a series'''
+
+    def __init__(self, period, columns=1):
+        self.period = period
+        self.sums = np.zeros((columns, _STATE_SIZE))
+        self.window = np.zeros((columns, period))
+        self.rows = 0
+
+
+def _pandas_moments(df, period, min_periods, stats):
+    roll = df.rolling(period, min_periods=min_periods)
+    return {s: getattr(roll, s)().to_numpy() for s in stats}
+
+
+@probe('indicator')
+def rolling_moments(x, period, min_periods=None, stats=STATS, state=None):
+    '''dict stat -> rolling values, same shape and type as x (array, Series
+    or DataFrame). min_periods defaults to period, like pandas. state: a
+    RollingState to run a long series block by block (not for min/max);
+    the blocks give exactly the values of one call on the whole series'''
+    min_periods = period if min_periods is None else min_periods
+    values = np.asarray(x, dtype=np.float64)
+    one_d = values.ndim == 1
+    values = values[:, None] if one_d else values
+    if state is not None and {'min', 'max'} & set(stats):
+        raise ValueError('min/max cannot be carried over blocks, use a window of the previous block')
+    if HAVE_NUMBA or state is not None:
+        out = np.empty((len(stats),) + values.shape)
+        slots = np.array([stats.index(s) if s in stats else -1 for s in STATS], dtype=np.int64)
+        powers = 4 if {'skew', 'kurt'} & set(stats) else 2
+        extremes = bool({'min', 'max'} & set(stats))
+        carry = state if state is not None else RollingState(period, values.shape[1])
+        _rolling_kernel(np.ascontiguousarray(values), period, min_periods, powers, extremes, slots, out,
+                        carry.sums, carry.window, carry.rows)
+        carry.rows += len(values)
+        result = {s: out[i] for i, s in enumerate(stats)}
+    else:
+        result = _pandas_moments(pd.DataFrame(values), period, min_periods, stats)
+    for s in stats:
+        v = result[s][:, 0] if one_d else result[s]
+        if isinstance(x, pd.Series):
+            v = pd.Series(v, index=x.index, name=s)
+        elif isinstance(x, pd.DataFrame):
+            v = pd.DataFrame(v, index=x.index, columns=x.columns)
+        result[s] = v
+    return result
+
+
+def rolling_std(x, period, min_periods=None, state=None):
+    return rolling_moments(x, period, min_periods, stats=('std',), state=state)['std']
+
+
+if __name__ == '__main__':
+    # the kernel against pandas rolling on a random walk with a leading NaN,
+    # a lone NaN and a short NaN run
+    import argparse
+    parser = argparse.ArgumentParser(description='compare the rolling_moments kernel with pandas rolling')
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--period', type=int, default=20)
+    parser.add_argument('--min-periods', type=int, default=None)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    x = 100 + np.cumsum(rng.normal(size=(args.rows, 2)), axis=0)
+    x[0, 0] = np.nan
+    x[args.rows//3, 0] = np.nan
+    x[args.rows//2:args.rows//2 + args.period//4, 1] = np.nan
+    min_periods = args.period if args.min_periods is None else args.min_periods
+    got = rolling_moments(x, args.period, args.min_periods)
+    expected = _pandas_moments(pd.DataFrame(x), args.period, min_periods, STATS)
+    for s in STATS:
+        same_nan = np.array_equal(np.isnan(got[s]), np.isnan(expected[s]))
+        both = ~np.isnan(got[s]) & ~np.isnan(expected[s])
+        diff = np.max(np.abs(got[s] - expected[s]), where=both, initial=0.0)
+        print(f'{s:5} NaN rows {"same" if same_nan else "DIFFERENT"}, max abs diff {diff:.2e}')
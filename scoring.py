@@ -0,0 +1,414 @@
+'''online scoring for the 5_basic_ma.py models.
+
+artifacts: one pickle per model, <models dir>/<name>.model, holding a dict
+with the format version, the model kind ('reg' or 'cls'), the feature
+names and a scorer. Scorers are plain numpy: linear models keep coef and
+intercept, KNN keeps its training points in a spatial_index.KDTree built
+when the artifact is made, anything else keeps the fitted estimator.
+
+ScoringService loads the artifacts once. Requests for a model are queued
+and scored together when the micro-batch window closes or the batch is
+full, one vectorized predict per batch. Latency is measured per request,
+from submit to result. Over a local socket the protocol is one JSON object
+per line:
+
+  -> {"id": 1, "model": "ridge", "bars": [{"Open": .., "High": .., "Low": .., "Close": ..}]}
+  <- {"id": 1, "predictions": [..]}
+  -> {"id": 2, "op": "stats"}
+  <- {"id": 2, "stats": {"ridge": {"requests": .., "batches": .., "p50_ms": .., "p99_ms": ..}}}
+
+usage: python scoring.py train [--models-dir models] [--models linear,ridge,knn]
+       python scoring.py serve [--port 8765] [--window-ms 2] [--max-batch 256]
+       python scoring.py bench [--requests 20000] [--concurrency 64] [--socket]'''
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import pickle
+import time
+import numpy as np
+import pandas as pd
+from instrument import LatencyStats
+from ml_features import FEATURES, bar_features, feature_arrays
+from spatial_index import KDTree
+from walk_forward import LinearStats, _sklearn
+
+SRC_DATA_FILENAME = 'goog_data.pkl'
+MODELS_DIR = 'models'
+ARTIFACT_FORMAT = 1
+HOST = '127.0.0.1'
+PORT = 8765
+
+
+class LinearScorer:
+    kind = 'reg'
+
+    def __init__(self, coef, intercept):
+        self.coef = np.asarray(coef, dtype=np.float64)
+        self.intercept = float(intercept)
+
+    def predict(self, x):
+        return x @ self.coef + self.intercept
+
+
+class KNNScorer:
+    '''majority vote of the k nearest training rows, ties to the smallest
+    label like sklearn'''
+    kind = 'cls'
+
+    def __init__(self, x, y, n_neighbors=15):
+        self.classes, self.codes = np.unique(np.asarray(y), return_inverse=True)
+        self.tree = KDTree(x)
+        self.n_neighbors = n_neighbors
+
+    def predict(self, x):
+        _, idx = self.tree.query(x, self.n_neighbors)
+        votes = (self.codes[idx][:, :, None] == np.arange(len(self.classes))).sum(axis=1)
+        return self.classes[votes.argmax(axis=1)]
+
+
+class EstimatorScorer:
+    def __init__(self, kind, model):
+        self.kind = kind
+        self.model = model
+
+    def predict(self, x):
+        return np.asarray(self.model.predict(x))
+
+
+def to_scorer(model, kind):
+    '''fitted sklearn (or walk_forward) model -> scorer'''
+    if hasattr(model, '_fit_X') and getattr(model, 'weights', None) == 'uniform':
+        return KNNScorer(model._fit_X, model.classes_[model._y], model.n_neighbors)
+    if kind == 'reg' and hasattr(model, 'coef_'):
+        return LinearScorer(np.ravel(model.coef_), np.ravel(model.intercept_)[0])
+    return EstimatorScorer(kind, model)
+
+
+def save_model(path, name, scorer, info=None):
+    artifact = {'format': ARTIFACT_FORMAT, 'name': name, 'kind': scorer.kind,
+                'features': list(FEATURES), 'created': time.time(),
+                'info': info or {}, 'scorer': scorer}
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        pickle.dump(artifact, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+
+
+def load_model(path):
+    with open(path, 'rb') as f:
+        artifact = pickle.load(f)
+    if artifact.get('format') != ARTIFACT_FORMAT:
+        raise ValueError(f'{path}: artifact format {artifact.get("format")}, expected {ARTIFACT_FORMAT}')
+    if artifact['features'] != list(FEATURES):
+        raise ValueError(f'{path}: trained on {artifact["features"]}, features are now {FEATURES}')
+    return artifact
+
+
+def load_models(models_dir=MODELS_DIR):
+    return {f[:-len('.model')]: load_model(os.path.join(models_dir, f))
+            for f in sorted(os.listdir(models_dir)) if f.endswith('.model')}
+
+
+def _linear(alpha):
+    def fit(x, y):
+        stats = LinearStats(x.mean(axis=0), y.mean())
+        stats.add(x, y)
+        return LinearScorer(*stats.solve(alpha))
+    return fit
+
+
+def _estimator(kind, make):
+    return lambda x, y: to_scorer(make().fit(x, y), kind)
+
+
+# same settings as 5_basic_ma.py: name -> (kind, fit(x, y) -> scorer)
+TRAINERS = {
+    'linear': ('reg', _linear(0.0)),
+    'ridge': ('reg', _linear(1e5)),
+    'lasso': ('reg', _estimator('reg', _sklearn('linear_model', 'Lasso', alpha=0.1))),
+    'knn': ('cls', lambda x, y: KNNScorer(x, y, n_neighbors=15)),
+    'svc': ('cls', _estimator('cls', _sklearn('svm', 'SVC'))),
+}
+
+
+def train_artifacts(df, models_dir=MODELS_DIR, models=tuple(TRAINERS)):
+    '''fits the models on all of df and writes one artifact each'''
+    features = feature_arrays(df)
+    os.makedirs(models_dir, exist_ok=True)
+    info = {'rows': len(features['x']),
+            'from': str(pd.Timestamp(features['index'][0])),
+            'to': str(pd.Timestamp(features['index'][-1]))}
+    paths = []
+    for name in models:
+        kind, fit = TRAINERS[name]
+        y = features['y_reg'] if kind == 'reg' else features['y_cls']
+        path = os.path.join(models_dir, name + '.model')
+        save_model(path, name, fit(features['x'], y), info)
+        paths.append(path)
+    return paths
+
+
+class BatchStats(LatencyStats):
+    '''LatencyStats plus the number of batches predicted'''
+
+    def __init__(self, size=100000):
+        super().__init__(size)
+        self.batches = 0
+
+    def summary(self):
+        out = super().summary()
+        return {'requests': out.pop('requests'), 'batches': self.batches, **out}
+
+
+class MicroBatcher:
+    '''queues feature rows for one scorer and predicts them in batches'''
+
+    def __init__(self, scorer, window=0.002, max_batch=256):
+        self.scorer = scorer
+        self.window = window
+        self.max_batch = max_batch
+        self.stats = BatchStats()
+        self.queue = asyncio.Queue()
+
+    async def submit(self, x):
+        t0 = time.perf_counter()
+        fut = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((x, fut))
+        result = await fut
+        self.stats.record(time.perf_counter() - t0)
+        return result
+
+    async def _collect(self):
+        batch = [await self.queue.get()]
+        rows = len(batch[0][0])
+        deadline = time.perf_counter() + self.window
+        while rows < self.max_batch:
+            try:
+                item = self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            batch.append(item)
+            rows += len(item[0])
+        return batch
+
+    async def run(self):
+        while True:
+            batch = await self._collect()
+            self.stats.batches += 1
+            try:
+                y = self.scorer.predict(np.concatenate([x for x, _ in batch]))
+            except Exception as e:
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+            start = 0
+            for x, fut in batch:
+                if not fut.done():
+                    fut.set_result(y[start:start + len(x)])
+                start += len(x)
+
+
+class ScoringService:
+    def __init__(self, artifacts, window=0.002, max_batch=256):
+        self.artifacts = artifacts
+        self.batchers = {name: MicroBatcher(a['scorer'], window, max_batch)
+                         for name, a in artifacts.items()}
+        self._tasks = []
+
+    async def start(self):
+        # first call compiles / loads the numba kernels, keep it out of the latencies
+        for a in self.artifacts.values():
+            a['scorer'].predict(np.zeros((1, len(a['features']))))
+        self._tasks = [asyncio.create_task(b.run()) for b in self.batchers.values()]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def predict(self, model, bars):
+        '''in-process client: predictions for bars (see ml_features.bar_features)'''
+        if model not in self.batchers:
+            raise KeyError(f'unknown model {model!r}, have {sorted(self.batchers)}')
+        return await self.batchers[model].submit(bar_features(bars))
+
+    def stats(self):
+        return {name: b.stats.summary() for name, b in self.batchers.items()}
+
+    async def _answer(self, line, writer):
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            response = {'error': f'bad json: {e}'}
+        else:
+            response = {'id': request.get('id')}
+            try:
+                if request.get('op') == 'stats':
+                    response['stats'] = self.stats()
+                else:
+                    response['predictions'] = (await self.predict(request['model'], request['bars'])).tolist()
+            except Exception as e:
+                response['error'] = f'{type(e).__name__}: {e}'
+        writer.write(json.dumps(response).encode() + b'\n')
+
+    async def _handle(self, reader, writer):
+        # every line is answered in its own task, so pipelined requests on
+        # one connection land in the same batch
+        pending = set()
+        try:
+            while line := await reader.readline():
+                task = asyncio.create_task(self._answer(line, writer))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+                await writer.drain()
+            await asyncio.gather(*pending)
+        finally:
+            writer.close()
+
+    async def serve(self, host=HOST, port=PORT):
+        return await asyncio.start_server(self._handle, host, port)
+
+
+class ScoringClient:
+    '''socket client, any number of requests in flight on one connection'''
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.ids = itertools.count()
+        self.waiting = {}
+        self._reader_task = asyncio.create_task(self._read())
+
+    @classmethod
+    async def connect(cls, host=HOST, port=PORT):
+        return cls(*await asyncio.open_connection(host, port))
+
+    async def _read(self):
+        try:
+            while line := await self.reader.readline():
+                response = json.loads(line)
+                fut = self.waiting.pop(response.get('id'), None)
+                if fut is not None and not fut.done():
+                    fut.set_result(response)
+        finally:
+            for fut in self.waiting.values():
+                if not fut.done():
+                    fut.set_exception(ConnectionError('scoring service closed the connection'))
+
+    async def _request(self, request):
+        request['id'] = next(self.ids)
+        fut = asyncio.get_running_loop().create_future()
+        self.waiting[request['id']] = fut
+        self.writer.write(json.dumps(request).encode() + b'\n')
+        await self.writer.drain()
+        response = await fut
+        if 'error' in response:
+            raise RuntimeError(response['error'])
+        return response
+
+    async def predict(self, model, bars):
+        if isinstance(bars, pd.DataFrame):
+            bars = bars[['Open', 'High', 'Low', 'Close']].to_dict('records')
+        response = await self._request({'model': model, 'bars': bars})
+        return np.asarray(response['predictions'])
+
+    async def stats(self):
+        return (await self._request({'op': 'stats'}))['stats']
+
+    async def close(self):
+        self.writer.close()
+        await self._reader_task
+
+
+async def bench(artifacts, bars, requests=20000, concurrency=64, window=0.002,
+                max_batch=256, use_socket=False, port=PORT):
+    '''single-bar requests from `concurrency` concurrent callers, round robin
+    over the models; returns the service stats'''
+    async with ScoringService(artifacts, window, max_batch) as service:
+        server = client = None
+        if use_socket:
+            server = await service.serve(HOST, port)
+            client = await ScoringClient.connect(HOST, port)
+        names = list(artifacts)
+        bar_rows = bars[['Open', 'High', 'Low', 'Close']].to_dict('records')
+        counter = itertools.count()
+
+        async def caller():
+            while (i := next(counter)) < requests:
+                bar = [bar_rows[i % len(bar_rows)]]
+                name = names[i % len(names)]
+                await (client or service).predict(name, bar)
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(caller() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - t0
+        if client is not None:
+            await client.close()
+            server.close()
+            await server.wait_closed()
+        stats = service.stats()
+    stats['_total'] = {'requests': requests, 'seconds': elapsed, 'per_second': requests/elapsed}
+    return stats
+
+
+async def _serve_forever(args):
+    service = ScoringService(load_models(args.models_dir), args.window_ms/1e3, args.max_batch)
+    async with service:
+        server = await service.serve(args.host, args.port)
+        print(f'serving {sorted(service.artifacts)} on {args.host}:{args.port}')
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='online model scoring')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    train = sub.add_parser('train', help='fit the models and write artifacts')
+    train.add_argument('--models', default=','.join(TRAINERS))
+    serve = sub.add_parser('serve', help='score over a local socket')
+    serve.add_argument('--host', default=HOST)
+    serve.add_argument('--port', type=int, default=PORT)
+    bench_cmd = sub.add_parser('bench', help='latency of the loaded models')
+    bench_cmd.add_argument('--requests', type=int, default=20000)
+    bench_cmd.add_argument('--concurrency', type=int, default=64)
+    bench_cmd.add_argument('--socket', action='store_true', help='go through the socket client')
+    bench_cmd.add_argument('--port', type=int, default=PORT)
+    for p in (train, serve, bench_cmd):
+        p.add_argument('--models-dir', default=MODELS_DIR)
+        p.add_argument('--data', default=SRC_DATA_FILENAME)
+    for p in (serve, bench_cmd):
+        p.add_argument('--window-ms', type=float, default=2.0)
+        p.add_argument('--max-batch', type=int, default=256)
+    args = parser.parse_args()
+
+    if args.cmd == 'train':
+        # pickle the scorers as scoring.*, not __main__.*
+        from scoring import train_artifacts
+        for path in train_artifacts(pd.read_pickle(args.data), args.models_dir, args.models.split(',')):
+            print('wrote', path)
+    elif args.cmd == 'serve':
+        asyncio.run(_serve_forever(args))
+    else:
+        stats = asyncio.run(bench(load_models(args.models_dir), pd.read_pickle(args.data),
+                                  args.requests, args.concurrency, args.window_ms/1e3,
+                                  args.max_batch, args.socket, args.port))
+        for name, s in stats.items():
+            print(name, s)
@@ -0,0 +1,226 @@
+'''cross-sectional screener: every signal definition of the repo on the
+latest bars of every symbol of an ohlcv_store, in one pass over a (bars x
+symbols) panel, ranked.
+
+signals, +1 buy / -1 sell / 0 nothing, on the last bar:
+  double_ma        short/long ma crossover (strategies.double_ma orders)
+  turtle           entry or exit order of strategies.turtle_strat
+  naive_momentum   order of strategies.naive_momentum_trading
+  sup_res          trading_support_resistance signal flipping to buy/sell
+  rsi              ta_batch.rsi under rsi_buy (oversold) / over rsi_sell
+  bollinger        close under the lower / over the upper band
+3_ta.py only plots the RSI and the bands; the thresholds here are the
+usual 30/70 and 2 std. The order signals count when they fired within
+the last `within` bars. The path-dependent ones (turtle, momentum,
+support/resistance) start from the first of the `bars` loaded, so they
+match the strategy run over that window, not over the whole history.
+
+score is the sum of the signals; the list is ranked by score, then by
+trend (short ma / long ma - 1).
+
+Each signal is computed for all symbols at once: the strat_kernels state
+machines (numba, see jit.py) and the sup_res one run on the whole panel;
+the rolling windows are numpy reductions over sliding-window views, or
+log2(window) elementwise passes for max/min (pandas rolling goes column by
+column, far too slow for 10k columns), only over the last bars where that
+is all a rule reads.
+Means and stds are summed in a different order than pandas, so a value
+right on a threshold can come out on the other side. The panel comes
+from OHLCVStore.latest(), which keeps it under <root>/_latest and only
+rereads the symbols that changed.
+
+usage: python screener.py [--root ohlcv] [--bars 260] [--top 20] [--side buy]
+                          [--symbols A,B,..] [--column Close] [-p key=value]'''
+
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+from instrument import probe
+from ohlcv_store import OHLCVStore, STORE_DIR
+from strat_kernels import momentum_orders, turtle_orders
+from sup_res import sup_res_bands, sup_res_state_machine
+
+SIGNALS = ('double_ma', 'turtle', 'naive_momentum', 'sup_res', 'rsi', 'bollinger')
+
+SCREEN_PARAMS = dict(
+    short_window=20,
+    long_window=100,
+    window_entry=50,
+    window_exit=25,
+    period_len=5,
+    bin_width=20,
+    rsi_period=20,
+    rsi_buy=30,
+    rsi_sell=70,
+    bb_period=20,
+    std_factor=2,
+    within=1, # bars back an order still counts
+)
+
+
+def _recent(orders, within):
+    '''the latest nonzero order of the last `within` rows, per column'''
+    tail = orders[-within:]
+    hit = tail != 0
+    latest = len(tail) - 1 - np.argmax(hit[::-1], axis=0)
+    return np.where(hit.any(axis=0), tail[latest, np.arange(tail.shape[1])], 0).astype(np.int8)
+
+
+def _windows(close, window, rows=None):
+    '''(rows, symbols, window) view of the windows ending on each of the last
+    `rows` bars (all of them by default), NaN before the first bar. A
+    window with a NaN gives NaN, like pandas rolling with min_periods=window'''
+    n = len(close)
+    rows = n if rows is None else rows
+    need = window + rows - 1
+    if n < need:
+        close = np.concatenate([np.full((need - n, close.shape[1]), np.nan), close])
+    return sliding_window_view(close[len(close) - need:], window, axis=0)
+
+
+def _rolling(close, window, how):
+    '''rolling max/min/mean over the whole panel, NaN for the first window - 1 rows.
+    max/min double the span covered per pass (log2(window) passes over the
+    panel instead of window reads per bar)'''
+    if how == 'mean':
+        return _windows(close, window).mean(axis=-1)
+    # maximum/minimum propagate NaN: a window with one gives NaN, like
+    # pandas rolling with min_periods=window
+    ufunc = np.maximum if how == 'max' else np.minimum
+    out = np.full(close.shape, np.nan)
+    if len(close) < window:
+        return out
+    acc, span = close, 1
+    while 2*span <= window:
+        acc = ufunc(acc[:-span], acc[span:])
+        span *= 2
+    rest = window - span
+    out[window - 1:] = ufunc(acc[:len(acc) - rest], acc[rest:]) if rest else acc
+    return out
+
+
+def _double_ma(close, p):
+    rows = p['within'] + 1
+    short_ma = _windows(close, p['short_window'], rows).mean(axis=-1)
+    long_ma = _windows(close, p['long_window'], rows).mean(axis=-1)
+    signal = np.where(short_ma > long_ma, 1.0, 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        trend = short_ma[-1]/long_ma[-1] - 1
+    return _recent(np.diff(signal, axis=0), p['within']), trend
+
+
+def _turtle(close, p):
+    prev = np.concatenate([np.full((1, close.shape[1]), np.nan), close[:-1]])
+    bands = (_rolling(prev, p['window_entry'], 'max'), _rolling(prev, p['window_entry'], 'min'),
+             _rolling(prev, p['window_exit'], 'mean'))
+    return _recent(turtle_orders(close, p['window_entry'], p['window_exit'], bands=bands), p['within'])
+
+
+def _sup_res(close, p):
+    bin_width = p['bin_width']
+    start = (bin_width - 1) + bin_width
+    n, m = close.shape
+    if n <= start + 1:
+        return np.zeros(m, dtype=np.int8)
+    bands = sup_res_bands(_rolling(close, bin_width + 1, 'min'), _rolling(close, bin_width + 1, 'max'))
+    # NaN before the first decision, like the runs on a DatetimeIndex
+    signal = sup_res_state_machine(close[start:], *(b[start:] for b in bands), np.nan)[-1]
+    changes = np.nan_to_num(np.diff(signal, axis=0))
+    return _recent(np.sign(changes), p['within'])
+
+
+def _rsi(close, p):
+    '''the rule on ta_batch.rsi of the last bar'''
+    window = _windows(close, p['rsi_period'] + 1, 1)[0]
+    last, price = window[:, :-1], window[:, 1:]
+    last = np.where(np.isnan(last), price, last) # the first bar diffs against itself
+    valid = ~np.isnan(price)
+    count = valid.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        avg_gains = np.where(valid, np.maximum(0, price - last), 0).sum(axis=1)/count
+        avg_losses = np.where(valid, np.maximum(0, last - price), 0).sum(axis=1)/count
+        rs = np.where(avg_losses > 0, avg_gains/avg_losses, 0.0)
+    rsi = np.where(valid[:, -1], 100 - 100/(1 + rs), np.nan)
+    return np.where(rsi < p['rsi_buy'], 1, np.where(rsi > p['rsi_sell'], -1, 0)).astype(np.int8)
+
+
+def _bollinger(close, p):
+    '''the rule on ta_batch.bollinger_bands of the last bar'''
+    window = _windows(close, p['bb_period'], 1)[0]
+    valid = ~np.isnan(window)
+    count = valid.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mid = np.where(valid, window, 0).sum(axis=1)/count
+        dev = np.sqrt((np.where(valid, window - mid[:, None], 0)**2).sum(axis=1)/(count - 1))
+    dev = np.where(count <= 2, 0.0, dev) # std warm-up of ta_batch
+    last = close[-1]
+    upper = mid + p['std_factor']*dev
+    lower = mid - p['std_factor']*dev
+    return np.where(last < lower, 1, np.where(last > upper, -1, 0)).astype(np.int8)
+
+
+@probe('signal')
+def screen_panel(close, symbols, last_time=None, signals=SIGNALS, **params):
+    '''close: (bars x symbols), aligned on the last bar. Returns the ranked
+    DataFrame, one row per symbol'''
+    p = dict(SCREEN_PARAMS, **params)
+    close = np.ascontiguousarray(close, dtype=np.float64)
+    out = pd.DataFrame(index=pd.Index(symbols, name='symbol'))
+    if last_time is not None:
+        out['last'] = pd.DatetimeIndex(np.where(last_time < 0, np.iinfo(np.int64).min,
+                                                last_time).view('datetime64[ns]'))
+    out['close'] = close[-1] if len(close) else np.nan
+    double_ma, trend = _double_ma(close, p)
+    computed = {
+        'double_ma': lambda: double_ma,
+        'turtle': lambda: _turtle(close, p),
+        'naive_momentum': lambda: _recent(momentum_orders(close, p['period_len']), p['within']),
+        'sup_res': lambda: _sup_res(close, p),
+        'rsi': lambda: _rsi(close, p),
+        'bollinger': lambda: _bollinger(close, p),
+    }
+    for name in signals:
+        out[name] = computed[name]()
+    out['score'] = out[list(signals)].sum(axis=1).astype(np.int64)
+    out['trend'] = trend
+    return out.sort_values(['score', 'trend'], ascending=False, kind='stable')
+
+
+def screen(store, symbols=None, column='Close', bars=260, signals=SIGNALS, **params):
+    '''screen_panel over the latest `bars` bars of every symbol in store'''
+    symbols = store.symbols() if symbols is None else list(symbols)
+    close, last_time = store.latest(symbols, column, bars)
+    return screen_panel(close, symbols, last_time, signals, **params)
+
+
+if __name__ == '__main__':
+    from cli import parse_params
+    parser = argparse.ArgumentParser(description='rank the symbols of a store by their signals')
+    parser.add_argument('--root', default=STORE_DIR)
+    parser.add_argument('--symbols', default=None, help='comma separated (default: all)')
+    parser.add_argument('--column', default='Close')
+    parser.add_argument('--bars', type=int, default=260)
+    parser.add_argument('--signals', default=','.join(SIGNALS))
+    parser.add_argument('--side', choices=['buy', 'sell', 'both'], default='both')
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('-p', '--param', action='append', help='key=value, repeatable')
+    parser.add_argument('--out', default=None, help='write the full ranking to this csv')
+    args = parser.parse_args()
+
+    store = OHLCVStore(args.root)
+    t0 = time.perf_counter()
+    ranked = screen(store, args.symbols.split(',') if args.symbols else None, args.column, args.bars,
+                    tuple(args.signals.split(',')), **parse_params(args.param))
+    elapsed = time.perf_counter() - t0
+    if args.out:
+        ranked.to_csv(args.out)
+    if args.side == 'buy':
+        shown = ranked[ranked['score'] > 0]
+    elif args.side == 'sell':
+        shown = ranked[ranked['score'] < 0].iloc[::-1]
+    else:
+        shown = ranked[ranked['score'] != 0]
+    print(shown.head(args.top).to_string())
+    print(f'{len(ranked)} symbols screened in {elapsed:.3f}s')
@@ -0,0 +1,290 @@
+'''calendar statistics and stationarity tests from 4_seasonality.py, for one
+series or a panel of symbols.
+
+calendar_stats: return statistics per month, weekday and day of month for
+every symbol, all buckets and symbols in one reduction (a one-hot bucket
+matrix times the stacked returns).
+
+adf_test: augmented Dickey-Fuller with a constant, numpy only. lag=None
+searches 0..maxlag by AIC like statsmodels' adfuller default (the candidate
+regressions are solved from one X'X); an int is the fixed-lag fast mode,
+a single regression.
+
+Screener runs both over a panel (time x symbols). ADF tests go to a
+process pool. Results are cached per symbol in .screen_cache/: the bucket
+sums are extended with the bars after the cached last date, ADF results
+are kept per (date range, lag), so a re-screen only computes new data.
+
+usage: python seasonality.py GOOG AAPL MSFT [--start 2001-01-01] [--end 2018-01-01]
+                             [--lag 1] [--workers 4]'''
+
+import argparse
+import math
+import os
+import pickle
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+
+SCREEN_CACHE_DIR = '.screen_cache'
+BUCKETS = {'month': 12, 'weekday': 7, 'day': 31}
+
+
+def monthly_return(data, column='Adj Close'):
+    '''mean daily return for every (year, month), indexed by month'''
+    dates = pd.DatetimeIndex(data.index)
+    pct_change = data[column].pct_change()
+    monthly = pct_change.groupby([dates.year, dates.month]).mean()
+    monthly = monthly.to_frame('monthly_return')
+    monthly.index.names = ['year', 'month']
+    return monthly.reset_index(level='year', drop=True)
+
+
+# calendar buckets
+
+def _bucket_codes(dates):
+    '''row of the stacked one-hot matrix for every date and bucket kind'''
+    dates = pd.DatetimeIndex(dates)
+    codes, offset = [], 0
+    for kind, size in BUCKETS.items():
+        if kind == 'month':
+            code = dates.month - 1
+        elif kind == 'weekday':
+            code = dates.weekday
+        else:
+            code = dates.day - 1
+        codes.append(np.asarray(code) + offset)
+        offset += size
+    return codes, offset
+
+
+def _returns(prices, prev=None):
+    '''simple returns, NaN when either price is missing. prev: the prices
+    just before the first row, to return on the first row too'''
+    prices = np.asarray(prices, dtype=np.float64)
+    before = np.vstack([np.full((1, prices.shape[1]), np.nan) if prev is None else prev[None, :],
+                        prices[:-1]])
+    return prices/before - 1
+
+
+def bucket_sums(dates, returns):
+    '''(buckets, symbols) count, sum, sum of squares and up-count of the
+    returns, every bucket kind stacked, in one matrix product'''
+    codes, n_buckets = _bucket_codes(dates)
+    onehot = np.zeros((n_buckets, len(returns)))
+    rows = np.arange(len(returns))
+    for code in codes:
+        onehot[code, rows] = 1.0
+    valid = ~np.isnan(returns)
+    r = np.where(valid, returns, 0.0)
+    stacked = np.hstack([valid, r, r*r, r > 0]).astype(np.float64)
+    count, total, squares, up = np.split(onehot @ stacked, 4, axis=1)
+    return {'count': count, 'sum': total, 'sumsq': squares, 'up': up}
+
+
+def _bucket_index():
+    kinds, buckets = [], []
+    for kind, size in BUCKETS.items():
+        kinds += [kind]*size
+        buckets += list(range(size)) if kind == 'weekday' else list(range(1, size + 1))
+    return pd.MultiIndex.from_arrays([kinds, buckets], names=['kind', 'bucket'])
+
+
+def stats_frame(sums, symbols):
+    '''mean, std, t-stat and hit rate per (symbol, kind, bucket)'''
+    count, total, squares, up = sums['count'], sums['sum'], sums['sumsq'], sums['up']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = total/count
+        var = (squares - count*mean*mean)/(count - 1)
+        std = np.sqrt(np.maximum(var, 0.0))
+        t_stat = mean/(std/np.sqrt(count))
+        hit_rate = up/count
+    index = _bucket_index()
+    frames = []
+    for j, symbol in enumerate(symbols):
+        frame = pd.DataFrame({'count': count[:, j], 'mean': mean[:, j], 'std': std[:, j],
+                              't_stat': t_stat[:, j], 'hit_rate': hit_rate[:, j]}, index=index)
+        frames.append(frame[frame['count'] > 0])
+    return pd.concat(frames, keys=list(symbols), names=['symbol'])
+
+
+def calendar_stats(panel):
+    '''calendar bucket return statistics for every column of a price panel'''
+    panel = pd.DataFrame(panel)
+    sums = bucket_sums(panel.index, _returns(panel.to_numpy()))
+    return stats_frame(sums, panel.columns)
+
+
+# augmented Dickey-Fuller, regression with a constant
+
+# MacKinnon (1994) p-value surface and MacKinnon (2010) critical values,
+# constant only, one variable (as in statsmodels.tsa.adfvalues)
+_TAU_MAX, _TAU_MIN, _TAU_STAR = 2.74, -18.83, -1.61
+_TAU_SMALLP = [2.1659, 1.4412, 0.038269]
+_TAU_LARGEP = [1.7339, 0.93202, -0.12745, -0.010368]
+_TAU_CRIT = {'1%': [-3.43035, -6.5393, -16.786, -79.433],
+             '5%': [-2.86154, -2.8903, -4.234, -40.040],
+             '10%': [-2.56677, -1.5384, -2.809, 0.0]}
+
+
+def mackinnon_p(stat):
+    if stat > _TAU_MAX:
+        return 1.0
+    if stat < _TAU_MIN:
+        return 0.0
+    coef = _TAU_SMALLP if stat <= _TAU_STAR else _TAU_LARGEP
+    z = sum(c*stat**i for i, c in enumerate(coef))
+    return 0.5*math.erfc(-z/math.sqrt(2))
+
+
+def mackinnon_crit(nobs):
+    return {k: c[0] + c[1]/nobs + c[2]/nobs**2 + c[3]/nobs**3 for k, c in _TAU_CRIT.items()}
+
+
+def _adf_design(x, lags):
+    '''[level, lagged diffs.., const] and the diffs they explain'''
+    dx = np.diff(x)
+    nobs = len(dx) - lags
+    cols = [x[lags:-1]] + [dx[lags - i:len(dx) - i] for i in range(1, lags + 1)] + [np.ones(nobs)]
+    return np.column_stack(cols), dx[lags:]
+
+
+def adf_test(x, lag=None, maxlag=None):
+    '''augmented Dickey-Fuller test with a constant. lag=None: pick the lag
+    in 0..maxlag with the lowest AIC (default maxlag 12*(n/100)^(1/4)),
+    otherwise use `lag` as is'''
+    x = np.asarray(x, dtype=np.float64)
+    x = x[~np.isnan(x)]
+    n = len(x)
+    if lag is None:
+        if maxlag is None:
+            maxlag = min(n//2 - 2, int(math.ceil(12*(n/100)**0.25)))
+        # every candidate on the common sample of the longest one; the
+        # regressors for `lags` are the first lags + 1 columns plus const
+        design, y = _adf_design(x, maxlag)
+        m = len(y)
+        xtx = design.T @ design
+        xty = design.T @ y
+        yty = y @ y
+        best = None
+        for lags in range(maxlag + 1):
+            cols = list(range(lags + 1)) + [maxlag + 1]
+            beta = np.linalg.lstsq(xtx[np.ix_(cols, cols)], xty[cols], rcond=None)[0]
+            ssr = max(yty - beta @ xty[cols], 1e-300)
+            aic = m*math.log(ssr/m) + 2*len(cols)
+            if best is None or aic < best[0]:
+                best = (aic, lags)
+        lag = best[1]
+    design, y = _adf_design(x, lag)
+    beta = np.linalg.lstsq(design, y, rcond=None)[0]
+    nobs, k = design.shape
+    ssr = float(((y - design @ beta)**2).sum())
+    cov = ssr/(nobs - k)*np.linalg.pinv(design.T @ design)
+    stat = float(beta[0]/math.sqrt(cov[0, 0]))
+    return {'adf_stat': stat, 'p_value': mackinnon_p(stat), 'lags': lag, 'nobs': nobs,
+            **{'crit_' + k: v for k, v in mackinnon_crit(nobs).items()}}
+
+
+def _adf_task(task):
+    symbol, values, lag = task
+    return symbol, adf_test(values, lag)
+
+
+# screening a panel with a per-symbol cache
+
+class Screener:
+    def __init__(self, cache_dir=SCREEN_CACHE_DIR, lag=None, workers=None):
+        self.cache_dir = cache_dir
+        self.lag = lag
+        self.workers = workers
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, symbol):
+        return os.path.join(self.cache_dir, f'{symbol}.pkl')
+
+    def _load(self, symbol):
+        try:
+            with open(self._path(symbol), 'rb') as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _save(self, symbol, entry):
+        tmp = self._path(symbol) + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(entry, f)
+        os.replace(tmp, self._path(symbol))
+
+    def _update_sums(self, symbol, series):
+        '''bucket sums for the series, reusing the cached ones when the
+        series only grew at the end'''
+        entry = self._load(symbol)
+        first, last = series.index[0], series.index[-1]
+        extend = (entry is not None and entry['first'] == first and entry['last'] <= last
+                  and entry['last'] in series.index
+                  and series.loc[entry['last']] == entry['last_price'])
+        if extend and entry['last'] == last:
+            return entry, 0
+        if extend:
+            new = series.loc[series.index > entry['last']]
+            returns = _returns(new.to_numpy()[:, None], prev=np.array([entry['last_price']]))
+            added = bucket_sums(new.index, returns)
+            sums = {k: entry['sums'][k] + added[k] for k in added}
+            adf = entry['adf']
+        else:
+            new = series
+            sums = bucket_sums(series.index, _returns(series.to_numpy()[:, None]))
+            adf = {}
+        entry = {'first': first, 'last': last, 'last_price': float(series.iloc[-1]),
+                 'sums': sums, 'adf': adf}
+        return entry, len(new)
+
+    def screen(self, panel):
+        '''(calendar stats, adf table) for every column of a price panel'''
+        panel = pd.DataFrame(panel)
+        entries, series_of, new_bars = {}, {}, {}
+        for symbol in panel.columns:
+            series = panel[symbol].dropna()
+            series_of[symbol] = series
+            entries[symbol], new_bars[symbol] = self._update_sums(symbol, series)
+
+        adf_key = lambda s: (str(entries[s]['first']), str(entries[s]['last']), self.lag)
+        tasks = [(s, series_of[s].to_numpy(), self.lag) for s in panel.columns
+                 if adf_key(s) not in entries[s]['adf']]
+        if tasks:
+            if self.workers == 1 or len(tasks) == 1:
+                results = list(map(_adf_task, tasks))
+            else:
+                with Pool(min(self.workers or os.cpu_count(), len(tasks))) as pool:
+                    results = pool.map(_adf_task, tasks)
+            for symbol, result in results:
+                entries[symbol]['adf'][adf_key(symbol)] = result
+        for symbol in panel.columns:
+            if new_bars[symbol] or symbol in (t[0] for t in tasks):
+                self._save(symbol, entries[symbol])
+
+        symbols = list(panel.columns)
+        sums = {k: np.hstack([entries[s]['sums'][k] for s in symbols]) for k in entries[symbols[0]]['sums']}
+        adf = pd.DataFrame([{'symbol': s, 'start': entries[s]['first'], 'end': entries[s]['last'],
+                             **entries[s]['adf'][adf_key(s)]} for s in symbols]).set_index('symbol')
+        return stats_frame(sums, symbols), adf
+
+
+if __name__ == '__main__':
+    from market_data import load_prices
+    parser = argparse.ArgumentParser(description='seasonality and stationarity screen')
+    parser.add_argument('symbols', nargs='+')
+    parser.add_argument('--start', default='2001-01-01')
+    parser.add_argument('--end', default='2018-01-01')
+    parser.add_argument('--column', default='Adj Close')
+    parser.add_argument('--lag', type=int, default=None, help='fixed ADF lag (default: AIC search)')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--cache-dir', default=SCREEN_CACHE_DIR)
+    parser.add_argument('--kind', choices=list(BUCKETS), default='month')
+    args = parser.parse_args()
+
+    panel = pd.DataFrame({s: load_prices(s, args.start, args.end)[args.column] for s in args.symbols})
+    calendar, adf = Screener(args.cache_dir, args.lag, args.workers).screen(panel)
+    pd.set_option('display.width', 1000)
+    print(adf.to_string())
+    print(calendar.xs(args.kind, level='kind').to_string())
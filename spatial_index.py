@@ -0,0 +1,119 @@
+'''static k-d tree for nearest neighbour lookups on small feature vectors
+(the KNN model in 5_basic_ma.py), built once and queried in batches.
+
+The tree is flat arrays: the points are reordered so every node owns a
+contiguous slice [lo, hi), inner nodes split on the widest dimension at the
+median. Queries walk it with an explicit stack and a sorted k-best list,
+compiled with numba when it is there (see jit.py).'''
+
+import numpy as np
+from jit import njit
+
+LEAF_SIZE = 16
+
+
+@njit(cache=True)
+def _query_kernel(points, lo, hi, dim, val, left, right, queries, k, out_dist, out_idx):
+    m, d = queries.shape
+    stack = np.empty(256, dtype=np.int64)
+    bounds = np.empty(256)
+    best_d = np.empty(k)
+    best_i = np.empty(k, dtype=np.int64)
+    for q in range(m):
+        best_d[:] = np.inf
+        best_i[:] = -1
+        stack[0] = 0
+        bounds[0] = 0.0
+        sp = 1
+        while sp > 0:
+            sp -= 1
+            node = stack[sp]
+            bound = bounds[sp]
+            if bound >= best_d[k - 1]:
+                continue
+            if left[node] < 0:
+                for p in range(lo[node], hi[node]):
+                    dist = 0.0
+                    for c in range(d):
+                        diff = points[p, c] - queries[q, c]
+                        dist += diff*diff
+                    if dist < best_d[k - 1]:
+                        j = k - 1
+                        while j > 0 and best_d[j - 1] > dist:
+                            best_d[j] = best_d[j - 1]
+                            best_i[j] = best_i[j - 1]
+                            j -= 1
+                        best_d[j] = dist
+                        best_i[j] = p
+            else:
+                diff = queries[q, dim[node]] - val[node]
+                if diff < 0:
+                    near, far = left[node], right[node]
+                else:
+                    near, far = right[node], left[node]
+                # far side first so the near side is searched first
+                stack[sp] = far
+                bounds[sp] = max(bound, diff*diff)
+                stack[sp + 1] = near
+                bounds[sp + 1] = bound
+                sp += 2
+        out_dist[q] = np.sqrt(best_d)
+        out_idx[q] = best_i
+
+
+class KDTree:
+    def __init__(self, points, leaf_size=LEAF_SIZE):
+        points = np.asarray(points, dtype=np.float64)
+        if points.ndim != 2 or len(points) == 0:
+            raise ValueError('points must be a non-empty 2-D array')
+        order = np.arange(len(points))
+        lo, hi, dim, val, left, right = [], [], [], [], [], []
+
+        def new_node(a, b):
+            lo.append(a)
+            hi.append(b)
+            dim.append(0)
+            val.append(0.0)
+            left.append(-1)
+            right.append(-1)
+            return len(lo) - 1
+
+        todo = [new_node(0, len(points))]
+        while todo:
+            node = todo.pop()
+            a, b = lo[node], hi[node]
+            if b - a <= leaf_size:
+                continue
+            sub = points[order[a:b]]
+            d = int(np.argmax(sub.max(axis=0) - sub.min(axis=0)))
+            mid = (b - a)//2
+            part = np.argpartition(sub[:, d], mid)
+            order[a:b] = order[a:b][part]
+            dim[node] = d
+            val[node] = points[order[a + mid], d]
+            left[node] = new_node(a, a + mid)
+            right[node] = new_node(a + mid, b)
+            todo += [left[node], right[node]]
+
+        self.order = order
+        self.points = np.ascontiguousarray(points[order])
+        self.lo = np.array(lo, dtype=np.int64)
+        self.hi = np.array(hi, dtype=np.int64)
+        self.dim = np.array(dim, dtype=np.int64)
+        self.val = np.array(val, dtype=np.float64)
+        self.left = np.array(left, dtype=np.int64)
+        self.right = np.array(right, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.points)
+
+    def query(self, x, k=1):
+        '''(dist, idx) of the k nearest points to every row of x, nearest
+        first. idx refers to the rows of the points given to the constructor'''
+        x = np.ascontiguousarray(np.atleast_2d(np.asarray(x, dtype=np.float64)))
+        k = min(k, len(self.points))
+        dist = np.empty((len(x), k))
+        idx = np.empty((len(x), k), dtype=np.int64)
+        _query_kernel(self.points, self.lo, self.hi, self.dim, self.val,
+                      self.left, self.right, x, k, dist, idx)
+        return dist, self.order[idx]
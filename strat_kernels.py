@@ -0,0 +1,178 @@
+'''typed-array kernels for the path-dependent strategies in strategies.py
+(turtle, naive momentum). Inputs are 1-D close arrays or 2-D
+(time x symbols) panels; a panel runs every symbol in one call.
+
+With numba (see jit.py) the state machines are compiled loops, parallel
+over symbols. Without it they fall back to numpy: the momentum counter is
+vectorized along time, the turtle machine jumps from trade to trade with
+precomputed next-signal indices, so python only loops once per trade.'''
+
+import numpy as np
+import pandas as pd
+from instrument import probe
+from jit import njit, prange, HAVE_NUMBA
+
+
+def _as_2d(close):
+    close = np.asarray(close, dtype=np.float64)
+    return (close[:, None], True) if close.ndim == 1 else (close, False)
+
+
+# naive momentum: +1 after period_len consecutive up closes, -1 after
+# period_len down closes. Unchanged closes keep the count.
+
+@njit(cache=True, parallel=True)
+def _momentum_kernel(close, period_len, orders, state):
+    '''state: (count, previous close) per column, read and written back so
+    the next block goes on from here. A fresh run starts from (0, close[0])'''
+    n, m = close.shape
+    for j in prange(m):
+        count = int(state[0, j])
+        prev_price = state[1, j]
+        for i in range(n):
+            price = close[i, j]
+            if price > prev_price:
+                if count < 0:
+                    count = 0
+                count += 1
+            elif price < prev_price:
+                if count > 0:
+                    count = 0
+                count -= 1
+            if count == period_len:
+                orders[i, j] = 1.0
+            elif count == -period_len:
+                orders[i, j] = -1.0
+            prev_price = price
+        state[0, j] = count
+        state[1, j] = prev_price
+
+
+def momentum_state(close2d):
+    '''_momentum_kernel state for a run that starts at close2d[0]'''
+    state = np.zeros((2, close2d.shape[1]))
+    if len(close2d):
+        state[1] = close2d[0]
+    return state
+
+
+def _momentum_numpy(close, period_len):
+    n, m = close.shape
+    move = np.zeros((n, m))
+    move[1:] = np.nan_to_num(np.sign(np.diff(close, axis=0)))
+    # running count: length of the current run of same-sign moves, carried
+    # over unchanged closes
+    orders = np.zeros((n, m))
+    for j in range(m):
+        idx = np.flatnonzero(move[:, j])
+        if len(idx) == 0:
+            continue
+        sign = move[idx, j]
+        run_start = np.r_[True, sign[1:] != sign[:-1]]
+        run_id = np.cumsum(run_start) - 1
+        starts = np.flatnonzero(run_start)
+        run_len = np.arange(len(idx)) - starts[run_id] + 1
+        count = np.zeros(n)
+        count[idx] = sign*run_len
+        # forward fill the count over unchanged closes
+        last = np.maximum.accumulate(np.where(move[:, j] != 0, np.arange(n), 0))
+        count = np.where(np.arange(n) >= idx[0], count[last], 0.0)
+        orders[count == period_len, j] = 1.0
+        orders[count == -period_len, j] = -1.0
+    return orders
+
+
+@probe('order')
+def momentum_orders(close, period_len):
+    close2d, squeeze = _as_2d(close)
+    if HAVE_NUMBA:
+        orders = np.zeros(close2d.shape)
+        _momentum_kernel(np.ascontiguousarray(close2d), period_len, orders, momentum_state(close2d))
+    else:
+        orders = _momentum_numpy(close2d, period_len)
+    return orders[:, 0] if squeeze else orders
+
+
+# turtle: enter on a window_entry breakout when flat, exit long/short when
+# the close crosses the window_exit mean
+
+@probe('indicator')
+def turtle_bands(close, window_entry, window_exit):
+    '''high/low/mean of the previous closes, like turtle_strat'''
+    prev = pd.DataFrame(close).shift(1)
+    high = prev.rolling(window=window_entry).max().to_numpy()
+    low = prev.rolling(window=window_entry).min().to_numpy()
+    mean = prev.rolling(window=window_exit).mean().to_numpy()
+    return high, low, mean
+
+
+@njit(cache=True, parallel=True)
+def _turtle_kernel(long_entry, short_entry, long_exit, short_exit, orders, positions):
+    '''positions: the position per column going in, updated on the way out'''
+    n, m = long_entry.shape
+    for j in prange(m):
+        pos = positions[j]
+        for i in range(n):
+            if long_entry[i, j] and pos == 0:
+                orders[i, j] = 1
+                pos = 1
+            elif short_entry[i, j] and pos == 0:
+                orders[i, j] = -1
+                pos = -1
+            elif long_exit[i, j] and pos == 1:
+                orders[i, j] = -1
+                pos = 0
+            elif short_exit[i, j] and pos == -1:
+                orders[i, j] = 1
+                pos = 0
+        positions[j] = pos
+
+
+def _next_true(mask):
+    '''index of the first True at or after each row (len if none), per column'''
+    n = mask.shape[0]
+    idx = np.where(mask, np.arange(n)[:, None], n)
+    return np.minimum.accumulate(idx[::-1], axis=0)[::-1]
+
+
+def _turtle_numpy(long_entry, short_entry, long_exit, short_exit):
+    n, m = long_entry.shape
+    orders = np.zeros((n, m), dtype=np.int64)
+    next_entry = _next_true(long_entry | short_entry)
+    next_long_exit = _next_true(long_exit)
+    next_short_exit = _next_true(short_exit)
+    for j in range(m):
+        i = next_entry[0, j] if n else 0
+        while i < n:
+            if long_entry[i, j]:
+                orders[i, j] = 1
+                exit_at = next_long_exit[i + 1, j] if i + 1 < n else n
+                if exit_at < n:
+                    orders[exit_at, j] = -1
+            else:
+                orders[i, j] = -1
+                exit_at = next_short_exit[i + 1, j] if i + 1 < n else n
+                if exit_at < n:
+                    orders[exit_at, j] = 1
+            i = next_entry[exit_at + 1, j] if exit_at + 1 < n else n
+    return orders
+
+
+@probe('order')
+def turtle_orders(close, window_entry, window_exit, bands=None):
+    '''orders (+1/-1/0) for every column of close. bands: precomputed
+    (high, low, mean) from turtle_bands'''
+    close2d, squeeze = _as_2d(close)
+    high, low, mean = bands if bands is not None else turtle_bands(close2d, window_entry, window_exit)
+    high, low, mean = (np.asarray(b).reshape(close2d.shape) for b in (high, low, mean))
+    long_entry = close2d > high
+    short_entry = close2d < low
+    long_exit = close2d < mean
+    short_exit = close2d > mean
+    if HAVE_NUMBA:
+        orders = np.zeros(close2d.shape, dtype=np.int64)
+        _turtle_kernel(long_entry, short_entry, long_exit, short_exit, orders,
+                       np.zeros(close2d.shape[1], dtype=np.int64))
+    else:
+        orders = _turtle_numpy(long_entry, short_entry, long_exit, short_exit)
+    return orders[:, 0] if squeeze else orders
@@ -0,0 +1,64 @@
+'''signal definitions from 6_basic_trading_strats.py, importable. The
+path-dependent ones (naive momentum, turtle) run their state machines in
+strat_kernels on plain arrays instead of writing signals['orders'][i]
+cell by cell'''
+
+import numpy as np
+import pandas as pd
+from instrument import probe
+from strat_kernels import momentum_orders, turtle_orders
+
+
+# buy when price decreases, sell when price increases (1_diff.py)
+@probe('signal')
+def diff_signal(price):
+    signals = pd.DataFrame(index=price.index)
+    signals['price'] = price
+    signals['daily_difference'] = signals['price'].diff()
+    signals['signal'] = np.where(signals['daily_difference'] > 0, 0.0, 1.0) # 0:sell, 1:buy
+    signals['positions'] = signals['signal'].diff()
+    return signals
+
+
+# doubla ma
+@probe('signal')
+def double_ma(data, short_window, long_window):
+    signals = pd.DataFrame(index=data.index)
+    signals['short_ma'] = data['Close'].rolling(window=short_window).mean()
+    signals['long_ma'] = data['Close'].rolling(window=long_window).mean()
+    signal = np.where(signals['short_ma'] > signals['long_ma'], 1.0, 0.0)
+    signal[:short_window] = 0.0
+    signals['signal'] = signal
+    signals['orders'] = signals['signal'].diff()
+    return signals
+
+
+# naive trading strategy
+@probe('signal')
+def naive_momentum_trading(data, period_len):
+    signals = pd.DataFrame(index=data.index)
+    signals['orders'] = momentum_orders(data['Close'].to_numpy(), period_len)
+    return signals
+
+
+# turtle strategy
+@probe('signal')
+def turtle_strat(data, window_entry, window_exit):
+    signals = pd.DataFrame(index=data.index)
+    signals['orders'] = 0
+    signals['high'] = data['Close'].shift(1).rolling(window=window_entry).max()
+    signals['low'] = data['Close'].shift(1).rolling(window=window_entry).min()
+    signals['mean'] = data['Close'].shift(1).rolling(window=window_exit).mean()
+
+    # entry: price > high for last [window] days
+    #        price < low for last [window] days
+    signals['long_entry'] = data['Close'] > signals['high']
+    signals['short_entry'] = data['Close'] < signals['low']
+
+    # exit: price crosses mean for last [window] days
+    signals['long_exit'] = data['Close'] < signals['mean']
+    signals['short_exit'] = data['Close'] > signals['mean']
+
+    bands = (signals['high'].to_numpy(), signals['low'].to_numpy(), signals['mean'].to_numpy())
+    signals['orders'] = turtle_orders(data['Close'].to_numpy(), window_entry, window_exit, bands=bands)
+    return signals
@@ -0,0 +1,143 @@
+'''O(n) support/resistance engine. Same bands and signals as the per-row loop
+that used to live in 2_sup_res.py: res/sup are the max/min of the last
+bin_width + 1 prices, bands are 0.2*(res - sup) thick, 3 bars in a band flips
+the signal (res: sell, sup: buy). The state machine is a compiled loop with
+numba (see jit.py), cumsums without it.'''
+
+import numpy as np
+import pandas as pd
+from instrument import probe
+from jit import njit, HAVE_NUMBA
+
+
+@probe('indicator')
+def rolling_sup_res(prices, bin_width=20):
+    '''rolling min/max over bin_width + 1 bars. pandas rolling min/max keeps a
+    monotonic deque so this is O(n) regardless of the window'''
+    s = pd.Series(np.asarray(prices, dtype=np.float64))
+    window = s.rolling(bin_width + 1)
+    return sup_res_bands(window.min().to_numpy(), window.max().to_numpy())
+
+
+def sup_res_bands(sup, res):
+    '''(sup, res, sup_tolerance, res_tolerance): the bands are 0.2 of the range'''
+    range_level = res - sup
+    res_tolerance = res - 0.2*range_level
+    sup_tolerance = sup + 0.2*range_level
+    return sup, res, sup_tolerance, res_tolerance
+
+
+@njit(cache=True)
+def _state_kernel(price, sup, res, sup_tolerance, res_tolerance, signal, counts,
+                  in_res, in_sup, in_resistance, in_support, signals):
+    '''signal and counts hold the carried state per column, updated in place.
+    Row by row, so a (time x symbols) panel is read in memory order'''
+    n, m = price.shape
+    for i in range(n):
+        for j in range(m):
+            p = price[i, j]
+            if p >= res_tolerance[i, j] and p <= res[i, j]:
+                in_res[i, j] = True
+                counts[0, j] += 1
+            elif p <= sup_tolerance[i, j] and p >= sup[i, j]:
+                in_sup[i, j] = True
+                counts[1, j] += 1
+            else:
+                counts[0, j] = 0
+                counts[1, j] = 0
+            if counts[0, j] > 2:
+                signal[j] = 0.0
+            elif counts[1, j] > 2:
+                signal[j] = 1.0
+            in_resistance[i, j] = counts[0, j]
+            in_support[i, j] = counts[1, j]
+            signals[i, j] = signal[j]
+
+
+def _state_machine_kernel(price, bands, signal_init, counts_init):
+    shape = price.shape
+    price, sup, res, sup_tolerance, res_tolerance = (
+        np.ascontiguousarray(np.asarray(a, dtype=np.float64).reshape(len(price), -1))
+        for a in (price,) + bands)
+    m = price.shape[1]
+    signal = np.array(np.broadcast_to(np.asarray(signal_init, dtype=np.float64), m))
+    counts = np.array([np.broadcast_to(np.asarray(c, dtype=np.int64), m) for c in counts_init])
+    in_res, in_sup = np.zeros(price.shape, dtype=bool), np.zeros(price.shape, dtype=bool)
+    in_resistance, in_support = np.zeros(price.shape, dtype=np.int64), np.zeros(price.shape, dtype=np.int64)
+    signals = np.empty(price.shape)
+    _state_kernel(price, sup, res, sup_tolerance, res_tolerance, signal, counts,
+                  in_res, in_sup, in_resistance, in_support, signals)
+    return tuple(a.reshape(shape) for a in (in_res, in_sup, in_resistance, in_support, signals))
+
+
+@probe('order')
+def sup_res_state_machine(price, sup, res, sup_tolerance, res_tolerance, signal_init=0.0,
+                          counts_init=(0, 0)):
+    '''in_resistance/in_support counters without a python loop. Both counters
+    only reset on a bar that is in neither band, so they are cumsums of their
+    band hits since the last such bar. signal_init is the signal and
+    counts_init the (resistance, support) counters carried into the first
+    bar. Inputs are series or (time x symbols) panels, run along axis 0;
+    the inits are scalars or one value per symbol'''
+    if HAVE_NUMBA:
+        return _state_machine_kernel(np.asarray(price), (sup, res, sup_tolerance, res_tolerance),
+                                     signal_init, counts_init)
+    in_res = (price >= res_tolerance) & (price <= res)
+    in_sup = ~in_res & (price <= sup_tolerance) & (price >= sup)
+    neither = ~(in_res | in_sup)
+
+    # the cumsums as of the last 'neither' bar, 0 before the first: they
+    # never decrease, so that is a running max of their values on those bars
+    res_cum = np.cumsum(in_res, axis=0)
+    sup_cum = np.cumsum(in_sup, axis=0)
+    res_base = np.maximum.accumulate(np.where(neither, res_cum, 0), axis=0)
+    sup_base = np.maximum.accumulate(np.where(neither, sup_cum, 0), axis=0)
+    first = ~np.logical_or.accumulate(neither, axis=0) # before the first reset
+    in_resistance = np.where(neither, 0, res_cum - res_base + np.where(first, counts_init[0], 0))
+    in_support = np.where(neither, 0, sup_cum - sup_base + np.where(first, counts_init[1], 0))
+
+    # 0: sell, 1: buy, otherwise carry the last signal forward
+    decided = np.where(in_resistance > 2, 0.0, np.where(in_support > 2, 1.0, np.nan))
+    init = np.broadcast_to(np.asarray(signal_init, dtype=np.float64), price.shape[1:])
+    carried = np.concatenate([init[None], decided]).reshape(len(price) + 1, -1)
+    signal = pd.DataFrame(carried).ffill().to_numpy()[1:].reshape(price.shape)
+    return in_res, in_sup, in_resistance, in_support, signal
+
+
+@probe('signal')
+def trading_support_resistance(data, bin_width=20):
+    '''drop-in for the loop version: adds the same columns to data in place'''
+    n = len(data)
+    # initialised like the loop did, so untouched warm-up cells match
+    # (zeros on a RangeIndex, NaN once aligned to a DatetimeIndex)
+    for col in ['sup_tolerance', 'res_tolerance', 'sup_count', 'res_count',
+                'sup', 'res', 'positions', 'signal']:
+        data[col] = pd.Series(np.zeros(n))
+    start = (bin_width - 1) + bin_width
+    if n <= start:
+        data['positions'] = data['signal'].diff()
+        return data
+
+    price = data['price'].to_numpy(dtype=np.float64)
+    sup, res, sup_tol, res_tol = rolling_sup_res(price, bin_width)
+    sup, res, sup_tol, res_tol, p = sup[start:], res[start:], sup_tol[start:], res_tol[start:], price[start:]
+    signal_init = data['signal'].to_numpy()[start - 1]
+    in_res, in_sup, in_resistance, in_support, signal = sup_res_state_machine(
+        p, sup, res, sup_tol, res_tol, signal_init)
+
+    idx = slice(start, n)
+    cols = {}
+    for col, values in [('res', res), ('sup', sup), ('res_tolerance', res_tol),
+                        ('sup_tolerance', sup_tol), ('signal', signal)]:
+        out = data[col].to_numpy(dtype=np.float64, copy=True)
+        out[idx] = values
+        cols[col] = out
+    # counts are only written on bars that hit the band
+    for col, hit, count in [('res_count', in_res, in_resistance), ('sup_count', in_sup, in_support)]:
+        out = data[col].to_numpy(dtype=np.float64, copy=True)
+        out[idx] = np.where(hit, count, out[idx])
+        cols[col] = out
+    for col, values in cols.items():
+        data[col] = values
+    data['positions'] = data['signal'].diff() # 1:sell, -1:buy
+    return data
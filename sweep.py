@@ -0,0 +1,199 @@
+'''grid / random parameter sweeps over a process pool.
+
+The close prices are loaded once in the parent and put in shared memory;
+workers attach to it instead of re-reading the pickle. Every finished
+combination is appended to the results csv straight away, so a crashed or
+interrupted sweep picks up where it stopped when rerun with the same --out
+(a --random one samples again with the seed kept in <out>.seed).
+
+usage:
+    python sweep.py double_ma short_window=5:60:5 long_window=50,100,150,200
+    python sweep.py apo num_periods_fast=5:20 std_basis=5,10,15,20 --random 50 --seed 1
+    python sweep.py turtle window_entry=20:100:10 window_exit=10:40:5 --rank pnl'''
+
+import argparse
+import csv
+import itertools
+import json
+import os
+import random
+from multiprocessing import Pool, shared_memory
+import numpy as np
+import pandas as pd
+from backtest import apo_backtest
+from strategies import double_ma, naive_momentum_trading, turtle_strat
+
+SRC_DATA_FILENAME = 'goog_data.pkl'
+TRADING_DAYS = 252
+RESULT_FIELDS = ['strategy', 'params', 'pnl', 'sharpe', 'trades']
+
+
+def curve_metrics(pnl_curve):
+    '''final pnl and annualised sharpe of the per-bar pnl changes'''
+    changes = np.diff(pnl_curve, prepend=0.0)
+    std = changes.std()
+    sharpe = changes.mean()/std*np.sqrt(TRADING_DAYS) if std > 0 else 0.0
+    return float(pnl_curve[-1]), float(sharpe)
+
+
+def orders_pnl(close, orders, shares=1):
+    '''pnl curve for +1/-1 orders filled at the close'''
+    position = np.cumsum(np.nan_to_num(orders))*shares
+    pnl = np.zeros(len(close))
+    pnl[1:] = np.cumsum(position[:-1]*np.diff(close))
+    return pnl
+
+
+def _run_signals(fn):
+    def run(close, **params):
+        orders = fn(pd.DataFrame({'Close': close}), **params)['orders'].to_numpy()
+        return orders_pnl(close, orders), int(np.count_nonzero(np.nan_to_num(orders)))
+    return run
+
+
+def _run_apo(close, **params):
+    results = apo_backtest(close, **params)
+    return results['pnl'] + results['open_pnl'], int(np.count_nonzero(results['orders']))
+
+
+STRATEGIES = {
+    'double_ma': _run_signals(double_ma),
+    'turtle': _run_signals(turtle_strat),
+    'naive_momentum': _run_signals(naive_momentum_trading),
+    'apo': _run_apo,
+}
+
+# worker side: the shared close array
+_shm = None
+_close = None
+
+
+def _attach(name, n):
+    global _shm, _close
+    _shm = shared_memory.SharedMemory(name=name)
+    _close = np.ndarray((n,), dtype=np.float64, buffer=_shm.buf)
+
+
+def _evaluate(task):
+    strategy, params = task
+    pnl_curve, trades = STRATEGIES[strategy](_close, **params)
+    pnl, sharpe = curve_metrics(pnl_curve)
+    return {'strategy': strategy, 'params': _key(params), 'pnl': pnl,
+            'sharpe': sharpe, 'trades': trades}
+
+
+def _key(params):
+    return json.dumps(params, sort_keys=True)
+
+
+def parse_values(spec):
+    '''"5,10,20" or "start:stop[:step]" (stop exclusive), ints or floats'''
+    def num(s):
+        return float(s) if any(c in s for c in '.eE') else int(s)
+    if ':' in spec:
+        parts = [num(p) for p in spec.split(':')]
+        return list(np.arange(*parts).tolist())
+    return [num(v) for v in spec.split(',')]
+
+
+def param_grid(space, n_random=None, seed=None):
+    names = list(space)
+    combos = [dict(zip(names, values)) for values in itertools.product(*space.values())]
+    if n_random is not None and n_random < len(combos):
+        combos = random.Random(seed).sample(combos, n_random)
+    return combos
+
+
+def sample_seed(out, seed=None):
+    '''the seed of a --random sweep, kept in <out>.seed so a resumed run
+    samples the same combos as the csv it appends to'''
+    path = out + '.seed'
+    if os.path.exists(out):
+        if os.path.exists(path):
+            with open(path) as f:
+                saved = int(f.read())
+            if seed is not None and seed != saved:
+                raise ValueError(f'{out} was sampled with --seed {saved}, not {seed}')
+            return saved
+        if seed is None:
+            raise ValueError(f'{out} has no {path}: pass the --seed it was sampled with to resume')
+    if seed is None:
+        seed = random.SystemRandom().randrange(2**32)
+    with open(path, 'w') as f:
+        f.write(f'{seed}\n')
+    return seed
+
+
+def load_done(out):
+    if not os.path.exists(out):
+        return set()
+    # a crash mid-write can leave a partial last row, drop it
+    with open(out, 'rb+') as f:
+        data = f.read()
+        if data and not data.endswith(b'\n'):
+            f.truncate(data.rfind(b'\n') + 1)
+    with open(out, newline='') as f:
+        return {(row['strategy'], row['params']) for row in csv.DictReader(f)}
+
+
+def run_sweep(close, strategy, combos, out, workers=None, chunksize=None):
+    '''evaluates the combos not already in out, appending rows as they finish'''
+    done = load_done(out)
+    tasks = [(strategy, p) for p in combos if (strategy, _key(p)) not in done]
+    if tasks:
+        close = np.ascontiguousarray(close, dtype=np.float64)
+        shm = shared_memory.SharedMemory(create=True, size=close.nbytes)
+        try:
+            np.ndarray(close.shape, dtype=close.dtype, buffer=shm.buf)[:] = close
+            workers = workers or os.cpu_count()
+            chunksize = chunksize or max(1, len(tasks)//(workers*8))
+            new_file = not os.path.exists(out)
+            with open(out, 'a', newline='') as f, \
+                    Pool(workers, initializer=_attach, initargs=(shm.name, len(close))) as pool:
+                writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+                if new_file:
+                    writer.writeheader()
+                for row in pool.imap_unordered(_evaluate, tasks, chunksize=chunksize):
+                    writer.writerow(row)
+                    f.flush()
+        finally:
+            shm.close()
+            shm.unlink()
+    return load_results(out, strategy)
+
+
+def load_results(out, strategy=None, rank='sharpe'):
+    results = pd.read_csv(out)
+    if strategy is not None:
+        results = results[results['strategy'] == strategy]
+    return results.sort_values(rank, ascending=False).reset_index(drop=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='parameter sweep')
+    parser.add_argument('strategy', choices=sorted(STRATEGIES))
+    parser.add_argument('params', nargs='+', help='name=v1,v2,... or name=start:stop[:step]')
+    parser.add_argument('--data', default=SRC_DATA_FILENAME)
+    parser.add_argument('--column', default='Close')
+    parser.add_argument('--out', default=None, help='results csv, reused to resume')
+    parser.add_argument('--random', type=int, default=None, help='sample this many combos (the seed is kept in <out>.seed)')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--rank', choices=['sharpe', 'pnl'], default='sharpe')
+    parser.add_argument('--top', type=int, default=20)
+    args = parser.parse_args()
+
+    space = {}
+    for p in args.params:
+        name, spec = p.split('=', 1)
+        space[name] = parse_values(spec)
+    out = args.out or f'sweep_{args.strategy}.csv'
+    seed = args.seed if args.random is None else sample_seed(out, args.seed)
+    combos = param_grid(space, args.random, seed)
+
+    close = pd.read_pickle(args.data)[args.column].to_numpy()
+    run_sweep(close, args.strategy, combos, out, workers=args.workers)
+    results = load_results(out, args.strategy, rank=args.rank)
+    pd.set_option('display.width', 1000)
+    pd.set_option('display.max_colwidth', 200)
+    print(results.head(args.top).to_string())
@@ -0,0 +1,165 @@
+'''batch versions of the 3_ta.py indicators for a whole universe at once.
+Input is a 2-D float array or a wide DataFrame with time along the rows and
+one column per symbol (pass x.T for a symbols x time array). Every kernel
+works on all columns together; DataFrames come back as DataFrames.
+
+warm-up follows the loops: the ema seeds with the first price (`ema == 0`),
+sma/rsi average whatever history exists, std is 0 for the first two bars.
+Leading NaNs (symbols that start trading later) are skipped, so each column
+warms up from its own first valid price. A NaN mid-series gives NaN on that
+bar; the ema carries its state over it, rolling windows count it as a bar.'''
+
+import numpy as np
+import pandas as pd
+from instrument import probe
+from jit import njit, HAVE_NUMBA
+
+
+def _as_frame(x):
+    if isinstance(x, pd.DataFrame):
+        return x.astype(np.float64), True
+    x = np.asarray(x, dtype=np.float64)
+    if x.ndim == 1:
+        x = x[:, None]
+    return pd.DataFrame(x), False
+
+
+def _out(values, like, is_frame):
+    if isinstance(values, pd.DataFrame):
+        values = values.to_numpy()
+    if is_frame:
+        return pd.DataFrame(values, index=like.index, columns=like.columns)
+    return values
+
+
+def _valid_count(a):
+    '''number of valid prices seen so far, per column'''
+    return np.cumsum(~np.isnan(a), axis=0)
+
+
+@njit(cache=True)
+def _ema_kernel(a, k, ema, out):
+    '''ema holds the state per column, updated in place. Row by row, so a
+    (time x symbols) panel is read in memory order'''
+    n, m = a.shape
+    for i in range(n):
+        for j in range(m):
+            price = a[i, j]
+            if price != price:
+                out[i, j] = np.nan
+                continue
+            if ema[j] == 0:
+                ema[j] = price
+            else:
+                ema[j] = ema[j] + (price - ema[j])*k[j]
+            out[i, j] = ema[j]
+
+
+def _ema_rows(a, k, ema=None):
+    '''the `ema == 0` recurrence from 3_ta.py, stepped over time with all
+    symbols updated together. k is a scalar or a per-column array; ema the
+    state to start from (zeros: seed with the first price)'''
+    ema = np.zeros(a.shape[1]) if ema is None else np.array(ema, dtype=np.float64)
+    if HAVE_NUMBA:
+        a = np.ascontiguousarray(a, dtype=np.float64)
+        k = np.ascontiguousarray(np.broadcast_to(np.asarray(k, dtype=np.float64), ema.shape))
+        out = np.empty_like(a)
+        _ema_kernel(a, k, ema, out)
+        return out
+    out = np.empty_like(a)
+    for i in range(a.shape[0]):
+        price = a[i]
+        valid = ~np.isnan(price)
+        step = ema + (price - ema)*k
+        ema = np.where(valid, np.where(ema == 0, price, step), ema)
+        out[i] = np.where(valid, ema, np.nan)
+    return out
+
+
+@probe('indicator')
+def sma(x, time_period=20):
+    df, is_frame = _as_frame(x)
+    values = df.rolling(time_period, min_periods=1).mean().to_numpy(copy=True)
+    values[np.isnan(df.to_numpy())] = np.nan
+    return _out(values, df, is_frame)
+
+
+@probe('indicator')
+def ema(x, time_period=20):
+    df, is_frame = _as_frame(x)
+    return _out(_ema_rows(df.to_numpy(), 2/(time_period + 1)), df, is_frame)
+
+
+@probe('indicator')
+def apo(x, time_period_fast=10, time_period_slow=40):
+    df, is_frame = _as_frame(x)
+    a = df.to_numpy()
+    values = _ema_rows(a, 2/(time_period_fast + 1)) - _ema_rows(a, 2/(time_period_slow + 1))
+    return _out(values, df, is_frame)
+
+
+@probe('indicator')
+def macd(x, time_period_fast=10, time_period_slow=40, time_period_macd=20):
+    '''returns (macd, signal, histogram)'''
+    df, is_frame = _as_frame(x)
+    macd_values = apo(df.to_numpy(), time_period_fast, time_period_slow)
+    signal = _ema_rows(macd_values, 2/(time_period_macd + 1))
+    histogram = macd_values - signal
+    return tuple(_out(v, df, is_frame) for v in (macd_values, signal, histogram))
+
+
+@probe('indicator')
+def std(x, time_period=20):
+    df, is_frame = _as_frame(x)
+    a = df.to_numpy()
+    values = df.rolling(time_period, min_periods=2).std().to_numpy(copy=True)
+    values[_valid_count(a) <= 2] = 0.0
+    values[np.isnan(a)] = np.nan
+    return _out(values, df, is_frame)
+
+
+@probe('indicator')
+def bollinger_bands(x, time_period=20, std_factor=2):
+    '''returns (sma, upper_band, lower_band)'''
+    df, is_frame = _as_frame(x)
+    mid = sma(df.to_numpy(), time_period)
+    dev = std(df.to_numpy(), time_period)
+    upper = mid + std_factor*dev
+    lower = mid - std_factor*dev
+    return tuple(_out(v, df, is_frame) for v in (mid, upper, lower))
+
+
+@probe('indicator')
+def rsi(x, time_period=20):
+    df, is_frame = _as_frame(x)
+    a = df.to_numpy()
+    valid = ~np.isnan(a)
+    # last valid price, so the first bar and bars after a gap diff against it
+    last = df.ffill().shift(1).to_numpy()
+    last = np.where(np.isnan(last), a, last)
+    gains = np.where(valid, np.maximum(0, a - last), np.nan)
+    losses = np.where(valid, np.maximum(0, last - a), np.nan)
+
+    avg_gains = pd.DataFrame(gains).rolling(time_period, min_periods=1).mean().to_numpy()
+    losses_df = pd.DataFrame(losses)
+    avg_losses = losses_df.rolling(time_period, min_periods=1).mean().to_numpy()
+    # count nonzero losses exactly, a float rolling sum can leave 1e-17 behind
+    any_losses = (losses_df > 0).astype(np.float64).where(valid).rolling(time_period, min_periods=1).sum().to_numpy() > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rs = np.where(any_losses, avg_gains/avg_losses, 0.0)
+    values = np.where(valid, 100 - 100/(1 + rs), np.nan)
+    return _out(values, df, is_frame)
+
+
+@probe('indicator')
+def mom(x, time_period=20):
+    '''price minus the price time_period - 1 bars back (or the first price
+    while warming up)'''
+    df, is_frame = _as_frame(x)
+    a = df.to_numpy()
+    valid = ~np.isnan(a)
+    first = np.argmax(valid, axis=0)
+    rows = np.arange(len(a))[:, None]
+    back = np.maximum(rows - (time_period - 1), first[None, :])
+    values = a - np.take_along_axis(a, back, axis=0)
+    return _out(values, df, is_frame)
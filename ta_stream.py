@@ -0,0 +1,239 @@
+'''streaming versions of the 3_ta.py indicators. One price per update(),
+O(1) per tick: windowed sums are compensated (Neumaier) and windowed
+variance uses rolling Welford, so the numbers track the stats.mean /
+stats.stdev loops to float precision without re-reading the window.
+
+chaining: MACD wraps an APO, BollingerBands wraps an SMA and a StdDev.
+checkpoint() returns a plain dict of the state, restore() loads it back.'''
+
+import math
+from collections import deque
+
+
+class Indicator:
+    __slots__ = ()
+
+    def update(self, price):
+        raise NotImplementedError
+
+    def update_many(self, prices):
+        return [self.update(p) for p in prices]
+
+    def _slot_names(self):
+        for cls in type(self).__mro__:
+            for name in getattr(cls, '__slots__', ()):
+                yield name
+
+    def checkpoint(self):
+        state = {}
+        for name in self._slot_names():
+            value = getattr(self, name)
+            if isinstance(value, Indicator):
+                value = value.checkpoint()
+            elif isinstance(value, deque):
+                value = list(value)
+            state[name] = value
+        return state
+
+    def restore(self, state):
+        for name in self._slot_names():
+            current = getattr(self, name)
+            value = state[name]
+            if isinstance(current, Indicator):
+                current.restore(value)
+            elif isinstance(current, deque):
+                setattr(self, name, deque(value, maxlen=current.maxlen))
+            else:
+                setattr(self, name, value)
+        return self
+
+
+class RollingSum(Indicator):
+    '''compensated running sum over the last `period` values'''
+    __slots__ = ('period', 'window', 'total', 'comp', 'nonzero')
+
+    def __init__(self, period):
+        self.period = period
+        self.window = deque(maxlen=period)
+        self.total = 0.0
+        self.comp = 0.0
+        self.nonzero = 0 # so an all-zero window sums to exactly 0
+
+    def _add(self, x):
+        t = self.total + x
+        if abs(self.total) >= abs(x):
+            self.comp += (self.total - t) + x
+        else:
+            self.comp += (x - t) + self.total
+        self.total = t
+
+    def update(self, x):
+        if len(self.window) == self.period:
+            old = self.window[0]
+            self._add(-old)
+            if old != 0:
+                self.nonzero -= 1
+        self.window.append(x)
+        self._add(x)
+        if x != 0:
+            self.nonzero += 1
+        return self.value
+
+    @property
+    def value(self):
+        if self.nonzero == 0:
+            self.total = self.comp = 0.0
+        return self.total + self.comp
+
+
+class SMA(Indicator):
+    __slots__ = ('sum', 'value')
+
+    def __init__(self, time_period=20):
+        self.sum = RollingSum(time_period)
+        self.value = 0.0
+
+    def update(self, price):
+        self.value = self.sum.update(price)/len(self.sum.window)
+        return self.value
+
+
+class EMA(Indicator):
+    '''seeded with the first price, as the loops do with `ema == 0`'''
+    __slots__ = ('k', 'value')
+
+    def __init__(self, time_period=20):
+        self.k = 2/(time_period + 1)
+        self.value = 0
+
+    def update(self, price):
+        if self.value == 0: # first ema
+            self.value = price
+        else:
+            self.value = self.value + (price - self.value)*self.k
+        return self.value
+
+
+class APO(Indicator):
+    __slots__ = ('fast', 'slow', 'value')
+
+    def __init__(self, time_period_fast=10, time_period_slow=40):
+        self.fast = EMA(time_period_fast)
+        self.slow = EMA(time_period_slow)
+        self.value = 0.0
+
+    def update(self, price):
+        self.value = self.fast.update(price) - self.slow.update(price)
+        return self.value
+
+
+class MACD(Indicator):
+    '''returns (macd, signal, histogram). macd is the wrapped APO'''
+    __slots__ = ('apo', 'signal', 'macd', 'histogram')
+
+    def __init__(self, time_period_fast=10, time_period_slow=40, time_period_macd=20, apo=None):
+        self.apo = apo if apo is not None else APO(time_period_fast, time_period_slow)
+        self.signal = EMA(time_period_macd)
+        self.macd = 0.0
+        self.histogram = 0.0
+
+    def update(self, price):
+        self.macd = self.apo.update(price)
+        signal = self.signal.update(self.macd)
+        self.histogram = self.macd - signal
+        return self.macd, signal, self.histogram
+
+
+class StdDev(Indicator):
+    '''sample stdev of the last `time_period` prices, 0 for the first two
+    bars like the loop. Rolling Welford: mean and m2 are updated for the
+    value leaving and entering the window'''
+    __slots__ = ('window', 'mean', 'm2', 'count', 'value')
+
+    def __init__(self, time_period=20):
+        self.window = deque(maxlen=time_period)
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.count = 0
+        self.value = 0.0
+
+    def update(self, price):
+        n = len(self.window)
+        if n == self.window.maxlen:
+            old = self.window[0]
+            old_mean = self.mean
+            self.mean += (price - old)/n
+            self.m2 += (price - old)*(price - self.mean + old - old_mean)
+        else:
+            n += 1
+            delta = price - self.mean
+            self.mean += delta/n
+            self.m2 += delta*(price - self.mean)
+        self.window.append(price)
+        self.count += 1
+
+        if self.count <= 2:
+            self.value = 0.0
+        else:
+            self.value = math.sqrt(max(self.m2, 0.0)/(len(self.window) - 1))
+        return self.value
+
+
+class BollingerBands(Indicator):
+    '''returns (sma, upper_band, lower_band)'''
+    __slots__ = ('sma', 'std', 'std_factor', 'upper', 'lower')
+
+    def __init__(self, time_period=20, std_factor=2, sma=None, std=None):
+        self.sma = sma if sma is not None else SMA(time_period)
+        self.std = std if std is not None else StdDev(time_period)
+        self.std_factor = std_factor
+        self.upper = 0.0
+        self.lower = 0.0
+
+    def update(self, price):
+        sma = self.sma.update(price)
+        std = self.std.update(price)
+        self.upper = sma + self.std_factor*std
+        self.lower = sma - self.std_factor*std
+        return sma, self.upper, self.lower
+
+
+class RSI(Indicator):
+    __slots__ = ('gains', 'losses', 'last_price', 'value')
+
+    def __init__(self, time_period=20):
+        self.gains = RollingSum(time_period)
+        self.losses = RollingSum(time_period)
+        self.last_price = 0
+        self.value = 0.0
+
+    def update(self, price):
+        if self.last_price == 0:
+            self.last_price = price
+        self.gains.update(max(0, price - self.last_price))
+        self.losses.update(max(0, self.last_price - price))
+        self.last_price = price
+
+        n = len(self.gains.window)
+        avg_gains = self.gains.value/n
+        avg_losses = self.losses.value/n
+        if avg_losses == 0:
+            rs = 0
+        else:
+            rs = avg_gains/avg_losses
+        self.value = 100 - 100/(1 + rs)
+        return self.value
+
+
+class Momentum(Indicator):
+    '''price minus the oldest price in the window'''
+    __slots__ = ('window', 'value')
+
+    def __init__(self, time_period=20):
+        self.window = deque(maxlen=time_period)
+        self.value = 0.0
+
+    def update(self, price):
+        self.window.append(price)
+        self.value = price - self.window[0]
+        return self.value
@@ -0,0 +1,70 @@
+'''vectorized signal -> portfolio accounting, the 1_diff.py backtest for many
+symbols and many signal variants at once.
+
+signals are target holdings in units of `shares` per symbol, shaped
+(time, symbols) like the prices, or (variants, time, symbols) to run a
+whole batch of signal variants against the same prices in one pass. Every
+step is an array op along the time axis, there is no per-bar loop.
+
+costs: commission is a fraction of traded value, cost_per_share a fixed
+amount per share traded, slippage moves the fill price against the trade
+by that fraction.'''
+
+import numpy as np
+import pandas as pd
+from instrument import probe
+
+
+@probe('pnl')
+def backtest_signals(prices, signals, initial_capital=1000.0, shares=1,
+                     commission=0.0, cost_per_share=0.0, slippage=0.0):
+    '''returns a dict with, per variant:
+        positions  (.., time, symbols) shares held
+        holdings   (.., time, symbols) market value of the positions
+        trades     (.., time, symbols) shares bought (+) / sold (-) on the bar
+        costs      (.., time) commission + slippage paid on the bar
+        cash       (.., time)
+        total      (.., time) cash + holdings, the equity curve
+    DataFrame prices with 2-D signals give DataFrames/Series back.'''
+    frame = isinstance(prices, pd.DataFrame)
+    if frame:
+        index, columns = prices.index, prices.columns
+        signals = signals.reindex(index=index, columns=columns) if isinstance(signals, pd.DataFrame) else signals
+    price = np.asarray(prices, dtype=np.float64)
+    signal = np.asarray(signals, dtype=np.float64)
+    if price.ndim == 1:
+        price = price[:, None]
+        signal = signal[..., None]
+
+    # value positions at the last known price, no position before the first one
+    price = pd.DataFrame(price).ffill().to_numpy()
+    tradable = ~np.isnan(price)
+    price = np.where(tradable, price, 0.0)
+
+    positions = np.where(tradable, np.nan_to_num(signal), 0.0)*shares
+    trades = np.diff(positions, axis=-2, prepend=0.0)
+    traded_value = np.abs(trades)*price
+    costs = (traded_value*(commission + slippage) + np.abs(trades)*cost_per_share).sum(axis=-1)
+    cash = initial_capital - np.cumsum((trades*price).sum(axis=-1) + costs, axis=-1)
+    holdings = positions*price
+    total = cash + holdings.sum(axis=-1)
+
+    results = {'positions': positions, 'holdings': holdings, 'trades': trades,
+               'costs': costs, 'cash': cash, 'total': total}
+    if frame and positions.ndim == 2:
+        for k in ('positions', 'holdings', 'trades'):
+            results[k] = pd.DataFrame(results[k], index=index, columns=columns)
+        for k in ('costs', 'cash', 'total'):
+            results[k] = pd.Series(results[k], index=index, name=k)
+    return results
+
+
+def portfolio_frame(results):
+    '''1_diff.py style portfolio table for a single variant'''
+    holdings = results['holdings']
+    return pd.DataFrame({
+        'positions': holdings.sum(axis=1) if isinstance(holdings, pd.DataFrame) else holdings.sum(axis=-1),
+        'cash': results['cash'],
+        'costs': results['costs'],
+        'total': results['total'],
+    })
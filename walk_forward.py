@@ -0,0 +1,256 @@
+'''walk-forward training for the 5_basic_ma.py models.
+
+The feature matrix is built once (ml_features.feature_arrays), cached in
+.feature_cache/ keyed on the input bars, and put in shared memory for the
+workers. Windows are rolling (fixed train length) or expanding, each one
+tested on the next `test` rows and moved forward by `step` (default test).
+
+linear and ridge keep running sums (n, sum x, sum y, X'X, X'y) and only add
+the rows entering the window and remove the rows leaving it; lasso warm
+starts from the previous window's coefficients; knn and svc refit. The
+windows are split into contiguous chunks, one pool task per (model, chunk),
+so an incremental model rebuilds its sums once per chunk.
+
+usage: python walk_forward.py [--train 500] [--test 100] [--expanding]
+                              [--models linear,ridge,lasso,knn,svc] [--out wf.csv]'''
+
+import argparse
+import hashlib
+import os
+from multiprocessing import Pool, shared_memory
+import numpy as np
+import pandas as pd
+from ml_features import feature_arrays
+
+SRC_DATA_FILENAME = 'goog_data.pkl'
+FEATURE_CACHE_DIR = '.feature_cache'
+
+
+def cached_features(df, cache_dir=FEATURE_CACHE_DIR):
+    '''feature_arrays(df), read from the cache when these bars were seen before'''
+    bars = df[['Open', 'High', 'Low', 'Close']]
+    digest = hashlib.sha1(pd.util.hash_pandas_object(bars).to_numpy().tobytes()).hexdigest()[:16]
+    path = os.path.join(cache_dir, digest + '.npz')
+    if os.path.exists(path):
+        with np.load(path) as f:
+            return {k: f[k] for k in f.files}
+    arrays = feature_arrays(bars)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = path + '.tmp.npz'
+    np.savez(tmp, **arrays)
+    os.replace(tmp, path)
+    return arrays
+
+
+def windows(n, train, test, step=None, expanding=False):
+    '''(train_lo, train_hi, test_hi) row bounds; test rows are [train_hi, test_hi)'''
+    step = step or test
+    out = []
+    start = train
+    while start < n:
+        out.append((0 if expanding else start - train, start, min(start + test, n)))
+        start += step
+    return out
+
+
+class LinearStats:
+    '''running sums for least squares with an intercept. Rows are shifted
+    by a fixed offset before accumulating to keep the sums well scaled'''
+
+    def __init__(self, x_shift, y_shift):
+        k = len(x_shift)
+        self.x_shift = np.asarray(x_shift, dtype=np.float64)
+        self.y_shift = float(y_shift)
+        self.n = 0
+        self.sx = np.zeros(k)
+        self.sy = 0.0
+        self.sxx = np.zeros((k, k))
+        self.sxy = np.zeros(k)
+
+    def add(self, x, y, sign=1):
+        x = x - self.x_shift
+        y = y - self.y_shift
+        self.n += sign*len(x)
+        self.sx += sign*x.sum(axis=0)
+        self.sy += sign*y.sum()
+        self.sxx += sign*(x.T @ x)
+        self.sxy += sign*(x.T @ y)
+
+    def remove(self, x, y):
+        self.add(x, y, sign=-1)
+
+    def solve(self, alpha=0.0):
+        '''(coef, intercept) of ridge regression, alpha=0 is ordinary least
+        squares. The intercept is not penalised, like sklearn'''
+        mx = self.sx/self.n
+        my = self.sy/self.n
+        cxx = self.sxx - self.n*np.outer(mx, mx) + alpha*np.eye(len(mx))
+        cxy = self.sxy - self.n*mx*my
+        coef = np.linalg.lstsq(cxx, cxy, rcond=None)[0]
+        intercept = my + self.y_shift - (mx + self.x_shift) @ coef
+        return coef, intercept
+
+
+class IncrementalLinear:
+    kind = 'reg'
+
+    def __init__(self, alpha=0.0):
+        self.alpha = alpha
+        self.stats = None
+        self.lo = self.hi = 0
+
+    def fit_window(self, x, y, lo, hi):
+        if self.stats is None or lo < self.lo or hi < self.hi or lo >= self.hi:
+            self.stats = LinearStats(x[lo:hi].mean(axis=0), y[lo:hi].mean())
+            self.stats.add(x[lo:hi], y[lo:hi])
+        else:
+            self.stats.add(x[self.hi:hi], y[self.hi:hi])
+            self.stats.remove(x[self.lo:lo], y[self.lo:lo])
+        self.lo, self.hi = lo, hi
+        self.coef_, self.intercept_ = self.stats.solve(self.alpha)
+
+    def predict(self, x):
+        return x @ self.coef_ + self.intercept_
+
+
+def _sklearn(module, name, **params):
+    def make():
+        import importlib # sklearn is slow to import, only when a model needs it
+        return getattr(importlib.import_module('sklearn.' + module), name)(**params)
+    return make
+
+
+class Refit:
+    '''sklearn estimator fitted on every window. warm: keep one estimator so
+    warm_start models begin from the previous window's solution'''
+
+    def __init__(self, kind, make, warm=False):
+        self.kind = kind
+        self.make = make
+        self.warm = warm
+        self.model = None
+
+    def fit_window(self, x, y, lo, hi):
+        if self.model is None or not self.warm:
+            self.model = self.make()
+        self.model.fit(x[lo:hi], y[lo:hi])
+
+    def predict(self, x):
+        return self.model.predict(x)
+
+
+# same settings as 5_basic_ma.py
+MODELS = {
+    'linear': lambda: IncrementalLinear(),
+    'ridge': lambda: IncrementalLinear(alpha=1e5),
+    'lasso': lambda: Refit('reg', _sklearn('linear_model', 'Lasso', alpha=0.1, warm_start=True), warm=True),
+    'knn': lambda: Refit('cls', _sklearn('neighbors', 'KNeighborsClassifier', n_neighbors=15)),
+    'svc': lambda: Refit('cls', _sklearn('svm', 'SVC')),
+}
+
+
+def _mse_r2(y, y_hat):
+    sse = float(((y - y_hat)**2).sum())
+    sst = float(((y - y.mean())**2).sum())
+    return sse/len(y), (1 - sse/sst if sst > 0 else np.nan)
+
+
+def run_chunk(name, chunk, x, y_reg, y_cls):
+    '''fits one model over consecutive windows, one metrics row per window'''
+    model = MODELS[name]()
+    y = y_reg if model.kind == 'reg' else y_cls
+    rows = []
+    for lo, hi, test_hi in chunk:
+        model.fit_window(x, y, lo, hi)
+        row = {'model': name, 'train_start': lo, 'train_end': hi, 'test_end': test_hi,
+               'n_train': hi - lo, 'n_test': test_hi - hi}
+        fit_hat = model.predict(x[lo:hi])
+        test_hat = model.predict(x[hi:test_hi])
+        if model.kind == 'reg':
+            row['mse_train'], row['r2_train'] = _mse_r2(y[lo:hi], fit_hat)
+            row['mse_test'], row['r2_test'] = _mse_r2(y[hi:test_hi], test_hat)
+        else:
+            row['acc_train'] = float((fit_hat == y[lo:hi]).mean())
+            row['acc_test'] = float((test_hat == y[hi:test_hi]).mean())
+        rows.append(row)
+    return rows
+
+
+# worker side: the shared (rows, features + 2) matrix
+_shm = None
+_data = None
+
+
+def _attach(name, shape):
+    global _shm, _data
+    _shm = shared_memory.SharedMemory(name=name)
+    _data = np.ndarray(shape, dtype=np.float64, buffer=_shm.buf)
+
+
+def _split(data):
+    return data[:, :-2], data[:, -2], data[:, -1]
+
+
+def _evaluate(task):
+    name, chunk = task
+    return run_chunk(name, chunk, *_split(_data))
+
+
+def walk_forward(df, train=500, test=100, step=None, expanding=False,
+                 models=('linear', 'ridge', 'lasso', 'knn', 'svc'), workers=None,
+                 cache_dir=FEATURE_CACHE_DIR):
+    '''per-window metrics table for the models, indexed like df'''
+    features = cached_features(df, cache_dir)
+    data = np.column_stack([features['x'], features['y_reg'], features['y_cls']])
+    wins = windows(len(data), train, test, step, expanding)
+    if not wins:
+        raise ValueError(f'no walk-forward window: train={train} needs more than the {len(data)} '
+                         f'feature rows available (test={test})')
+    workers = workers or os.cpu_count()
+    n_chunks = max(1, min(workers, len(wins)))
+    tasks = [(name, [tuple(w) for w in chunk]) for name in models
+             for chunk in np.array_split(np.array(wins, dtype=np.int64), n_chunks) if len(chunk)]
+
+    rows = []
+    if workers == 1:
+        for name, chunk in tasks:
+            rows.extend(run_chunk(name, chunk, *_split(data)))
+    else:
+        shm = shared_memory.SharedMemory(create=True, size=data.nbytes)
+        try:
+            np.ndarray(data.shape, dtype=data.dtype, buffer=shm.buf)[:] = data
+            with Pool(workers, initializer=_attach, initargs=(shm.name, data.shape)) as pool:
+                for chunk_rows in pool.imap_unordered(_evaluate, tasks):
+                    rows.extend(chunk_rows)
+        finally:
+            shm.close()
+            shm.unlink()
+
+    table = pd.DataFrame(rows).sort_values(['model', 'train_end']).reset_index(drop=True)
+    dates = pd.to_datetime(features['index'])
+    last = len(dates) - 1
+    table.insert(1, 'train_from', dates[table['train_start']])
+    table.insert(2, 'test_from', dates[table['train_end']])
+    table.insert(3, 'test_to', dates[np.minimum(table['test_end'] - 1, last)])
+    return table
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='walk-forward model training')
+    parser.add_argument('--data', default=SRC_DATA_FILENAME)
+    parser.add_argument('--train', type=int, default=500, help='train rows (first window when expanding)')
+    parser.add_argument('--test', type=int, default=100)
+    parser.add_argument('--step', type=int, default=None)
+    parser.add_argument('--expanding', action='store_true')
+    parser.add_argument('--models', default=','.join(MODELS))
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--out', default=None, help='write the table to this csv')
+    args = parser.parse_args()
+
+    table = walk_forward(pd.read_pickle(args.data), args.train, args.test, args.step,
+                         args.expanding, args.models.split(','), args.workers)
+    pd.set_option('display.width', 1000)
+    pd.set_option('display.max_columns', 50)
+    print(table.to_string())
+    if args.out:
+        table.to_csv(args.out, index=False)